@@ -0,0 +1,60 @@
+"""
+compares build_stats_df with the Series.apply(pd.Series) implementation it replaced
+usage: python -m benchmarks.bench_build_stats [n_events]
+"""
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_events
+from src.fetch_data.table_builders import build_stats_df
+
+
+def legacy_build_stats_df(events_df: pd.DataFrame) -> pd.DataFrame:
+    stats_df = events_df[["id", "stats"]].copy()
+    stats_df = stats_df.rename(columns={"id": "event_id"})
+    stats_df = pd.concat(
+        [stats_df.drop(["stats"], axis=1), stats_df["stats"].apply(pd.Series)], axis=1
+    )
+    stats_df = stats_df[
+        [
+            "event_id",
+            "average_price",
+            "lowest_price",
+            "highest_price",
+            "median_price",
+            "listing_count",
+            "visible_listing_count",
+        ]
+    ]
+    stats_df["utc_read_time"] = pd.to_datetime("now").round("min")
+    stats_df = stats_df.dropna()
+    return stats_df
+
+
+def timed(func, events: pd.DataFrame):
+    start = time.perf_counter()
+    result = func(events)
+    return result, time.perf_counter() - start
+
+
+def main(n: int = 100_000):
+    events = generate_events(n)
+    legacy, legacy_time = timed(legacy_build_stats_df, events)
+    current, current_time = timed(build_stats_df, events)
+    pd.testing.assert_frame_equal(
+        current.drop(columns="utc_read_time"),
+        legacy.drop(columns="utc_read_time"),
+        check_exact=True,
+        # apply(pd.Series) infers int64 or float64 per payload, values are compared exactly
+        check_dtype=False,
+    )
+    print(f"events: {n}")
+    print(f"apply(pd.Series): {legacy_time:.3f}s")
+    print(f"extract_stats:    {current_time:.3f}s")
+    print(f"speedup:          {legacy_time / current_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,43 @@
+"""
+compares rows/sec of the stat bulk writers against a local sqlite file
+usage: python -m benchmarks.bench_stat_writers [n_rows]
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from benchmarks.synthetic import generate_stat_rows
+import src.fetch_data.db as db
+
+
+def write_to_sql(df: pd.DataFrame, engine, table_name: str) -> int:
+    """the writer push_to_db used before the bulk writers"""
+    df.to_sql(table_name, engine, if_exists="append", index=False, chunksize=10000)
+    return len(df)
+
+
+def main(n: int = 200_000):
+    stats = generate_stat_rows(np.arange(5_000_000, 5_000_000 + n))
+    writers = {"to_sql (previous)": write_to_sql}
+    writers.update({name: db.STAT_WRITERS[name] for name in ("multi", "executemany")})
+    print(f"rows: {n}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, writer in writers.items():
+            engine = create_engine(f"sqlite:///{Path(tmp) / (name.split()[0] + '.db')}")
+            start = time.perf_counter()
+            writer(stats, engine, db.STAT_TABLE)
+            elapsed = time.perf_counter() - start
+            stored = pd.read_sql(f"SELECT COUNT(*) AS n FROM {db.STAT_TABLE}", engine).n[0]
+            assert stored == n
+            print(f"{name:<18} {n / elapsed:>12,.0f} rows/s")
+            engine.dispose()
+    print("load_data needs a mysql server and is not measured here")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,83 @@
+"""
+compares DataPlotter.stats_info_view with the row-wise implementation it replaced
+usage: python -m benchmarks.bench_stats_info_view [n_events] [reads_per_event]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_stat_rows
+from src.analysis import analysis_scripts
+from src.analysis.analysis_scripts import DataPlotter
+from src.fetch_data import SlugReq
+
+
+class LocalEntities:
+    """answers get_by_id from in-memory tables so only the view itself is timed"""
+    def __init__(self, venues: pd.DataFrame, performers: pd.DataFrame):
+        self.tables = {'venues': venues, 'performers': performers}
+
+    def get_by_id(self, kind, ids):
+        table = self.tables[kind]
+        return table.loc[table.id.isin([int(i) for i in ids])]
+
+
+def legacy_stats_info_view(self, slug):
+    slug = SlugReq(slug={'performer': slug})
+    stats = self.get_stats_by_slug(slug)
+    stats_joined = stats.merge(self.get_ids_by_slug(slug), on='event_id')
+    client = analysis_scripts.get_client()
+    venues = client.get_by_id(
+        'venues', stats_joined.venue_id.unique().astype(str)
+    )[['id', 'slug']].rename(columns={'slug': 'venue_slug'})
+    stats_joined = stats_joined.merge(venues, left_on='venue_id', right_on='id').drop(columns='id')
+    performers = client.get_by_id(
+        'performers', stats_joined.performer_id.unique().astype(str)
+    )[['id', 'slug']].rename(columns={'slug': 'performer_slug'})
+    stats_joined = stats_joined.merge(performers, left_on='performer_id', right_on='id').drop(columns='id')
+    stats_joined['title'] = stats_joined.apply(
+        lambda x: f'{x.performer_slug},{x.venue_slug},{x.datetime_utc}', axis=1)
+    return stats_joined
+
+
+def synthetic_plotter(n_events: int, reads: int, seed: int = 0) -> DataPlotter:
+    rng = np.random.default_rng(seed)
+    event_ids = np.arange(1, n_events + 1)
+    venue_ids = rng.integers(1, 200, size=n_events)
+    pev = pd.DataFrame(
+        {
+            'event_id': event_ids,
+            'venue_id': venue_ids,
+            'datetime_utc': pd.date_range('2030-01-01', periods=n_events, freq='h').astype(str),
+            'performer_id': 1,
+        }
+    )
+    stat = generate_stat_rows(event_ids, reads, seed, start='2029-01-01')
+    performers = pd.DataFrame({'id': [1], 'name': ['Performer'], 'slug': ['performer']})
+    venues = pd.DataFrame({'id': np.arange(1, 200), 'slug': [f'venue-{i}' for i in range(1, 200)]})
+    analysis_scripts._client = LocalEntities(venues, performers)
+    return DataPlotter(pd.DataFrame(), performers, stat, pev, venues)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main(n_events: int = 500, reads: int = 400):
+    plotter = synthetic_plotter(n_events, reads)
+    legacy, legacy_time = timed(lambda: legacy_stats_info_view(plotter, 'performer'))
+    current, current_time = timed(lambda: plotter.stats_info_view('performer'))
+    assert (legacy.title.values == current.title.astype(str).values).all()
+    print(f"stat rows:     {len(current)}")
+    print(f"row-wise view: {legacy_time:.3f}s")
+    print(f"joined view:   {current_time:.3f}s")
+    print(f"speedup:       {legacy_time / current_time:.1f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,186 @@
+"""
+times the table builders, push_to_db against sqlite and the slug/id query methods
+on synthetic payloads, records time and peak traced memory per case and compares
+them with a stored baseline
+usage: python -m benchmarks.bench_table_builders [--sizes 1k 10k 100k 1m] [--save-baseline]
+exits with status 1 when a case regressed past the tolerance
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from benchmarks.synthetic import SIZES, generate_events
+from src.fetch_data import ForeignKey, SeatgeekData, SlugReq
+from src.fetch_data.table_builders import (
+    build_df_from_series_of_dicts,
+    build_performer_events_df,
+    build_stats_df,
+    get_event_venue_ids,
+)
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_SIZES = ["1k", "10k", "100k"]
+# slower or larger than baseline by more than this share is a regression
+TOLERANCE = 0.25
+# differences below these are noise
+MIN_SECONDS_DELTA = 0.01
+MIN_BYTES_DELTA = 1 << 20
+QUERIES = 100
+
+
+def performers_of(events: pd.DataFrame) -> pd.DataFrame:
+    return build_df_from_series_of_dicts(events["performers"].explode()).drop_duplicates(subset=["id"])
+
+
+def with_venue_ids(events: pd.DataFrame) -> pd.DataFrame:
+    return events.assign(venue_id=get_event_venue_ids(events).values)
+
+
+def run_queries(data: SeatgeekData) -> int:
+    """slug and id lookups on a fresh SeatgeekData, index builds included"""
+    slugs = data.performer["slug"].head(QUERIES)
+    names = data.performer["name"].head(QUERIES)
+    rows = 0
+    for slug, name in zip(slugs, names):
+        query = SlugReq(slug={"performer": slug})
+        rows += len(data.get_stats_by_slug(query))
+        ids = data.get_ids_by_slug(query)
+        rows += len(data.get_pev_by_id(ForeignKey(fk={"performer_id": int(ids["performer_id"].iloc[0])})))
+        rows += len(data.get_performer_stats(name))
+    return rows
+
+
+def push(data: SeatgeekData, directory: str) -> None:
+    engine = create_engine(f"sqlite:///{Path(tempfile.mkdtemp(dir=directory)) / 'bench.db'}")
+    data.push_to_db(engine)
+    engine.dispose()
+
+
+# case -> (setup(events, tmp_dir) -> args, function(*args))
+CASES: typing.Dict[str, typing.Tuple[typing.Callable, typing.Callable]] = {
+    "build_stats_df": (lambda events, tmp: (events,), build_stats_df),
+    "get_event_venue_ids": (lambda events, tmp: (events,), get_event_venue_ids),
+    "build_performer_events_df": (lambda events, tmp: (with_venue_ids(events),), build_performer_events_df),
+    "_build_tables": (lambda events, tmp: (events.copy(), performers_of(events)), SeatgeekData._build_tables),
+    "push_to_db": (
+        lambda events, tmp: (SeatgeekData._build_tables(events.copy(), performers_of(events)), tmp),
+        push,
+    ),
+    "slug_and_id_queries": (
+        lambda events, tmp: (SeatgeekData._build_tables(events.copy(), performers_of(events)),),
+        run_queries,
+    ),
+}
+
+
+def measure(setup: typing.Callable, function: typing.Callable, events: pd.DataFrame, tmp: str, repeat: int) -> dict:
+    """
+    returns the best wall time over repeat runs and the peak traced memory of one more run
+    :param setup:
+    :param function:
+    :param events:
+    :param tmp:
+    :param repeat:
+    :return:
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup(events, tmp)
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    args = setup(events, tmp)
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(min(times), 4), "peak_bytes": peak}
+
+
+def run_suite(sizes: typing.List[str], cases: typing.Optional[typing.List[str]] = None) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            n = SIZES[size]
+            events = generate_events(n)
+            repeat = 3 if n <= 10_000 else 1
+            results[size] = {}
+            for name in cases or CASES:
+                setup, function = CASES[name]
+                results[size][name] = measure(setup, function, events, tmp, repeat)
+                print(f"{size:>5} {name:<26} {results[size][name]['seconds']:>9.4f}s "
+                      f"{results[size][name]['peak_bytes'] / 2 ** 20:>9.1f} MiB", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> typing.List[str]:
+    """
+    returns a line per case that is slower or uses more memory than its baseline beyond tolerance
+    :param results:
+    :param baseline:
+    :param tolerance:
+    :return:
+    """
+    regressions = []
+    for size, cases in results.items():
+        for name, current in cases.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None:
+                continue
+            for metric, min_delta in (("seconds", MIN_SECONDS_DELTA), ("peak_bytes", MIN_BYTES_DELTA)):
+                before, after = previous[metric], current[metric]
+                if after > before * (1 + tolerance) and after - before > min_delta:
+                    regressions.append(f"{size} {name} {metric}: {before} -> {after} (+{after / before - 1:.0%})")
+    return regressions
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("usage")[0])
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, choices=list(SIZES))
+    parser.add_argument("--cases", nargs="+", choices=list(CASES))
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.cases)
+    if args.save_baseline:
+        stored = json.loads(args.baseline.read_text())["results"] if args.baseline.exists() else {}
+        for size, cases in results.items():
+            stored.setdefault(size, {}).update(cases)
+        args.baseline.write_text(json.dumps(
+            {
+                "environment": {
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "machine": platform.machine(),
+                },
+                "results": stored,
+            },
+            indent=2,
+        ) + "\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print("no baseline, run with --save-baseline first")
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text())["results"], args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
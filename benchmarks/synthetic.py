@@ -0,0 +1,153 @@
+"""
+synthetic seatgeek payloads shaped like ScalpyrPro.get_events results: nested
+venue, performers and stats dicts, a shared pool of venues and performers with
+skewed popularity, and a share of events without listings. generate_stat_rows
+returns stat table rows drawn from the same distributions. every benchmark
+builds its data here so baselines are measured on one data shape
+"""
+import numpy as np
+import pandas as pd
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+EVENT_TYPES = ["concert", "concert", "concert", "theater", "comedy"]
+STATES = ["NY", "CA", "TX", "IL", "FL", "WA", "MA", "CO"]
+
+
+def generate_venues(n: int, rng: np.random.Generator) -> list:
+    return [
+        {
+            "id": 1000 + i,
+            "name": f"Venue {i}",
+            "slug": f"venue-{i}",
+            "city": f"City {i % 300}",
+            "state": STATES[i % len(STATES)],
+            "country": "US",
+            "postal_code": f"{10000 + i % 89999}",
+            "timezone": "America/New_York",
+            "location": {"lat": float(rng.uniform(25, 48)), "lon": float(rng.uniform(-122, -70))},
+            "score": float(rng.random()),
+            "capacity": int(rng.integers(500, 60000)),
+        }
+        for i in range(n)
+    ]
+
+
+def generate_performers(n: int, rng: np.random.Generator) -> list:
+    return [
+        {
+            "id": 100_000 + i,
+            "name": f"Performer {i}",
+            "slug": f"performer-{i}",
+            "type": "band",
+            "score": float(rng.random()),
+            "primary": True,
+            "has_upcoming_events": True,
+            "num_upcoming_events": int(rng.integers(1, 80)),
+            "taxonomies": [{"id": 2000000, "name": "concert", "parent_id": None}],
+        }
+        for i in range(n)
+    ]
+
+
+def generate_stats(rng: np.random.Generator) -> dict:
+    prices = np.sort(rng.integers(20, 900, size=4))
+    listing_count = int(rng.integers(1, 3000))
+    return {
+        "listing_count": listing_count,
+        "average_price": int(prices[2]),
+        "lowest_price_good_deals": int(prices[0]),
+        "lowest_price": int(prices[0]),
+        "highest_price": int(prices[3]),
+        "visible_listing_count": int(listing_count * rng.uniform(0.5, 1)),
+        "dq_bucket_counts": rng.integers(0, 50, size=8).tolist(),
+        "median_price": int(prices[1]),
+        "lowest_sg_base_price": int(prices[0] * 0.9),
+        "lowest_sg_base_price_good_deals": int(prices[0] * 0.9),
+    }
+
+
+EMPTY_STATS = {
+    "listing_count": 0,
+    "average_price": None,
+    "lowest_price_good_deals": None,
+    "lowest_price": None,
+    "highest_price": None,
+    "visible_listing_count": 0,
+    "dq_bucket_counts": None,
+    "median_price": None,
+    "lowest_sg_base_price": None,
+    "lowest_sg_base_price_good_deals": None,
+}
+
+
+def generate_events(n: int, seed: int = 0, no_listing_share: float = 0.1) -> pd.DataFrame:
+    """
+    returns n events. venues and performers are drawn from pools of n/20 and n/5
+    entities with zipf-like popularity, events have 1-3 performers
+    :param n:
+    :param seed:
+    :param no_listing_share: share of events whose stats carry no prices
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    venues = generate_venues(max(1, n // 20), rng)
+    performers = generate_performers(max(3, n // 5), rng)
+    weights = 1 / np.arange(1, len(performers) + 1)
+    weights /= weights.sum()
+    starts = pd.Timestamp("2030-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24, size=n), unit="h")
+    events = []
+    for i in range(n):
+        lineup = rng.choice(len(performers), size=int(rng.integers(1, 4)), replace=False, p=weights)
+        start = starts[i].isoformat()
+        events.append(
+            {
+                "id": 5_000_000 + i,
+                "type": EVENT_TYPES[i % len(EVENT_TYPES)],
+                "title": f"Event {i}",
+                "short_title": f"Event {i}",
+                "url": f"https://seatgeek.com/e/{5_000_000 + i}",
+                "datetime_utc": start,
+                "datetime_local": start,
+                "announce_date": "2029-06-01T00:00:00",
+                "visible_at": "2029-06-01T00:00:00",
+                "status": "normal",
+                "score": float(rng.random()),
+                "venue": venues[int(rng.integers(0, len(venues)))],
+                "performers": [performers[p] for p in lineup],
+                "stats": EMPTY_STATS if rng.random() < no_listing_share else generate_stats(rng),
+                "taxonomies": [{"id": 2000000, "name": "concert", "parent_id": None}],
+            }
+        )
+    return pd.DataFrame(events)
+
+
+def generate_stat_rows(
+        event_ids, reads: int = 1, seed: int = 0, start: str = "2030-01-01", freq: str = "h"
+) -> pd.DataFrame:
+    """
+    returns reads stat table rows per event, read freq apart, with prices and
+    counts drawn like generate_stats
+    :param event_ids:
+    :param reads: snapshots per event
+    :param seed:
+    :param start: first utc_read_time
+    :param freq: time between snapshots
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    event_ids = np.asarray(event_ids)
+    n = len(event_ids) * reads
+    prices = np.sort(rng.integers(20, 900, size=(n, 4)), axis=1).astype(np.float64)
+    listing_count = rng.integers(1, 3000, size=n)
+    return pd.DataFrame(
+        {
+            "event_id": np.repeat(event_ids, reads),
+            "average_price": prices[:, 2],
+            "lowest_price": prices[:, 0],
+            "highest_price": prices[:, 3],
+            "median_price": prices[:, 1],
+            "listing_count": listing_count,
+            "visible_listing_count": (listing_count * rng.uniform(0.5, 1, size=n)).astype(np.int64),
+            "utc_read_time": np.tile(pd.date_range(start, periods=reads, freq=freq), len(event_ids)),
+        }
+    )
@@ -1,11 +1,85 @@
-import env
-from src.fetch_data import SeatgeekData, SlugReq
-from src.scalpyr import ScalpyrPro
-from sqlalchemy import create_engine
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.fetch_data import SeatgeekData, SlugReq, StatBucketQuery, StatQuery
+import src.fetch_data.buckets as buckets
+import src.fetch_data.connections as connections
+import src.fetch_data.db as db
+import src.fetch_data.rollup as rollup
 import pandas as pd
 from pprint import pprint
 
 from src.scalpyr.scalpyrpro import ApiException
+from src.fetch_data.client_cache import CachedScalpyr
+
+_client = None
+_archive = None
+
+
+def get_client() -> CachedScalpyr:
+    """
+    returns the process wide ScalpyrPro client, performer and venue lookups are
+    served from the on-disk cache
+    :return:
+    """
+    global _client
+    if _client is None:
+        _client = CachedScalpyr(connections.get_client())
+    return _client
+
+
+def get_archive():
+    """
+    returns the local parquet mirror of the stat tables, see archive.ParquetArchive.sync
+    :return:
+    """
+    global _archive
+    if _archive is None:
+        from src.fetch_data.archive import ParquetArchive
+        _archive = ParquetArchive()
+    return _archive
+
+
+def read_stats(query: StatQuery, resolution='auto', source='db') -> pd.DataFrame:
+    """
+    returns the stats selected by query from the database or the local archive.
+    the archive holds raw snapshots only, resolution applies to the database
+    :param query:
+    :param resolution: 'auto', 'raw', 'hourly' or 'daily'
+    :param source: 'db' or 'archive'
+    :return:
+    """
+    if source == 'archive':
+        return get_archive().read_stats(query)
+    engine = connections.get_engine()
+    return rollup.read_stats_at_resolution(engine, query, resolution)
+
+
+def read_bucketed_stats(query: StatBucketQuery, source='db') -> pd.DataFrame:
+    """
+    returns the stats selected by query downsampled to query.bucket, grouped in
+    the database or, for the archive, in memory
+    :param query:
+    :param source: 'db' or 'archive'
+    :return:
+    """
+    if source == 'archive':
+        return buckets.bucket_stats(get_archive().read_stats(query), query.bucket, query.aggregations, query.columns)
+    return buckets.read_bucketed_stats(connections.get_engine(), query)
+
+
+def read_performer_event_venue(query: StatQuery, source='db') -> pd.DataFrame:
+    """
+    returns the performer_event_venue rows selected by query from the database or the local archive
+    :param query:
+    :param source: 'db' or 'archive'
+    :return:
+    """
+    if source == 'archive':
+        return get_archive().read_performer_event_venue(query)
+    return db.read_performer_event_venue(connections.get_engine(), query)
 
 
 def get_performer_id(slug):
@@ -15,36 +89,40 @@ def get_performer_id(slug):
     :param slug:
     :return:
     """
-    client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
+    client = get_client()
     performer = client.get_performers({'slug': slug})
     performer_id = performer.id.values[0]
     return performer_id
 
 
-def get_performer_stats(slug):
+def get_performer_stats(slug, start=None, end=None, resolution='auto', source='db', bucket=None, aggregations=None):
+    """
+    returns the stats of a performer's events. long spans are read from the hourly
+    or daily rollup tables, see rollup.read_stats_at_resolution. given bucket, one
+    row per event and bucket is returned instead, see read_bucketed_stats
+    :param slug:
+    :param start: earliest utc_read_time
+    :param end: utc_read_time upper bound (exclusive)
+    :param resolution: 'auto', 'raw', 'hourly' or 'daily'
+    :param source: 'db' or 'archive'
+    :param bucket: e.g. '1h' or '1d'
+    :param aggregations: e.g. ['mean', 'max'], defaults to buckets.DEFAULT_AGGREGATIONS
+    :return:
+    """
     # get performer id from scalpyr
     performer_id = get_performer_id(slug)
-    engine = create_engine(env.PLANETSCALE_URL)
-    stats = pd.read_sql(
-        f'SELECT s.* '
-        f'FROM stat s '
-        f'JOIN performer_event_venue pev ON s.event_id = pev.event_id '
-        f'WHERE pev.performer_id = {performer_id}'
-        , engine
-    )
-    return stats
+    query = StatQuery(performer_id=[int(performer_id)], start=start, end=end)
+    if bucket is not None:
+        query = StatBucketQuery(
+            **query.model_dump(), bucket=bucket, aggregations=aggregations or buckets.DEFAULT_AGGREGATIONS
+        )
+        return read_bucketed_stats(query, source)
+    return read_stats(query, resolution, source)
 
 
-def get_performer_event_ids(slug):
+def get_performer_event_ids(slug, source='db'):
     performer_id = get_performer_id(slug)
-    engine = create_engine(env.PLANETSCALE_URL)
-    ids = pd.read_sql(
-        f'SELECT * '
-        f'FROM performer_event_venue '
-        f'WHERE performer_id = {performer_id}'
-        , engine
-    )
-    return ids
+    return read_performer_event_venue(StatQuery(performer_id=[int(performer_id)]), source)
 
 
 def plot_stats(performer_stats: pd.DataFrame, title, include_highest=False):
@@ -53,13 +131,13 @@ def plot_stats(performer_stats: pd.DataFrame, title, include_highest=False):
     :param performer_stats:
     :param title:
     :param include_highest:
-    :return:
+    :return: axes of the plot
     """
     stats = ['average_price', 'lowest_price', 'median_price', 'listing_count']
     stats += ['highest_price'] if include_highest else []
     # plot average_price, lowest_price, median_price, listing_count on left-y. plot highest_price on right-y
     plot_df = performer_stats.set_index('utc_read_time', drop=True)
-    plot_df[stats].plot(secondary_y=['listing_count'], title=title)
+    return plot_df[stats].plot(secondary_y=['listing_count'], title=title)
 
 
 def plot_all_stats(performer_stats, performer_events):
@@ -69,29 +147,114 @@ def plot_all_stats(performer_stats, performer_events):
     :param performer_stats:
     :return:
     """
-    client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
-    for event_id in performer_stats.event_id.unique():
-        ref_data = performer_events.loc[performer_events.event_id == event_id].iloc[0]
-        venue_id = ref_data.venue_id
-        venue_name = client.get_venues({'id': venue_id}).name.values[0]
-        performer_slug = client.get_performers({'id': ref_data.performer_id}).slug.values[0]
-        title = f'{performer_slug}, {venue_name}, {ref_data.datetime_utc}'
-        data = performer_stats.loc[performer_stats.event_id == event_id].copy()
-        plot_stats(data, title)
-
-
-def plot_every_stat():
-    engine = create_engine(env.PLANETSCALE_URL)
-    stats = pd.read_sql(
-        f'SELECT * '
-        f'FROM stat'
-        , engine
-    )
-    performer_events = pd.read_sql(
-        f'SELECT * '
-        f'FROM performer_event_venue'
-        , engine
+    titles = build_event_titles(performer_events.loc[performer_events.event_id.isin(performer_stats.event_id.unique())])
+    for event_id, data in performer_stats.groupby('event_id', sort=False):
+        plot_stats(data, titles.get(event_id, str(event_id)))
+
+
+def _lookup(client, kind: str, ids, column: str) -> pd.Series:
+    """
+    returns column of the kind entities with ids, indexed by id. ids the client
+    does not know are missing from the result
+    :param client:
+    :param kind: 'venues' or 'performers'
+    :param ids:
+    :param column:
+    :return:
+    """
+    found = client.get_by_id(kind, ids)
+    if found.empty or column not in found.columns:
+        return pd.Series(dtype=object)
+    return found.set_index('id')[column]
+
+
+def build_event_titles(performer_events: pd.DataFrame, client=None) -> pd.Series:
+    """
+    returns '{performer_slug}, {venue_name}, {datetime_utc}' indexed by event_id, using the
+    first performer_event_venue row of each event. venues and performers are each
+    resolved in one batched lookup, events whose venue or performer is not found
+    have no title
+    :param performer_events:
+    :param client:
+    :return:
+    """
+    client = client or get_client()
+    ref_data = performer_events.drop_duplicates('event_id')
+    venue_name = ref_data.venue_id.map(_lookup(client, 'venues', ref_data.venue_id.unique(), 'name'))
+    performer_slug = ref_data.performer_id.map(_lookup(client, 'performers', ref_data.performer_id.unique(), 'slug'))
+    titles = performer_slug.astype(str) + ', ' + venue_name.astype(str) + ', ' + ref_data.datetime_utc.astype(str)
+    found = venue_name.notna() & performer_slug.notna()
+    return pd.Series(titles[found].values, index=ref_data.event_id[found].values, dtype=object)
+
+
+def _use_non_interactive_backend():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render_stats_png(task: typing.Tuple[pd.DataFrame, str, Path, bool]) -> Path:
+    """
+    plots one event to a png file, runs in a worker process
+    :param task: stats of the event, title, output path, include_highest
+    :return:
+    """
+    import matplotlib.pyplot as plt
+    data, title, path, include_highest = task
+    axes = plot_stats(data, title, include_highest)
+    axes.figure.savefig(path)
+    plt.close('all')
+    return path
+
+
+def plot_all_stats_batch(
+        performer_stats: pd.DataFrame,
+        performer_events: pd.DataFrame,
+        out_dir: typing.Union[str, Path],
+        processes: typing.Optional[int] = None,
+        include_highest: bool = False,
+        client=None,
+) -> typing.List[Path]:
+    """
+    plots every event in performer_stats to <out_dir>/<event_id>.png.
+    stats are grouped by event once, titles are resolved in one batched lookup
+    and figures are rendered by a pool of processes with a non-interactive backend
+    :param performer_stats:
+    :param performer_events:
+    :param out_dir:
+    :param processes: worker processes, defaults to the cpu count
+    :param include_highest:
+    :param client:
+    :return: paths of the written files
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    titles = build_event_titles(
+        performer_events.loc[performer_events.event_id.isin(performer_stats.event_id.unique())], client
     )
+    tasks = [
+        (data, titles.get(event_id, str(event_id)), out_dir / f'{event_id}.png', include_highest)
+        for event_id, data in performer_stats.groupby('event_id', sort=False)
+    ]
+    if not tasks:
+        return []
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes, initializer=_use_non_interactive_backend) as pool:
+        chunksize = max(1, len(tasks) // (processes * 4))
+        return list(pool.map(_render_stats_png, tasks, chunksize=chunksize))
+
+
+def plot_every_stat(out_dir: typing.Union[str, Path, None] = None, resolution='auto', source='db'):
+    """
+    plots every event in the stat table, to png files in out_dir when given
+    :param out_dir:
+    :param resolution: 'auto', 'raw', 'hourly' or 'daily'
+    :param source: 'db' or 'archive'
+    :return:
+    """
+    stats = read_stats(StatQuery(), resolution, source)
+    performer_events = read_performer_event_venue(StatQuery(), source)
+    if out_dir is not None:
+        return plot_all_stats_batch(stats, performer_events, out_dir)
     plot_all_stats(stats, performer_events)
 
 
@@ -110,34 +273,37 @@ class DataPlotter(SeatgeekData):
         plot_all_stats(stats, ids)
         return ids
 
-    def stats_info_view(self, slug):
+    def stats_info_view(self, slug, columns: typing.Optional[typing.List[str]] = None):
         """
-        gets the stats for a given slug and joins the stats with the performer_event_venue table
+        gets the stats for a given slug and joins the stats with the performer_event_venue table,
+        venue and performer slugs and a '{performer_slug},{venue_slug},{datetime_utc}' title.
+        slugs and titles are resolved on the performer_event_venue rows of the slug, which are
+        then joined to the stats once
         :param slug:
+        :param columns: columns to return, e.g. ['utc_read_time', 'average_price', 'event_id', 'title']
         :return:
         """
         slug = SlugReq(slug={'performer': slug})
-        stats = self.get_stats_by_slug(slug)
-        # merge stats with performer_event_venue on event_id
-        stats_joined = stats.merge(self.get_ids_by_slug(slug), on='event_id')
-        client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
-        # get venue name from scalpyr by concating all unique venue_ids into comma separated string
-        venues = client.get_by_id(
-            'venues', stats_joined.venue_id.unique().astype(str)
-        )[['id', 'slug']].rename(columns={'slug': 'venue_slug'})
-        # merge stats with venues on left on venue_id right on id, drop id column
-        stats_joined = stats_joined.merge(venues, left_on='venue_id', right_on='id').drop(columns='id')
-        # get performer name from scalpyr by concating all unique performer_ids into comma separated string
-        performers = client.get_by_id(
-            'performers', stats_joined.performer_id.unique().astype(str)
-        )[['id', 'slug']].rename(columns={'slug': 'performer_slug'})
-        # merge stats with performers on left on performer_id right on id, drop id column
-        stats_joined = stats_joined.merge(performers, left_on='performer_id', right_on='id').drop(columns='id')
+        performer_events = self.get_ids_by_slug(slug)
+        stats = self._get_stats(performer_events.event_id)
+        client = get_client()
+        # one batched lookup each for the venues and performers of the slug
+        venue_slugs = _lookup(client, 'venues', performer_events.venue_id.unique().astype(str), 'slug')
+        performer_slugs = _lookup(client, 'performers', performer_events.performer_id.unique().astype(str), 'slug')
+        performer_events = performer_events.assign(
+            venue_slug=performer_events.venue_id.map(venue_slugs).astype('category'),
+            performer_slug=performer_events.performer_id.map(performer_slugs).astype('category'),
+        ).dropna(subset=['venue_slug', 'performer_slug'])
         # create a new column that is a concatenation of performer_slug, venue_slug, and datetime_utc
-        stats_joined['title'] = stats_joined.apply(
-            lambda x: f'{x.performer_slug},{x.venue_slug},{x.datetime_utc}', axis=1)
-        # drop all columns except utc_read_time, average_price, event_id, title
-        # stats_joined = stats_joined[['utc_read_time', 'average_price', 'event_id', 'title']]
+        performer_events['title'] = (
+            performer_events.performer_slug.astype(str) + ','
+            + performer_events.venue_slug.astype(str) + ','
+            + performer_events.datetime_utc.astype(str)
+        ).astype('category')
+        # merge stats with performer_event_venue on event_id
+        stats_joined = stats.merge(performer_events, on='event_id')
+        if columns is not None:
+            stats_joined = stats_joined[columns]
         return stats_joined
 
 
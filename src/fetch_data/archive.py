@@ -0,0 +1,172 @@
+"""
+local parquet mirror of the stat and performer_event_venue tables. stat rows are
+partitioned by read date and a hash bucket of event_id, so time windows and event
+filters only open the matching files; the sync appends the rows read since the
+last synced utc_read_time
+"""
+import json
+import os
+import typing
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import src.fetch_data.db as db
+import src.fetch_data.rollup as rollup
+import src.fetch_data.schema as schema
+
+DEFAULT_ARCHIVE_PATH = Path.home() / ".cache" / "sg-event-stats" / "archive"
+# event_id % EVENT_BUCKETS picks the event partition of a stat row
+EVENT_BUCKETS = 16
+STAT_PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.string()), ("event_bucket", pa.int32())]), flavor="hive"
+)
+SYNC_STATE_FILE = "_sync.json"
+
+
+def _window_token(watermark: typing.Optional[pd.Timestamp]) -> str:
+    """file name prefix of the rows synced from a watermark"""
+    return "0" if watermark is None else watermark.strftime("%Y%m%dT%H%M%S%f")
+
+
+class ParquetArchive:
+    """
+    parquet dataset at path:
+        stat/date=YYYY-MM-DD/event_bucket=N/part-*.parquet
+        performer_event_venue.parquet
+        _sync.json (utc_read_time watermark of the stat mirror)
+    read_stats and read_performer_event_venue take the same StatQuery as the db readers
+    """
+    def __init__(self, path: typing.Union[str, Path] = DEFAULT_ARCHIVE_PATH):
+        self.path = Path(path)
+        self.stat_path = self.path / db.STAT_TABLE
+        self.pev_path = self.path / f"{db.PEV_TABLE}.parquet"
+
+    @property
+    def watermark(self) -> typing.Optional[pd.Timestamp]:
+        """utc_read_time up to which (exclusive) stat rows have been synced"""
+        state_path = self.path / SYNC_STATE_FILE
+        if not state_path.exists():
+            return None
+        state = json.loads(state_path.read_text())
+        return pd.Timestamp(state["stat"]) if state.get("stat") else None
+
+    def _set_watermark(self, watermark: pd.Timestamp):
+        state_path = self.path / SYNC_STATE_FILE
+        tmp_path = state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"stat": watermark.isoformat()}))
+        os.replace(tmp_path, state_path)
+
+    def write_stats(self, stats: pd.DataFrame, basename: str) -> int:
+        """
+        appends stat rows to their date/event_bucket partitions
+        :param stats:
+        :param basename: file name prefix, files of the same prefix are overwritten
+        :return: rows written
+        """
+        if stats.empty:
+            return 0
+        read_time = pd.to_datetime(stats["utc_read_time"])
+        stats = stats.assign(
+            utc_read_time=read_time,
+            date=read_time.dt.strftime("%Y-%m-%d"),
+            event_bucket=(stats["event_id"] % EVENT_BUCKETS).astype("int32"),
+        )
+        ds.write_dataset(
+            pa.Table.from_pandas(stats, preserve_index=False),
+            self.stat_path,
+            format="parquet",
+            partitioning=STAT_PARTITIONING,
+            basename_template=f"{basename}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        return len(stats)
+
+    def sync(self, engine, chunksize: int = 50000) -> typing.Dict[str, int]:
+        """
+        appends the stat rows read since the watermark and replaces the
+        performer_event_venue mirror. rows at the latest stored utc_read_time are
+        left for the next sync, since the run writing them may not have finished
+        :param engine:
+        :param chunksize: stat rows read and written at a time
+        :return: stat and performer_event_venue rows written
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        watermark = self.watermark
+        _, latest = rollup.stat_time_range(engine, schema.StatQuery(start=watermark))
+        synced = 0
+        if not pd.isna(latest) and (watermark is None or latest > watermark):
+            token = _window_token(watermark)
+            # files left by an interrupted sync of the same window
+            for stale in self.stat_path.glob(f"**/part-{token}-*.parquet"):
+                stale.unlink()
+            statement = db.stat_select(schema.StatQuery(start=watermark, end=latest))
+            for n, chunk in enumerate(db.iter_read(engine, statement, chunksize, ["utc_read_time"])):
+                synced += self.write_stats(chunk, f"part-{token}-{n}")
+            self._set_watermark(latest)
+        pev = db.read_performer_event_venue(engine, schema.StatQuery())
+        tmp_path = self.pev_path.with_suffix(".tmp")
+        pq.write_table(pa.Table.from_pandas(pev, preserve_index=False), tmp_path)
+        os.replace(tmp_path, self.pev_path)
+        return {"stat": synced, "performer_event_venue": len(pev)}
+
+    def read_performer_event_venue(self, query: schema.StatQuery) -> pd.DataFrame:
+        """
+        returns the performer_event_venue rows selected by the id filters of query
+        :param query:
+        :return:
+        """
+        filters = [
+            pc.field(name).isin([db._native(v) for v in getattr(query, name)])
+            for name in ("performer_id", "venue_id", "event_id")
+            if getattr(query, name) is not None
+        ]
+        table = pq.read_table(self.pev_path, filters=_all(filters))
+        return table.to_pandas()
+
+    def read_stats(self, query: schema.StatQuery) -> pd.DataFrame:
+        """
+        returns the stat rows and columns selected by query. only the partitions of
+        the query's dates and event buckets are read
+        :param query:
+        :return:
+        """
+        columns = query.columns or db.STAT_COLUMNS
+        unknown = set(columns) - set(db.STAT_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown stat columns: {sorted(unknown)}")
+        columns = ["event_id"] + [c for c in columns if c != "event_id"]
+        if not self.stat_path.exists():
+            return pd.DataFrame(columns=columns)
+        filters = []
+        if query.start is not None:
+            start = pd.Timestamp(query.start)
+            filters += [pc.field("date") >= start.strftime("%Y-%m-%d"), pc.field("utc_read_time") >= start]
+        if query.end is not None:
+            end = pd.Timestamp(query.end)
+            filters += [pc.field("date") <= end.strftime("%Y-%m-%d"), pc.field("utc_read_time") < end]
+        event_ids = query.event_id
+        if query.performer_id is not None or query.venue_id is not None:
+            linked = self.read_performer_event_venue(query.model_copy(update={"event_id": None}))
+            linked = linked["event_id"].unique().tolist()
+            event_ids = linked if event_ids is None else list(set(linked) & set(event_ids))
+        if event_ids is not None:
+            event_ids = [int(e) for e in event_ids]
+            buckets = sorted({e % EVENT_BUCKETS for e in event_ids})
+            filters += [pc.field("event_bucket").isin(buckets), pc.field("event_id").isin(event_ids)]
+        dataset = ds.dataset(self.stat_path, format="parquet", partitioning=STAT_PARTITIONING)
+        return dataset.to_table(columns=columns, filter=_all(filters)).to_pandas()
+
+
+def _all(filters: list):
+    """and of pyarrow filter expressions, None when there are none"""
+    if not filters:
+        return None
+    expression = filters[0]
+    for f in filters[1:]:
+        expression = expression & f
+    return expression
@@ -0,0 +1,143 @@
+"""
+time bucketed stat reads: snapshots are downsampled to one row per event and
+utc_read_time bucket, either in the database with a GROUP BY on the truncated
+read time or in memory with a vectorized groupby. both return the same columns:
+event_id, bucket, n (snapshots in the bucket) and <column>_<aggregation>
+"""
+import typing
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+
+import src.fetch_data.db as db
+import src.fetch_data.schema as schema
+from src.fetch_data.delta import VALUE_COLUMNS
+
+# aggregation name -> sql aggregate, the same names are pandas aggregations
+AGGREGATIONS = {
+    "mean": sa.func.avg,
+    "min": sa.func.min,
+    "max": sa.func.max,
+    "sum": sa.func.sum,
+    "count": sa.func.count,
+}
+DEFAULT_AGGREGATIONS = ["mean"]
+
+
+class bucket_start(sa.sql.functions.FunctionElement):
+    """
+    unix seconds of the start of the bucket holding a datetime column:
+    bucket_start(column, seconds)
+    """
+    type = sa.BigInteger()
+    name = "bucket_start"
+    inherit_cache = True
+
+
+@compiles(bucket_start)
+def _bucket_start(element, compiler, **kw):
+    column, seconds = [compiler.process(c, **kw) for c in element.clauses]
+    return f"FLOOR(EXTRACT(EPOCH FROM {column}) / {seconds}) * {seconds}"
+
+
+@compiles(bucket_start, "sqlite")
+def _bucket_start_sqlite(element, compiler, **kw):
+    column, seconds = [compiler.process(c, **kw) for c in element.clauses]
+    return f"(CAST(strftime('%s', {column}) AS INTEGER) / {seconds}) * {seconds}"
+
+
+@compiles(bucket_start, "mysql")
+def _bucket_start_mysql(element, compiler, **kw):
+    # TIMESTAMPDIFF does not depend on the session time zone, UNIX_TIMESTAMP does
+    column, seconds = [compiler.process(c, **kw) for c in element.clauses]
+    return f"(TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', {column}) DIV {seconds}) * {seconds}"
+
+
+def bucket_seconds(bucket: str) -> int:
+    """
+    returns the length of a bucket in whole seconds
+    :param bucket: pandas timedelta string, e.g. '1h'
+    :return:
+    """
+    # pandas deprecates the lowercase day unit, '1d' is accepted as '1D'
+    length = pd.Timedelta(bucket[:-1] + "D" if bucket.endswith("d") else bucket)
+    if length <= pd.Timedelta(0) or length % pd.Timedelta(seconds=1):
+        raise ValueError(f"bucket must be a positive whole number of seconds: {bucket}")
+    return int(length.total_seconds())
+
+
+def _value_columns(columns: typing.Optional[typing.List[str]], aggregations: typing.List[str]) -> typing.List[str]:
+    unknown = set(aggregations) - set(AGGREGATIONS)
+    if unknown:
+        raise ValueError(f"unknown aggregations: {sorted(unknown)}")
+    return [c for c in columns or VALUE_COLUMNS if c not in ("event_id", "utc_read_time")]
+
+
+def bucket_select(query: schema.StatBucketQuery) -> sa.Select:
+    """
+    returns a select on stat grouped by event_id and query.bucket, filtered like db.stat_select
+    :param query:
+    :return:
+    """
+    columns = _value_columns(query.columns, query.aggregations)
+    seconds = bucket_seconds(query.bucket)
+    selected = db.stat_select(query.model_copy(update={"columns": columns + ["utc_read_time"]})).subquery()
+    bucket = bucket_start(selected.c.utc_read_time, sa.literal_column(str(seconds)))
+    return (
+        sa.select(
+            selected.c.event_id,
+            bucket.label("bucket"),
+            sa.func.count().label("n"),
+            *[
+                AGGREGATIONS[aggregation](selected.c[column]).label(f"{column}_{aggregation}")
+                for column in columns
+                for aggregation in query.aggregations
+            ],
+        )
+        .group_by(selected.c.event_id, bucket)
+        .order_by(selected.c.event_id, bucket)
+    )
+
+
+def read_bucketed_stats(engine, query: schema.StatBucketQuery) -> pd.DataFrame:
+    """
+    returns the stat rows selected by query downsampled in the database
+    :param engine:
+    :param query:
+    :return:
+    """
+    stats = db.read_frames(engine, bucket_select(query), query.chunksize)
+    stats["bucket"] = pd.to_datetime(stats["bucket"].astype("int64"), unit="s")
+    return stats
+
+
+def bucket_stats(
+        stats: pd.DataFrame,
+        bucket: str,
+        aggregations: typing.Optional[typing.List[str]] = None,
+        columns: typing.Optional[typing.List[str]] = None,
+) -> pd.DataFrame:
+    """
+    returns stat rows downsampled in memory, shaped like read_bucketed_stats
+    :param stats: stat rows
+    :param bucket: pandas timedelta string, e.g. '1h'
+    :param aggregations: defaults to DEFAULT_AGGREGATIONS
+    :param columns: columns to aggregate, defaults to the value columns of stats
+    :return:
+    """
+    aggregations = aggregations or DEFAULT_AGGREGATIONS
+    columns = _value_columns(columns or [c for c in VALUE_COLUMNS if c in stats.columns], aggregations)
+    seconds = bucket_seconds(bucket)
+    read_time = pd.to_datetime(stats["utc_read_time"])
+    named = {
+        f"{column}_{aggregation}": (column, aggregation)
+        for column in columns
+        for aggregation in aggregations
+    }
+    return (
+        stats.assign(bucket=read_time.dt.floor(pd.Timedelta(seconds=seconds)))
+        .groupby(["event_id", "bucket"], sort=True)
+        .agg(n=("event_id", "size"), **named)
+        .reset_index()
+    )
@@ -0,0 +1,185 @@
+"""
+on-disk cache for seatgeek entity lookups (performers, venues)
+"""
+import json
+import sqlite3
+import threading
+import time
+import typing
+from pathlib import Path
+
+import pandas as pd
+
+from src.scalpyr import ScalpyrPro
+from src.fetch_data.fetch_engine import FetchEngine
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "sg-event-stats" / "scalpyr.sqlite"
+# seconds a cached entity is served before it is fetched again
+DEFAULT_TTL = 24 * 60 * 60
+# least recently used entries are evicted beyond this many
+DEFAULT_MAX_ENTRIES = 50000
+ENTITY_KINDS = ("performers", "venues")
+
+
+class CachedScalpyr:
+    """
+    wraps a ScalpyrPro client. performer and venue lookups by id (or performer by slug)
+    are served from a sqlite store with a ttl and lru eviction; the ids missing from
+    the store are fetched in one batched, deduplicated call. every other client
+    method is passed through
+    """
+    def __init__(
+            self,
+            client: ScalpyrPro,
+            path: typing.Union[str, Path] = DEFAULT_CACHE_PATH,
+            ttl: float = DEFAULT_TTL,
+            max_entries: int = DEFAULT_MAX_ENTRIES,
+            clock: typing.Callable[[], float] = time.time,
+    ):
+        self.client = client
+        self.fetcher = FetchEngine(client)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entity ("
+            " kind TEXT, key TEXT, value TEXT, fetched_at REAL, used_at REAL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entity_used_at ON entity (used_at)")
+        self._db.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def cache_info(self) -> typing.Dict[str, int]:
+        """
+        returns hit and miss counters and the number of stored entries
+        :return:
+        """
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entity").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def _read(self, kind: str, keys: typing.List[str]) -> typing.Dict[str, dict]:
+        """
+        returns {key: entity} for the fresh entries of keys and marks them used
+        :param kind:
+        :param keys:
+        :return:
+        """
+        now = self.clock()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, value FROM entity WHERE kind = ? AND fetched_at >= ?"
+                    f" AND key IN ({','.join('?' * len(batch))})",
+                    [kind, now - self.ttl, *batch],
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            self._db.executemany(
+                "UPDATE entity SET used_at = ? WHERE kind = ? AND key = ?",
+                [(now, kind, key) for key in found],
+            )
+            self._db.commit()
+        return found
+
+    def _write(self, kind: str, entities: typing.Dict[str, dict]):
+        """
+        stores entities by key and evicts the least recently used entries over max_entries
+        :param kind:
+        :param entities:
+        :return:
+        """
+        now = self.clock()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entity (kind, key, value, fetched_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                [(kind, key, json.dumps(value, default=str), now, now) for key, value in entities.items()],
+            )
+            self._db.execute(
+                "DELETE FROM entity WHERE rowid IN ("
+                " SELECT rowid FROM entity ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                [self.max_entries],
+            )
+            self._db.commit()
+
+    def get_entities(self, kind: str, ids: typing.Iterable) -> pd.DataFrame:
+        """
+        returns one row per distinct id of kind ('performers' or 'venues'),
+        fetching only the ids that are not cached
+        :param kind:
+        :param ids:
+        :return:
+        """
+        keys = list(dict.fromkeys(str(i) for i in ids))
+        found = self._read(kind, keys)
+        missing = [key for key in keys if key not in found]
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            fetched = self.fetcher.map_chunks(f"get_{kind}", "id", missing)
+            fetched = {str(row["id"]): row for row in fetched.to_dict("records")}
+            self._write(kind, fetched)
+            found.update(fetched)
+        return pd.DataFrame([found[key] for key in keys if key in found])
+
+    def get_performer_by_slug(self, slug: str) -> pd.DataFrame:
+        """
+        returns the performer with slug, cached under its slug
+        :param slug:
+        :return:
+        """
+        key = f"slug:{slug}"
+        found = self._read("performers", [key])
+        with self._lock:
+            if key in found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if key in found:
+            return pd.DataFrame([found[key]])
+        performers = self.client.get_performers({"slug": slug})
+        records = performers.to_dict("records")
+        if records:
+            self._write("performers", {key: records[0], str(records[0]["id"]): records[0]})
+        return performers
+
+    def _cacheable_ids(self, params: dict) -> typing.Optional[str]:
+        """returns the id filter of params when nothing but ids and paging is requested"""
+        if "id" in params and set(params) <= {"id", "per_page", "page"}:
+            return params["id"]
+        return None
+
+    def get_performers(self, params: dict) -> pd.DataFrame:
+        ids = self._cacheable_ids(params)
+        if ids is not None:
+            # every id is answered on the first page
+            if params.get("page", 1) > 1:
+                return pd.DataFrame()
+            return self.get_entities("performers", str(ids).split(","))
+        if set(params) == {"slug"}:
+            return self.get_performer_by_slug(params["slug"])
+        return self.client.get_performers(params)
+
+    def get_venues(self, params: dict) -> pd.DataFrame:
+        ids = self._cacheable_ids(params)
+        if ids is not None:
+            if params.get("page", 1) > 1:
+                return pd.DataFrame()
+            return self.get_entities("venues", str(ids).split(","))
+        return self.client.get_venues(params)
+
+    def get_by_id(self, kind: str, ids: typing.Iterable) -> pd.DataFrame:
+        if kind in ENTITY_KINDS:
+            return self.get_entities(kind, ids)
+        return self.client.get_by_id(kind, ids)
@@ -0,0 +1,171 @@
+"""
+process wide database engines and seatgeek client. every caller asking for the
+same url shares one engine, and so one connection pool, instead of paying the
+tls and auth handshake of a fresh engine per call
+"""
+import os
+import threading
+import typing
+
+import requests
+import sqlalchemy as sa
+from requests.adapters import HTTPAdapter
+
+import env
+from src.scalpyr import ScalpyrPro
+
+# pool settings of new engines, each can be overridden by the environment variable of the same name
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+# seconds before a pooled connection is replaced, below the server's idle timeout
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+# pooled http connections per host of the seatgeek session
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+
+_lock = threading.Lock()
+_engines: typing.Dict[tuple, sa.engine.Engine] = {}
+_stats: typing.Dict[int, typing.Dict[str, int]] = {}
+_client = None
+_http_session = None
+
+
+def _count(engine: sa.engine.Engine) -> typing.Dict[str, int]:
+    """
+    counts new dbapi connections and pool checkouts of engine
+    :param engine:
+    :return: the counters, updated in place by the pool events
+    """
+    stats = {"connects": 0, "checkouts": 0}
+
+    def on_connect(dbapi_connection, connection_record):
+        stats["connects"] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats["checkouts"] += 1
+
+    sa.event.listen(engine, "connect", on_connect)
+    sa.event.listen(engine, "checkout", on_checkout)
+    return stats
+
+
+def pool_options(url: str) -> dict:
+    """
+    returns the create_engine pool arguments for url. sqlite engines keep the
+    dialect's default pool
+    :param url:
+    :return:
+    """
+    options = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    if sa.engine.make_url(url).get_backend_name() != "sqlite":
+        options.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+    return options
+
+
+def get_engine(url: typing.Optional[str] = None, **kwargs) -> sa.engine.Engine:
+    """
+    returns the shared engine of url, created with pool_options on first use
+    :param url: defaults to env.PLANETSCALE_URL
+    :param kwargs: create_engine arguments, engines with different arguments are not shared
+    :return:
+    """
+    url = url or env.PLANETSCALE_URL
+    key = (str(url), tuple(sorted(kwargs.items())))
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = sa.create_engine(url, **{**pool_options(str(url)), **kwargs})
+            _stats[id(engine)] = _count(engine)
+            _engines[key] = engine
+    return engine
+
+
+def connection_stats(engine: typing.Optional[sa.engine.Engine] = None) -> typing.Dict[str, int]:
+    """
+    returns the connections opened and checkouts served by the pool of engine,
+    summed over every shared engine when None. reused = checkouts - connects
+    :param engine:
+    :return:
+    """
+    with _lock:
+        counters = [_stats[id(engine)]] if engine is not None else list(_stats.values())
+    connects = sum(c["connects"] for c in counters)
+    checkouts = sum(c["checkouts"] for c in counters)
+    return {"connects": connects, "checkouts": checkouts, "reused": checkouts - connects}
+
+
+def dispose_engines(close: bool = True):
+    """
+    closes every pooled connection and forgets the shared engines
+    :param close: False leaves the connections open for the process that owns them,
+        see reset_after_fork
+    :return:
+    """
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+        _engines.clear()
+        _stats.clear()
+
+
+def reset_after_fork():
+    """
+    forgets the engines, http session and client inherited from a forked parent
+    process without closing the parent's connections, the child opens its own on
+    first use. meant as a process pool initializer
+    :return:
+    """
+    global _client, _http_session
+    dispose_engines(close=False)
+    _client = None
+    _http_session = None
+
+
+def get_http_session() -> requests.Session:
+    """
+    returns the process wide requests session, keeping up to HTTP_POOL_SIZE
+    connections per host alive between requests
+    :return:
+    """
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+    return _http_session
+
+
+def get_client() -> ScalpyrPro:
+    """
+    returns the process wide seatgeek client, sending its requests through the
+    pooled http session
+    :return:
+    """
+    global _client
+    if _client is None:
+        session = get_http_session()
+        with _lock:
+            if _client is None:
+                client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
+                attach_session(client, session)
+                _client = client
+    return _client
+
+
+def attach_session(client, session: requests.Session):
+    """
+    replaces the requests session of client with session
+    :param client:
+    :param session:
+    :return:
+    """
+    # a client without a session would send every request outside the pool
+    if not hasattr(client, "session"):
+        raise TypeError(f"{type(client).__name__} has no session, the pooled http session cannot be attached")
+    try:
+        client.session = session
+    except AttributeError as e:
+        raise TypeError(f"the session of {type(client).__name__} cannot be replaced") from e
@@ -0,0 +1,557 @@
+"""
+database read/write helpers for the seatgeek tables
+"""
+import csv
+import os
+import tempfile
+import typing
+
+import pandas as pd
+import sqlalchemy as sa
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype, is_object_dtype, is_string_dtype
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+import src.fetch_data.schema as schema
+
+PEV_TABLE = "performer_event_venue"
+STAT_TABLE = "stat"
+# natural key of the performer_event_venue link table
+PEV_KEY = ["event_id", "performer_id"]
+PEV_DATETIME_COLUMNS = ["datetime_utc", "announce_date", "visible_at"]
+STAT_COLUMNS = [
+    "event_id",
+    "average_price",
+    "lowest_price",
+    "highest_price",
+    "median_price",
+    "listing_count",
+    "visible_listing_count",
+    "utc_read_time",
+]
+# max number of values bound into a single IN (...) clause
+KEY_QUERY_BATCH = 500
+# conservative max_allowed_packet, multi-row inserts are sized to stay below it
+MAX_PACKET_BYTES = 16 * 1024 * 1024
+# max bound parameters in one sqlite statement (SQLITE_MAX_VARIABLE_NUMBER since 3.32)
+SQLITE_MAX_VARIABLES = 32766
+EXECUTEMANY_CHUNKSIZE = 10000
+# length of text key columns, mysql cannot index unbounded TEXT columns
+KEY_STRING_LENGTH = 255
+
+
+def has_table(con, table_name: str) -> bool:
+    """
+    returns True if table_name exists in the database
+    :param con: engine or connection
+    :param table_name:
+    :return:
+    """
+    return sa.inspect(con).has_table(table_name)
+
+
+def reflect_table(con, table_name: str) -> sa.Table:
+    """
+    returns a sqlalchemy Table for an existing table
+    :param con: engine or connection
+    :param table_name:
+    :return:
+    """
+    return sa.Table(table_name, sa.MetaData(), autoload_with=con)
+
+
+def batched(values: typing.Sequence, size: int) -> typing.Iterator[list]:
+    """
+    yields consecutive lists of at most size values
+    :param values:
+    :param size:
+    :return:
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def read_rows_where_in(
+    con, table: sa.Table, column: str, values: typing.Iterable, *where
+) -> pd.DataFrame:
+    """
+    select * from table where column in values, values are bound in batches
+    so the statement size stays bounded
+    :param con:
+    :param table:
+    :param column:
+    :param values:
+    :param where: further clauses and-ed to every batch
+    :return:
+    """
+    frames = [
+        pd.read_sql(sa.select(table).where(table.c[column].in_(batch), *where), con)
+        for batch in batched([_native(v) for v in values], KEY_QUERY_BATCH)
+    ]
+    if not frames:
+        return pd.DataFrame(columns=[c.name for c in table.columns])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _native(value):
+    """numpy scalars -> python scalars, so they can be bound as parameters"""
+    return value.item() if hasattr(value, "item") else value
+
+
+def _to_records(df: pd.DataFrame) -> typing.List[dict]:
+    """
+    returns df as a list of dicts with NaN/NaT replaced by None
+    :param df:
+    :return:
+    """
+    if not df.isna().values.any():
+        # to_dict already boxes numpy scalars as python scalars
+        return df.to_dict("records")
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    return [{k: _native(v) for k, v in record.items()} for record in records]
+
+
+def _comparable(series: pd.Series, as_datetime: bool) -> pd.Series:
+    if as_datetime:
+        return pd.to_datetime(series, utc=True, errors="coerce", format="mixed")
+    return series
+
+
+def _changed(new: pd.Series, stored: pd.Series, as_datetime: bool) -> pd.Series:
+    """
+    elementwise True where new differs from stored, missing == missing
+    :param new:
+    :param stored:
+    :param as_datetime:
+    :return:
+    """
+    as_datetime = as_datetime or is_datetime64_any_dtype(new) or is_datetime64_any_dtype(stored)
+    new = _comparable(new, as_datetime)
+    stored = _comparable(stored, as_datetime)
+    if not as_datetime and not (is_numeric_dtype(new) and is_numeric_dtype(stored)):
+        new = new.astype(str).where(new.notna())
+        stored = stored.astype(str).where(stored.notna())
+    return new.ne(stored) & ~(new.isna() & stored.isna())
+
+
+def _key_index_name(table_name: str) -> str:
+    return f"ux_{table_name}_key"
+
+
+def _has_unique_key(con, table_name: str, key: typing.List[str]) -> bool:
+    """
+    returns True if a unique index or constraint of table_name covers exactly key
+    :param con:
+    :param table_name:
+    :param key:
+    :return:
+    """
+    inspector = sa.inspect(con)
+    unique = [i["column_names"] for i in inspector.get_indexes(table_name) if i.get("unique")]
+    unique += [c["column_names"] for c in inspector.get_unique_constraints(table_name)]
+    return any(set(columns) == set(key) for columns in unique)
+
+
+def ensure_unique_key(engine, table_name: str, key: typing.List[str]) -> bool:
+    """
+    creates a unique index on key unless one exists. tables holding duplicate keys,
+    or text keys mysql cannot index, are left without it. runs in its own
+    transaction, mysql commits implicitly on CREATE INDEX
+    :param engine:
+    :param table_name:
+    :param key:
+    :return: True if the key is unique in the database
+    """
+    if _has_unique_key(engine, table_name, key):
+        return True
+    table = reflect_table(engine, table_name)
+    try:
+        with engine.begin() as conn:
+            sa.Index(_key_index_name(table_name), *[table.c[k] for k in key], unique=True).create(conn)
+    except sa.exc.DBAPIError:
+        return False
+    return True
+
+
+def _insert_statement(con, table: sa.Table, key: typing.List[str], value_columns: typing.List[str]):
+    """
+    returns an insert on table that updates the value columns of rows whose key
+    another writer inserted since they were read, requires a unique key
+    :param con:
+    :param table:
+    :param key:
+    :param value_columns:
+    :return:
+    """
+    name = con.dialect.name
+    if name == "mysql":
+        statement = mysql.insert(table)
+        if not value_columns:
+            return statement.prefix_with("IGNORE")
+        return statement.on_duplicate_key_update({c: statement.inserted[c] for c in value_columns})
+    if name in ("sqlite", "postgresql"):
+        statement = (sqlite if name == "sqlite" else postgresql).insert(table)
+        if not value_columns:
+            return statement.on_conflict_do_nothing(index_elements=key)
+        return statement.on_conflict_do_update(
+            index_elements=key, set_={c: statement.excluded[c] for c in value_columns}
+        )
+    return table.insert()
+
+
+def upsert_rows(
+    df: pd.DataFrame,
+    engine,
+    table_name: str,
+    key: typing.List[str],
+    datetime_columns: typing.Iterable[str] = (),
+) -> typing.Dict[str, int]:
+    """
+    incrementally writes df to table_name using key as the natural key:
+    - rows whose key is not stored yet are inserted
+    - rows whose key is stored but whose other columns changed are updated
+    - unchanged rows are skipped
+    the table is created with a unique index on key. only stored rows sharing
+    key[0] with df are read, through that index, so the cost scales with the size
+    of df rather than the size of the table. rows another writer inserted after
+    the read are updated instead of duplicated
+    :param df:
+    :param engine:
+    :param table_name:
+    :param key:
+    :param datetime_columns: columns compared as timestamps rather than raw values
+    :return: counts of inserted and updated rows
+    """
+    rows = df.drop_duplicates(subset=key, keep="last").reset_index(drop=True)
+    if not has_table(engine, table_name):
+        text_keys = {
+            k: sa.String(KEY_STRING_LENGTH)
+            for k in key if is_object_dtype(rows[k]) or is_string_dtype(rows[k])
+        }
+        with engine.begin() as conn:
+            rows.iloc[:0].to_sql(table_name, conn, index=False, dtype=text_keys)
+    unique = ensure_unique_key(engine, table_name, key)
+    with engine.begin() as conn:
+        table = reflect_table(conn, table_name)
+        stored = read_rows_where_in(conn, table, key[0], rows[key[0]].unique())
+        stored = stored.drop_duplicates(subset=key, keep="last")
+        # cast stored key columns to the incoming dtypes so the merge lines up
+        stored = stored.astype({k: rows[k].dtype for k in key}, errors="ignore")
+        merged = rows.merge(
+            stored, on=key, how="left", suffixes=("", "_stored"), indicator=True
+        )
+        is_new = (merged["_merge"] == "left_only").values
+
+        value_columns = [c for c in rows.columns if c not in key and c in stored.columns]
+        is_changed = pd.Series(False, index=merged.index)
+        datetime_columns = set(datetime_columns)
+        for column in value_columns:
+            is_changed |= _changed(
+                merged[column], merged[f"{column}_stored"], column in datetime_columns
+            )
+        is_changed = is_changed.values & ~is_new
+
+        new_rows = rows.loc[is_new]
+        if not new_rows.empty:
+            if unique:
+                statement = _insert_statement(conn, table, key, [c for c in rows.columns if c not in key])
+                for batch in batched(_to_records(new_rows), EXECUTEMANY_CHUNKSIZE):
+                    conn.execute(statement, batch)
+            else:
+                new_rows.to_sql(
+                    table_name, conn, if_exists="append", index=False, chunksize=10000
+                )
+        changed_rows = rows.loc[is_changed, key + value_columns]
+        if not changed_rows.empty:
+            # SET clause is built from the value column keys of each record
+            statement = table.update().where(
+                sa.and_(*[table.c[k] == sa.bindparam(f"key_{k}") for k in key])
+            )
+            records = _to_records(changed_rows)
+            for record in records:
+                for k in key:
+                    record[f"key_{k}"] = record.pop(k)
+            conn.execute(statement, records)
+    return {"inserted": int(is_new.sum()), "updated": int(is_changed.sum())}
+
+
+def upsert_performer_event_venue(df: pd.DataFrame, engine) -> typing.Dict[str, int]:
+    """
+    incrementally writes performer_event_venue rows keyed on (event_id, performer_id)
+    :param df:
+    :param engine:
+    :return:
+    """
+    return upsert_rows(df, engine, PEV_TABLE, PEV_KEY, PEV_DATETIME_COLUMNS)
+
+
+def _in_filter(column, values):
+    """list filters are bound as a single expanding IN parameter"""
+    return column.in_([_native(v) for v in values])
+
+
+def pev_filters(pev: sa.TableClause, query: schema.StatQuery) -> list:
+    """
+    returns where clauses on performer_event_venue for the id filters of query
+    :param pev:
+    :param query:
+    :return:
+    """
+    return [
+        _in_filter(pev.c[name], getattr(query, name))
+        for name in ("performer_id", "venue_id", "event_id")
+        if getattr(query, name) is not None
+    ]
+
+
+def pev_select(pev: sa.Table, query: schema.StatQuery) -> sa.Select:
+    """
+    returns select * from performer_event_venue filtered by the ids in query
+    :param pev: reflected performer_event_venue table
+    :param query:
+    :return:
+    """
+    return sa.select(pev).where(*pev_filters(pev, query))
+
+
+def stat_select(query: schema.StatQuery) -> sa.Select:
+    """
+    returns a select on stat projected to query.columns and filtered by the time
+    window of query. performer/venue filters select stat rows whose event_id is
+    linked to them in performer_event_venue
+    :param query:
+    :return:
+    """
+    columns = query.columns or STAT_COLUMNS
+    unknown = set(columns) - set(STAT_COLUMNS)
+    if unknown:
+        raise ValueError(f"unknown stat columns: {sorted(unknown)}")
+    columns = ["event_id"] + [c for c in columns if c != "event_id"]
+    stat = sa.table(
+        STAT_TABLE,
+        *[sa.column(c, sa.DateTime if c == "utc_read_time" else None) for c in STAT_COLUMNS],
+    )
+    statement = sa.select(*[stat.c[c] for c in columns])
+    if query.start is not None:
+        statement = statement.where(stat.c.utc_read_time >= query.start)
+    if query.end is not None:
+        statement = statement.where(stat.c.utc_read_time < query.end)
+    if query.event_id is not None:
+        statement = statement.where(_in_filter(stat.c.event_id, query.event_id))
+    if query.performer_id is not None or query.venue_id is not None:
+        pev = sa.table(PEV_TABLE, *[sa.column(c) for c in ("event_id", "performer_id", "venue_id")])
+        linked = sa.select(pev.c.event_id).where(
+            *pev_filters(pev, query.model_copy(update={"event_id": None}))
+        )
+        statement = statement.where(stat.c.event_id.in_(linked))
+    return statement
+
+
+def iter_read(
+    engine, statement: sa.Select, chunksize: int, parse_dates: typing.Iterable[str] = ()
+) -> typing.Iterator[pd.DataFrame]:
+    """
+    streams the result of statement as dataframes of at most chunksize rows,
+    using a server side cursor where the driver supports one
+    :param engine:
+    :param statement:
+    :param chunksize:
+    :param parse_dates:
+    :return:
+    """
+    selected = [c.name for c in statement.selected_columns]
+    parse_dates = [c for c in parse_dates if c in selected]
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(statement, conn, chunksize=chunksize, parse_dates=parse_dates)
+
+
+def read_frames(
+    engine, statement: sa.Select, chunksize: int, parse_dates: typing.Iterable[str] = ()
+) -> pd.DataFrame:
+    """
+    reads statement in chunks and concatenates them. chunking bounds each fetch
+    from the driver, not memory: the whole result is held in the returned frame.
+    callers that need bounded memory consume iter_read instead
+    :param engine:
+    :param statement:
+    :param chunksize:
+    :param parse_dates:
+    :return:
+    """
+    frames = list(iter_read(engine, statement, chunksize, parse_dates))
+    if not frames:
+        return pd.DataFrame(columns=[c.name for c in statement.selected_columns])
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_stats(engine, query: schema.StatQuery) -> pd.DataFrame:
+    """
+    returns the stat rows and columns selected by query
+    :param engine:
+    :param query:
+    :return:
+    """
+    return read_frames(engine, stat_select(query), query.chunksize, ["utc_read_time"])
+
+
+def read_performer_event_venue(engine, query: schema.StatQuery) -> pd.DataFrame:
+    """
+    returns the performer_event_venue rows selected by the id filters of query
+    :param engine:
+    :param query:
+    :return:
+    """
+    pev = reflect_table(engine, PEV_TABLE)
+    return read_frames(engine, pev_select(pev, query), query.chunksize)
+
+
+def multi_row_chunksize(df: pd.DataFrame, engine, max_packet_bytes: int = MAX_PACKET_BYTES) -> int:
+    """
+    returns the number of rows per multi-row INSERT ... VALUES statement so a
+    statement stays below max_packet_bytes, and below the bound parameter limit on sqlite
+    :param df:
+    :param engine:
+    :param max_packet_bytes:
+    :return:
+    """
+    sample = df.head(1000)
+    # rendered values plus quoting, separators and parameter overhead
+    row_bytes = max(1, 2 * len(sample.to_csv(index=False, header=False).encode()) // max(1, len(sample)))
+    rows = max(1, max_packet_bytes // row_bytes)
+    if engine.dialect.name == "sqlite":
+        rows = min(rows, SQLITE_MAX_VARIABLES // max(1, len(df.columns)))
+    return rows
+
+
+def _stat_table(conn, df: pd.DataFrame, table_name: str) -> sa.Table:
+    """
+    returns the reflected table, creating it from the dtypes of df when missing
+    :param conn:
+    :param df:
+    :param table_name:
+    :return:
+    """
+    if not has_table(conn, table_name):
+        df.head(0).to_sql(table_name, conn, index=False)
+    return reflect_table(conn, table_name)
+
+
+def write_multi(df: pd.DataFrame, engine, table_name: str = STAT_TABLE) -> int:
+    """
+    appends df with multi-row INSERT ... VALUES statements sized by multi_row_chunksize
+    :param df:
+    :param engine:
+    :param table_name:
+    :return: rows written
+    """
+    df.to_sql(
+        table_name,
+        engine,
+        if_exists="append",
+        index=False,
+        method="multi",
+        chunksize=multi_row_chunksize(df, engine),
+    )
+    return len(df)
+
+
+# placeholder for one bound value, by DBAPI paramstyle
+PARAMSTYLE_PLACEHOLDERS = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+
+
+def _to_rows(df: pd.DataFrame) -> typing.List[tuple]:
+    """
+    returns df as a list of tuples of python scalars. datetimes are rendered as
+    'YYYY-MM-DD HH:MM:SS.ffffff' strings, missing values as None
+    :param df:
+    :return:
+    """
+    columns = []
+    for column in df.columns:
+        values = df[column]
+        if is_datetime64_any_dtype(values):
+            values = values.dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        values = values.astype(object).where(values.notna(), None)
+        columns.append(values.tolist())
+    return list(zip(*columns))
+
+
+def write_executemany(df: pd.DataFrame, engine, table_name: str = STAT_TABLE) -> int:
+    """
+    appends df with one prepared INSERT run through the DBAPI cursor.executemany
+    over batches of plain tuples
+    :param df:
+    :param engine:
+    :param table_name:
+    :return: rows written
+    """
+    placeholder = PARAMSTYLE_PLACEHOLDERS[engine.dialect.paramstyle]
+    preparer = engine.dialect.identifier_preparer
+    statement = (
+        f"INSERT INTO {preparer.quote(table_name)} "
+        f"({', '.join(preparer.quote(c) for c in df.columns)}) "
+        f"VALUES ({', '.join([placeholder] * len(df.columns))})"
+    )
+    with engine.begin() as conn:
+        _stat_table(conn, df, table_name)
+        for start in range(0, len(df), EXECUTEMANY_CHUNKSIZE):
+            conn.exec_driver_sql(statement, _to_rows(df.iloc[start:start + EXECUTEMANY_CHUNKSIZE]))
+    return len(df)
+
+
+def write_load_data(df: pd.DataFrame, engine, table_name: str = STAT_TABLE) -> int:
+    """
+    appends df through a temporary csv file and LOAD DATA LOCAL INFILE (mysql only).
+    the engine must allow local infile, e.g. connect_args={"allow_local_infile": True}
+    :param df:
+    :param engine:
+    :param table_name:
+    :return: rows written
+    """
+    if engine.dialect.name != "mysql":
+        raise ValueError(f"load_data writer requires mysql, got {engine.dialect.name}")
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as f:
+        df.to_csv(f, index=False, header=False, na_rep="\\N", quoting=csv.QUOTE_MINIMAL)
+        path = f.name
+    try:
+        with engine.begin() as conn:
+            _stat_table(conn, df, table_name)
+            columns = ", ".join(f"`{c}`" for c in df.columns)
+            conn.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE `{table_name}` "
+                f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                f"LINES TERMINATED BY '\\n' ({columns})"
+            )
+    finally:
+        os.remove(path)
+    return len(df)
+
+
+STAT_WRITERS = {
+    "multi": write_multi,
+    "executemany": write_executemany,
+    "load_data": write_load_data,
+}
+# writer used for an engine dialect when none is chosen. mysql-connector rewrites
+# executemany INSERTs into multi-row statements itself
+DEFAULT_STAT_WRITERS = {
+    "mysql": "executemany",
+    "sqlite": "executemany",
+    "postgresql": "executemany",
+}
+
+
+def write_stats(df: pd.DataFrame, engine, writer: typing.Optional[str] = None) -> int:
+    """
+    appends rows to the stat table with the named bulk writer, or the default
+    writer for the engine dialect
+    :param df:
+    :param engine:
+    :param writer: one of STAT_WRITERS
+    :return: rows written
+    """
+    if df.empty:
+        return 0
+    writer = writer or DEFAULT_STAT_WRITERS.get(engine.dialect.name, "executemany")
+    return STAT_WRITERS[writer](df, engine, STAT_TABLE)
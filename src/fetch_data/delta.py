@@ -0,0 +1,198 @@
+"""
+change-only stat snapshots: a new stat row is only written when a price or
+listing count moved since the last stored row of its event (or a heartbeat
+interval passed), and read_forward_filled fills the gaps back into a regular
+series. push_to_db only suppresses rows given last_values; the other readers of
+the stat table, buckets and rollups expect every snapshot, so it is opt-in
+"""
+import threading
+import typing
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+import src.fetch_data.db as db
+import src.fetch_data.schema as schema
+
+# stat columns compared between snapshots
+VALUE_COLUMNS = [c for c in db.STAT_COLUMNS if c not in ("event_id", "utc_read_time")]
+# an unchanged event is still written once a day so readers can tell it is tracked
+DEFAULT_HEARTBEAT = pd.Timedelta(days=1)
+
+
+def latest_stats(
+        engine, event_ids: typing.Iterable, before: typing.Optional[pd.Timestamp] = None
+) -> pd.DataFrame:
+    """
+    returns the most recent stored stat row of each event, optionally the most
+    recent one read before a time
+    :param engine:
+    :param event_ids:
+    :param before: only rows with utc_read_time < before are considered
+    :return:
+    """
+    stat = sa.table(db.STAT_TABLE, *[
+        sa.column(c, sa.DateTime if c == "utc_read_time" else None) for c in db.STAT_COLUMNS
+    ])
+    frames = []
+    for batch in db.batched([db._native(e) for e in pd.unique(pd.Series(event_ids))], db.KEY_QUERY_BATCH):
+        latest = sa.select(
+            stat.c.event_id, sa.func.max(stat.c.utc_read_time).label("latest_read_time")
+        ).where(stat.c.event_id.in_(batch))
+        if before is not None:
+            latest = latest.where(stat.c.utc_read_time < pd.Timestamp(before).to_pydatetime())
+        latest = latest.group_by(stat.c.event_id).subquery()
+        statement = sa.select(*stat.c).join(
+            latest,
+            sa.and_(stat.c.event_id == latest.c.event_id, stat.c.utc_read_time == latest.c.latest_read_time),
+        )
+        frames.append(db.read_frames(engine, statement, db.KEY_QUERY_BATCH, ["utc_read_time"]))
+    if not frames:
+        return pd.DataFrame(columns=db.STAT_COLUMNS)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("event_id", keep="last")
+
+
+def _same(new: pd.Series, last: pd.Series) -> np.ndarray:
+    """elementwise equality of numeric columns, missing == missing"""
+    new = new.to_numpy(dtype=np.float64, na_value=np.nan)
+    last = last.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.isclose(new, last, rtol=1e-6, atol=1e-9) | (np.isnan(new) & np.isnan(last))
+
+
+class LastValueCache:
+    """
+    last written stat values per event_id, kept in process between runs and
+    seeded from the stat table for events it has not seen yet
+    """
+    def __init__(self):
+        self.values = pd.DataFrame(columns=db.STAT_COLUMNS).set_index("event_id")
+        self._seeded = set()
+        self._lock = threading.Lock()
+
+    def seed(self, engine, event_ids: typing.Iterable):
+        """
+        loads the last stored row of every event not seen before
+        :param engine:
+        :param event_ids:
+        :return:
+        """
+        unseen = [e for e in pd.unique(pd.Series(event_ids)) if e not in self._seeded]
+        if not unseen:
+            return
+        if db.has_table(engine, db.STAT_TABLE):
+            self.update(latest_stats(engine, unseen))
+        with self._lock:
+            self._seeded.update(unseen)
+
+    def update(self, stats: pd.DataFrame):
+        """
+        records the last row of each event in stats as its last written value
+        :param stats:
+        :return:
+        """
+        if stats.empty:
+            return
+        last = stats.drop_duplicates("event_id", keep="last").set_index("event_id")
+        with self._lock:
+            self.values = pd.concat([self.values.loc[~self.values.index.isin(last.index)], last])
+
+    def filter_changed(
+            self, stats: pd.DataFrame, heartbeat: typing.Optional[pd.Timedelta] = None
+    ) -> pd.DataFrame:
+        """
+        returns the rows of stats that differ from the last value of their event,
+        rows of events without a last value, and rows at least heartbeat after it
+        :param stats:
+        :param heartbeat: write an unchanged row when the last one is this old
+        :return:
+        """
+        with self._lock:
+            last = self.values.reindex(stats["event_id"].values)
+        columns = [c for c in VALUE_COLUMNS if c in stats.columns and c in last.columns]
+        known = last[columns].notna().any(axis=1).values
+        same = np.ones(len(stats), dtype=bool)
+        for column in columns:
+            same &= _same(stats[column], last[column])
+        keep = ~known | ~same
+        if heartbeat is not None:
+            last_read = pd.to_datetime(last["utc_read_time"]).to_numpy()
+            elapsed = pd.to_datetime(stats["utc_read_time"]).to_numpy() - last_read
+            keep |= ~pd.isna(elapsed) & (elapsed >= pd.Timedelta(heartbeat).to_timedelta64())
+        return stats.loc[keep]
+
+
+def suppress_unchanged(
+        stats: pd.DataFrame,
+        engine,
+        last_values: LastValueCache,
+        heartbeat: typing.Optional[pd.Timedelta] = None,
+) -> pd.DataFrame:
+    """
+    returns the rows of stats worth writing. the caller records them with
+    last_values.update once they are written, so rows of a failed write are not
+    suppressed later
+    :param stats:
+    :param engine:
+    :param last_values:
+    :param heartbeat:
+    :return:
+    """
+    last_values.seed(engine, stats["event_id"])
+    return last_values.filter_changed(stats, heartbeat)
+
+
+def forward_fill_stats(
+        stats: pd.DataFrame, freq: str = "h", end: typing.Optional[pd.Timestamp] = None
+) -> pd.DataFrame:
+    """
+    returns a regular series per event: one row per freq bucket from the first
+    snapshot of each event until end, holding the last snapshot read up to that bucket
+    :param stats: change-only stat rows
+    :param freq: bucket frequency
+    :param end: last bucket, defaults to the latest utc_read_time in stats
+    :return:
+    """
+    if stats.empty:
+        return stats
+    stats = stats.assign(utc_read_time=pd.to_datetime(stats["utc_read_time"]))
+    end = pd.Timestamp(end) if end is not None else stats["utc_read_time"].max()
+    # an empty row at end per event extends every series to the same last bucket
+    tails = pd.DataFrame({"event_id": stats["event_id"].unique(), "utc_read_time": end})
+    filled = (
+        pd.concat([stats, tails], ignore_index=True)
+        .set_index("utc_read_time")
+        .groupby("event_id")
+        .resample(freq)
+        .last()
+        .drop(columns="event_id", errors="ignore")
+        .groupby(level="event_id")
+        .ffill()
+        .reset_index()
+    )
+    return filled[[c for c in stats.columns if c in filled.columns]]
+
+
+def read_forward_filled(engine, query: schema.StatQuery, freq: str = "h") -> pd.DataFrame:
+    """
+    reads change-only stat rows selected by query and forward fills them to a
+    regular series. the last row before query.start seeds each series
+    :param engine:
+    :param query:
+    :param freq:
+    :return:
+    """
+    stats = db.read_stats(engine, query)
+    if query.start is not None:
+        # events that did not change inside the window still have a value in it
+        before = db.stat_select(
+            query.model_copy(update={"start": None, "end": query.start, "columns": ["event_id"]})
+        ).distinct()
+        with engine.connect() as conn:
+            event_ids = [row[0] for row in conn.execute(before)]
+        earlier = latest_stats(engine, event_ids, before=query.start)
+        if not earlier.empty:
+            earlier = earlier.assign(utc_read_time=pd.Timestamp(query.start))[stats.columns]
+            stats = pd.concat([earlier, stats], ignore_index=True)
+    end = pd.Timestamp(query.end) - pd.Timedelta(1, "ns") if query.end is not None else None
+    return forward_fill_stats(stats, freq, end)
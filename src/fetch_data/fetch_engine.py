@@ -0,0 +1,167 @@
+"""
+chunked, paginated and concurrent requests against the seatgeek api
+"""
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from src.scalpyr import ScalpyrPro
+
+# max ids submitted in a single comma separated id filter
+MAX_IDS_PER_REQUEST = 50
+# conservative bound on the length of the characters an id filter may add to a request url,
+# leaves room for the endpoint, client id and the other query parameters
+MAX_ID_PARAM_CHARS = 1500
+# url encoded length of the separator between ids ("," -> "%2C")
+ID_SEPARATOR_CHARS = 3
+DEFAULT_PER_PAGE = 100
+DEFAULT_MAX_WORKERS = 8
+# max number of pages requested for a single chunk, guards against runaway paging
+MAX_PAGES = 100
+
+# watchlist id kind -> seatgeek events endpoint filter
+EVENT_ID_FILTERS = {
+    'venue': 'venue.id',
+    'performers': 'performers.id',
+    'events': 'id',
+}
+
+
+def chunk_ids(
+        ids: typing.Iterable,
+        size: int = MAX_IDS_PER_REQUEST,
+        max_chars: int = MAX_ID_PARAM_CHARS,
+) -> typing.List[typing.List[str]]:
+    """
+    splits ids into lists of at most size ids whose joined, url encoded length stays
+    within max_chars. duplicates are dropped, order is kept
+    :param ids:
+    :param size:
+    :param max_chars:
+    :return:
+    """
+    chunks = []
+    chunk, chunk_chars = [], 0
+    for id_ in dict.fromkeys(str(i) for i in ids):
+        id_chars = len(id_) + (ID_SEPARATOR_CHARS if chunk else 0)
+        if chunk and (len(chunk) == size or chunk_chars + id_chars > max_chars):
+            chunks.append(chunk)
+            chunk, chunk_chars = [], 0
+            id_chars = len(id_)
+        chunk.append(id_)
+        chunk_chars += id_chars
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class FetchEngine:
+    """
+    submits requests to a shared ScalpyrPro client from a bounded thread pool.
+    id lists are split into api sized chunks and every chunk is paged through
+    until a short page is returned
+    """
+    def __init__(
+            self,
+            client: ScalpyrPro,
+            max_workers: int = DEFAULT_MAX_WORKERS,
+            chunk_size: int = MAX_IDS_PER_REQUEST,
+            per_page: int = DEFAULT_PER_PAGE,
+    ):
+        self.client = client
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.per_page = per_page
+
+    def iter_pages(self, method: str, params: dict) -> typing.Iterator[pd.DataFrame]:
+        """
+        yields each page returned by client.<method>(params), stops on the first
+        page holding fewer than per_page rows
+        :param method: name of the ScalpyrPro method, e.g. 'get_events'
+        :param params: seatgeek query parameters
+        :return:
+        """
+        fetch = getattr(self.client, method)
+        for page in range(1, MAX_PAGES + 1):
+            result = fetch({**params, 'per_page': self.per_page, 'page': page})
+            if result is None or len(result) == 0:
+                return
+            yield result
+            if len(result) < self.per_page:
+                return
+
+    def fetch_all_pages(self, method: str, params: dict) -> pd.DataFrame:
+        """
+        returns every page of client.<method>(params) concatenated
+        :param method:
+        :param params:
+        :return:
+        """
+        pages = list(self.iter_pages(method, params))
+        return pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+
+    def fetch_requests(self, method: str, requests: typing.List[dict]) -> pd.DataFrame:
+        """
+        pages through every request concurrently and concatenates the results
+        :param method: name of the ScalpyrPro method, e.g. 'get_events'
+        :param requests: list of seatgeek query parameter dicts
+        :return:
+        """
+        if not requests:
+            return pd.DataFrame()
+        workers = max(1, min(self.max_workers, len(requests)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(lambda p: self.fetch_all_pages(method, p), requests))
+        frames = [f for f in frames if len(f) > 0]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def map_chunks(
+            self,
+            method: str,
+            id_param: str,
+            ids: typing.Iterable,
+            params: typing.Optional[dict] = None,
+    ) -> pd.DataFrame:
+        """
+        fetches every chunk of ids concurrently, each chunk submitted as
+        {id_param: 'id1,id2,...'} merged with params
+        :param method: name of the ScalpyrPro method
+        :param id_param: query parameter the ids are submitted under
+        :param ids:
+        :param params: extra query parameters sent with every chunk
+        :return:
+        """
+        params = params or {}
+        requests = [
+            {**params, id_param: ','.join(chunk)} for chunk in chunk_ids(ids, self.chunk_size)
+        ]
+        return self.fetch_requests(method, requests)
+
+    def get_watchlist_events(
+            self,
+            venue_id: typing.Optional[typing.List[str]] = None,
+            performer_id: typing.Optional[typing.List[str]] = None,
+            event_id: typing.Optional[typing.List[str]] = None,
+            event_type: typing.Optional[str] = None,
+    ) -> pd.DataFrame:
+        """
+        returns the events of every venue, performer and event id in a watchlist,
+        chunks for all three id kinds share one pool. each event appears once
+        :param venue_id:
+        :param performer_id:
+        :param event_id:
+        :param event_type: seatgeek event type, e.g. 'concert'
+        :return:
+        """
+        params = {'type': event_type} if event_type else {}
+        requests = [
+            {**params, EVENT_ID_FILTERS[kind]: ','.join(chunk)}
+            for kind, ids in (('venue', venue_id), ('performers', performer_id), ('events', event_id))
+            for chunk in chunk_ids(ids or [], self.chunk_size)
+        ]
+        events = self.fetch_requests('get_events', requests)
+        if events.empty:
+            return events
+        # keep first instance of each event id
+        return events.drop_duplicates(subset=['id']).reset_index(drop=True)
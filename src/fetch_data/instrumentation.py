@@ -0,0 +1,168 @@
+"""
+structured instrumentation of ingestion runs: stage timers with row counts,
+json log lines, peak rss and an optional profiler dump.
+set SG_PROFILE=cprofile or SG_PROFILE=pyinstrument to profile each run into SG_PROFILE_DIR
+"""
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import typing
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+LOGGER_NAME = "sg_event_stats"
+PROFILE_ENV = "SG_PROFILE"
+PROFILE_DIR_ENV = "SG_PROFILE_DIR"
+
+logger = logging.getLogger(LOGGER_NAME)
+_local = threading.local()
+
+
+class JsonFormatter(logging.Formatter):
+    """formats a record as one json object: time, level, event and the record's fields"""
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+def configure_logging(level: int = logging.INFO, stream: typing.TextIO = sys.stdout) -> logging.Logger:
+    """
+    sends the instrumentation logger's records to stream as json lines
+    :param level:
+    :param stream:
+    :return:
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def log_event(event: str, **fields):
+    """
+    logs an event with fields as a json line
+    :param event:
+    :param fields:
+    :return:
+    """
+    logger.info(event, extra={"fields": fields})
+
+
+def peak_rss_bytes() -> typing.Optional[int]:
+    """returns the peak resident set size of the process, None where it is not available"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _current_run() -> typing.Optional[dict]:
+    return getattr(_local, "run", None)
+
+
+@contextlib.contextmanager
+def stage(name: str, **fields) -> typing.Iterator[dict]:
+    """
+    times the block and logs a 'stage' event with its seconds and peak rss.
+    counts added to the yielded dict are logged with it and summed into the
+    enclosing run
+    :param name: stage name, e.g. 'api_fetch'
+    :param fields: logged with the stage
+    :return:
+    """
+    counts = dict(fields)
+    started = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        seconds = time.perf_counter() - started
+        log_event("stage", stage=name, seconds=round(seconds, 4), peak_rss_bytes=peak_rss_bytes(), **counts)
+        current = _current_run()
+        if current is not None:
+            current["stages"][name] = current["stages"].get(name, 0.0) + seconds
+            for key, value in counts.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    current["counts"][f"{name}.{key}"] = current["counts"].get(f"{name}.{key}", 0) + value
+
+
+@contextlib.contextmanager
+def profiled(name: str) -> typing.Iterator[None]:
+    """
+    profiles the block when SG_PROFILE is set, writing <name>-<time>.prof (cprofile)
+    or .html (pyinstrument) to SG_PROFILE_DIR, default ./profiles
+    :param name:
+    :return:
+    """
+    profiler_name = os.environ.get(PROFILE_ENV, "").lower()
+    if not profiler_name:
+        yield
+        return
+    out_dir = Path(os.environ.get(PROFILE_DIR_ENV, "profiles"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = out_dir / f"{name}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}"
+    if profiler_name == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = stem.with_suffix(".html")
+            path.write_text(profiler.output_html())
+            log_event("profile", run=name, path=str(path))
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = stem.with_suffix(".prof")
+        profiler.dump_stats(path)
+        log_event("profile", run=name, path=str(path))
+
+
+@contextlib.contextmanager
+def run(name: str, **fields) -> typing.Iterator[dict]:
+    """
+    collects the stages timed in the block on this thread and logs a 'run' summary
+    with seconds per stage, summed counts and peak rss. the block is profiled when
+    SG_PROFILE is set
+    :param name:
+    :param fields: logged with the summary
+    :return: the summary being collected
+    """
+    summary = {"run": name, "stages": {}, "counts": {}, **fields}
+    previous = _current_run()
+    _local.run = summary
+    started = time.perf_counter()
+    try:
+        with profiled(name):
+            yield summary
+    finally:
+        _local.run = previous
+        summary["seconds"] = round(time.perf_counter() - started, 4)
+        summary["stages"] = {k: round(v, 4) for k, v in summary["stages"].items()}
+        summary["peak_rss_bytes"] = peak_rss_bytes()
+        log_event("run", **summary)
@@ -0,0 +1,141 @@
+"""
+background job queue for the ingestion endpoint: one worker thread runs jobs one
+at a time, and triggers arriving while a job is running coalesce into a single
+follow-up job
+"""
+import queue
+import threading
+import time
+import traceback
+import typing
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from src.fetch_data.schema import JobStatus
+
+# finished jobs kept for the status endpoint
+MAX_FINISHED_JOBS = 100
+
+
+class Job:
+    """
+    handle passed to the job function to report the stage being run
+    """
+    def __init__(self, status: JobStatus, lock: threading.Lock):
+        self.status = status
+        self._lock = lock
+        self._stage_started = None
+
+    def stage(self, name: str):
+        """
+        finishes the current stage, recording its duration, and starts the next
+        :param name:
+        :return:
+        """
+        self.finish()
+        with self._lock:
+            self.status.stage = name
+        self._stage_started = time.perf_counter()
+
+    def finish(self):
+        """records the duration of the current stage"""
+        if self._stage_started is None:
+            return
+        elapsed = round(time.perf_counter() - self._stage_started, 3)
+        with self._lock:
+            self.status.timings[self.status.stage] = elapsed
+        self._stage_started = None
+
+
+class JobQueue:
+    """
+    runs submitted jobs on a single worker thread. while a job is running at most
+    one more is queued: submit returns the id of the queued job instead of adding
+    another, so overlapping triggers never run the pipeline twice concurrently
+    """
+    def __init__(self, run: typing.Callable[[Job], typing.Optional[dict]], max_finished: int = MAX_FINISHED_JOBS):
+        """
+        :param run: job function, called with a Job, returns the job result
+        :param max_finished: finished jobs kept for status lookups
+        """
+        self.run = run
+        self.max_finished = max_finished
+        self._jobs: typing.Dict[str, JobStatus] = OrderedDict()
+        self._pending: typing.Optional[str] = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self) -> JobStatus:
+        """
+        queues a job unless one is already waiting to run
+        :return: status of the queued job
+        """
+        with self._lock:
+            if self._pending is not None:
+                return self._jobs[self._pending].model_copy(deep=True)
+            status = JobStatus(id=uuid.uuid4().hex, submitted_at=datetime.now(timezone.utc))
+            self._jobs[status.id] = status
+            self._pending = status.id
+            self._prune()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, daemon=True)
+                self._worker.start()
+        self._queue.put(status.id)
+        return status.model_copy(deep=True)
+
+    def get(self, job_id: str) -> typing.Optional[JobStatus]:
+        """
+        returns a snapshot of a job's status, None for unknown ids
+        :param job_id:
+        :return:
+        """
+        with self._lock:
+            status = self._jobs.get(job_id)
+            return status.model_copy(deep=True) if status is not None else None
+
+    def join(self, timeout: typing.Optional[float] = None) -> bool:
+        """
+        waits until every queued job has finished
+        :param timeout: seconds to wait, forever when None
+        :return: whether the queue drained in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _prune(self):
+        """drops the oldest finished jobs beyond max_finished"""
+        finished = [k for k, s in self._jobs.items() if s.state in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                self._pending = None
+                status = self._jobs[job_id]
+                status.state = "running"
+                status.started_at = datetime.now(timezone.utc)
+            job = Job(status, self._lock)
+            try:
+                result = self.run(job)
+                job.finish()
+                with self._lock:
+                    status.result = result
+                    status.state = "succeeded"
+                    status.finished_at = datetime.now(timezone.utc)
+            except Exception as e:
+                job.finish()
+                traceback.print_exc()
+                with self._lock:
+                    status.error = f"{type(e).__name__}: {e}"
+                    status.state = "failed"
+                    status.finished_at = datetime.now(timezone.utc)
+            finally:
+                self._queue.task_done()
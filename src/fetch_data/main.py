@@ -1,6 +1,13 @@
-from sqlalchemy import create_engine
-from src.scalpyr import ScalpyrPro
+import os
+import typing
+
 from src.fetch_data.table_builders import SeatgeekData
+import src.fetch_data.connections as connections
+from src.fetch_data.jobs import Job, JobQueue
+import src.fetch_data.delta as delta
+import src.fetch_data.sharding as sharding
+import src.fetch_data.watchlists as watchlists
+import src.fetch_data.instrumentation as instrumentation
 import env
 from flask import Flask
 import pydantic
@@ -10,6 +17,15 @@ import certifi
 import src.watchlist
 
 ca = certifi.where()
+# 'latest' ingests the latest event-tracking watchlist, 'all' every active user watchlist
+WATCHLIST_MODE = os.environ.get('WATCHLIST_MODE', 'latest')
+WATCHLIST_DATABASE = os.environ.get('WATCHLIST_DATABASE', 'event-tracking')
+WATCHLIST_COLLECTION = os.environ.get('WATCHLIST_COLLECTION', 'watchlist')
+# worker processes the watchlist is ingested by, see sharding. 1 runs in process
+INGEST_SHARDS = int(os.environ.get('INGEST_SHARDS', 1))
+# '1' writes only the stat rows that changed, see delta. off until the analysis
+# readers, buckets and rollups read the sparse stat table through delta.read_forward_filled
+SUPPRESS_UNCHANGED = os.environ.get('SUPPRESS_UNCHANGED', '0') == '1'
 
 
 # pydantic class that represents the incoming request body:
@@ -19,18 +35,131 @@ class TrackEvents(pydantic.BaseModel):
 
 
 app = Flask(__name__)
+# last written stats per event, kept across requests to skip unchanged snapshots with SUPPRESS_UNCHANGED
+last_values = delta.LastValueCache()
+# created on first use and reused by every job, see connections for the engine and seatgeek client
+_watchlist_client = None
+_mongo_client = None
+
+
+def get_watchlist_client():
+    global _watchlist_client
+    if _watchlist_client is None:
+        _watchlist_client = src.watchlist.MongoWatchlistClient(env.WATCHLIST_API_KEY)
+    return _watchlist_client
+
+
+def get_active_watchlists() -> typing.List[WatchListResponse]:
+    """
+    returns the latest active watchlist of each user
+    :return:
+    """
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = MongoClient(env.MONGO_URL, tlsCAFile=ca)
+    return watchlists.read_latest_watchlists(_mongo_client[WATCHLIST_DATABASE][WATCHLIST_COLLECTION])
+
+
+def update_database(job: Job) -> dict:
+    """
+    fetches the latest watchlist, builds its tables and pushes them to the database
+    :param job: reports the stage being run
+    :return: row counts of the pushed tables
+    """
+    job.stage('watchlist')
+    user_watchlists = None
+    if WATCHLIST_MODE == 'all':
+        # each distinct id is fetched once however many watchlists hold it
+        user_watchlists = get_active_watchlists()
+        watchlist = watchlists.merge_watchlists(user_watchlists)
+    else:
+        watchlist = get_watchlist_client().get_latest('event-tracking')
+    if INGEST_SHARDS > 1:
+        job.stage('sharded')
+        metrics, performer_event_venue = sharding.run_sharded(
+            watchlist, INGEST_SHARDS, suppress_unchanged=SUPPRESS_UNCHANGED
+        )
+        result = {'events': metrics['events'], 'stat': metrics['stat'], 'shards': metrics}
+        return attribute(job, user_watchlists, performer_event_venue, result)
+    job.stage('fetch')
+    seatgeek_data = SeatgeekData.from_watchlist(connections.get_client(), **watchlist)
+    job.stage('compact')
+    full_size = seatgeek_data.memory_report()
+    seatgeek_data.compact()
+    compact_size = seatgeek_data.memory_report()
+    instrumentation.log_event(
+        'compacted',
+        bytes_before=int(full_size.loc['total', 'bytes']),
+        bytes_after=int(compact_size.loc['total', 'bytes']),
+    )
+    job.stage('push')
+    engine = connections.get_engine()
+    seatgeek_data.push_to_db(
+        engine, last_values=last_values if SUPPRESS_UNCHANGED else None, heartbeat=delta.DEFAULT_HEARTBEAT
+    )
+    result = {
+        'events': len(seatgeek_data.event),
+        'stat': len(seatgeek_data.stat),
+    }
+    return attribute(job, user_watchlists, seatgeek_data.performer_event_venue, result)
+
+
+def attribute(job: Job, user_watchlists, performer_event_venue, result: dict) -> dict:
+    """
+    records which watchlists asked for the written events when every watchlist was ingested
+    :param job:
+    :param user_watchlists: None when only the latest watchlist was ingested
+    :param performer_event_venue: written rows
+    :param result: counts of update_database, updated in place
+    :return: result
+    """
+    engine = connections.get_engine()
+    if user_watchlists is not None:
+        job.stage('attribution')
+        attribution = watchlists.attribute_events(user_watchlists, performer_event_venue)
+        result['watchlists'] = len(user_watchlists)
+        result['watchlist_event'] = watchlists.push_attribution(attribution, engine)['inserted']
+    result['connections'] = connections.connection_stats(engine)
+    return result
+
+
+def run_update(job: Job) -> dict:
+    """
+    runs update_database as an instrumented run, its summary is added to the job result
+    :param job:
+    :return:
+    """
+    with instrumentation.run('update_database', job_id=job.status.id) as summary:
+        result = update_database(job)
+    return {**result, 'stages': summary['stages'], 'peak_rss_bytes': summary['peak_rss_bytes']}
+
+
+jobs = JobQueue(run_update)
 
 
 @app.route('/', methods=['POST'])
 def handle_request():
-    client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
-    watchlist_client = src.watchlist.MongoWatchlistClient(env.WATCHLIST_API_KEY)
-    watchlist = watchlist_client.get_latest('event-tracking')
-    seatgeek_data = SeatgeekData.from_watchlist(client, **watchlist)
-    engine = create_engine(env.PLANETSCALE_URL)
-    seatgeek_data.push_to_db(engine)
-    return 'Updated database'
+    """
+    queues a database update and returns its job id at once, see /jobs/<job_id>
+    :return:
+    """
+    status = jobs.submit()
+    return {'job_id': status.id, 'state': status.state}, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    returns the state, current stage and stage timings of a job
+    :param job_id:
+    :return:
+    """
+    status = jobs.get(job_id)
+    if status is None:
+        return {'error': f'unknown job {job_id}'}, 404
+    return status.model_dump(mode='json')
 
 
 if __name__ == '__main__':
+    instrumentation.configure_logging()
     app.run(host='0.0.0.0', port=8080)
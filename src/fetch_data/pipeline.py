@@ -0,0 +1,133 @@
+"""
+streaming ingestion: each page of events is built into tables and written to the
+database before the page after next is fetched, so peak memory is bounded by the
+page size instead of the size of the watchlist
+"""
+import queue
+import threading
+import typing
+
+import pandas as pd
+
+from src.fetch_data.fetch_engine import EVENT_ID_FILTERS, FetchEngine, chunk_ids
+from src.fetch_data.table_builders import SeatgeekData
+from src.fetch_data.instrumentation import log_event
+
+# number of pages fetched ahead of the page being built and written
+PREFETCH_PAGES = 1
+# how often a producer blocked on a full buffer checks that the consumer is still there
+PREFETCH_POLL_SECONDS = 0.1
+
+
+def iter_watchlist_pages(
+        fetcher: FetchEngine,
+        venue_id: typing.Optional[typing.List[str]] = None,
+        performer_id: typing.Optional[typing.List[str]] = None,
+        event_id: typing.Optional[typing.List[str]] = None,
+        event_type: typing.Optional[str] = 'concert',
+        **_
+) -> typing.Iterator[pd.DataFrame]:
+    """
+    yields pages of events for every chunk of watchlist ids, one request at a time
+    :param fetcher:
+    :param venue_id:
+    :param performer_id:
+    :param event_id:
+    :param event_type:
+    :return:
+    """
+    params = {'type': event_type} if event_type else {}
+    for kind, ids in (('venue', venue_id), ('performers', performer_id), ('events', event_id)):
+        for chunk in chunk_ids(ids or [], fetcher.chunk_size):
+            yield from fetcher.iter_pages('get_events', {**params, EVENT_ID_FILTERS[kind]: ','.join(chunk)})
+
+
+def prefetch(items: typing.Iterator, depth: int = PREFETCH_PAGES) -> typing.Iterator:
+    """
+    runs items in a background thread, holding at most depth items ahead of the consumer.
+    the thread stops once the consumer stops, also when it breaks or raises early
+    :param items:
+    :param depth:
+    :return:
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        # a full buffer would block forever once the consumer is gone
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(done)
+
+    threading.Thread(target=produce, name='prefetch', daemon=True).start()
+    try:
+        while (item := buffer.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_batches(pages: typing.Iterable[pd.DataFrame]) -> typing.Iterator[SeatgeekData]:
+    """
+    builds the tables of each page, events and performers already seen on an
+    earlier page are dropped
+    :param pages:
+    :return:
+    """
+    seen_events = set()
+    seen_performers = set()
+    for page in pages:
+        page = page.loc[~page['id'].isin(seen_events)].drop_duplicates(subset=['id'])
+        if page.empty:
+            continue
+        seen_events.update(page['id'])
+        batch = SeatgeekData.from_events(page.reset_index(drop=True))
+        performers = batch.performer.drop_duplicates(subset=['id'])
+        batch.performer = performers.loc[~performers['id'].isin(seen_performers)]
+        seen_performers.update(batch.performer['id'])
+        yield batch
+
+
+def run_watchlist(
+        fetcher: FetchEngine,
+        engine,
+        watchlist: dict,
+        prefetch_pages: int = PREFETCH_PAGES,
+) -> typing.Dict[str, int]:
+    """
+    fetches, builds and writes a watchlist page by page
+    :param fetcher:
+    :param engine:
+    :param watchlist: venue_id, performer_id and event_id lists
+    :param prefetch_pages: pages fetched ahead while a page is being written, 0 disables
+    :return: counts of batches, events, stat rows and performer_event_venue rows written
+    """
+    pages = iter_watchlist_pages(fetcher, **watchlist)
+    if prefetch_pages:
+        pages = prefetch(pages, prefetch_pages)
+    summary = {'batches': 0, 'events': 0, 'stat': 0, 'performer_event_venue': 0}
+    for batch in iter_batches(pages):
+        batch.push_to_db(engine)
+        summary['batches'] += 1
+        summary['events'] += len(batch.event)
+        summary['stat'] += len(batch.stat)
+        summary['performer_event_venue'] += len(batch.performer_event_venue)
+        log_event("batch_written", batch=summary['batches'], events=len(batch.event), stat=len(batch.stat))
+    return summary
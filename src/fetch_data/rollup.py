@@ -0,0 +1,314 @@
+"""
+hourly and daily per-event rollups of the stat table. each rollup row holds
+open/high/low/close of the lowest, median and average price, the max highest
+price, the min/max listing count and max visible listing count of the snapshots
+read during one bucket
+"""
+import typing
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+import src.fetch_data.db as db
+import src.fetch_data.schema as schema
+
+ROLLUP_PRICE_COLUMNS = ["lowest_price", "median_price", "average_price"]
+# resolution -> (table, bucket frequency)
+ROLLUPS = {
+    "hourly": ("stat_hourly", "h"),
+    "daily": ("stat_daily", "D"),
+}
+ROLLUP_KEY = ["event_id", "bucket"]
+# longest utc_read_time span read at each resolution by choose_resolution
+RESOLUTION_SPANS = [
+    ("raw", pd.Timedelta(days=3)),
+    ("hourly", pd.Timedelta(days=60)),
+]
+
+
+def compute_rollup(stats: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """
+    aggregates stat rows into one row per event_id and utc_read_time bucket
+    :param stats: stat rows
+    :param freq: bucket frequency, e.g. 'h' or 'D'
+    :return:
+    """
+    # snapshots without a highest price or visible listing count roll up to NaN
+    optional = {c: np.nan for c in ("highest_price", "visible_listing_count") if c not in stats.columns}
+    stats = stats.assign(
+        bucket=pd.to_datetime(stats["utc_read_time"]).dt.floor(freq), **optional
+    ).sort_values(["event_id", "utc_read_time"], kind="stable")
+    aggregations = {}
+    for price in ROLLUP_PRICE_COLUMNS:
+        aggregations.update(
+            {
+                f"{price}_open": (price, "first"),
+                f"{price}_high": (price, "max"),
+                f"{price}_low": (price, "min"),
+                f"{price}_close": (price, "last"),
+            }
+        )
+    aggregations.update(
+        highest_price_max=("highest_price", "max"),
+        listing_count_min=("listing_count", "min"),
+        listing_count_max=("listing_count", "max"),
+        visible_listing_count_max=("visible_listing_count", "max"),
+        n=("utc_read_time", "size"),
+        first_read_time=("utc_read_time", "min"),
+        last_read_time=("utc_read_time", "max"),
+    )
+    return stats.groupby(ROLLUP_KEY, sort=False).agg(**aggregations).reset_index()
+
+
+def merge_rollups(rollups: pd.DataFrame) -> pd.DataFrame:
+    """
+    combines rollup rows sharing event_id and bucket, e.g. a stored row and the
+    row computed from new snapshots. open comes from the earliest read, close from the latest
+    :param rollups:
+    :return:
+    """
+    rollups = rollups.sort_values(["first_read_time", "last_read_time"], kind="stable")
+    aggregations = {}
+    for price in ROLLUP_PRICE_COLUMNS:
+        aggregations.update(
+            {
+                f"{price}_open": "first",
+                f"{price}_high": "max",
+                f"{price}_low": "min",
+                f"{price}_close": "last",
+            }
+        )
+    aggregations.update(
+        highest_price_max="max",
+        listing_count_min="min",
+        listing_count_max="max",
+        visible_listing_count_max="max",
+        n="sum",
+        first_read_time="min",
+        last_read_time="max",
+    )
+    return rollups.groupby(ROLLUP_KEY, sort=False).agg(aggregations).reset_index()
+
+
+def _parse_times(rollups: pd.DataFrame) -> pd.DataFrame:
+    for column in ("bucket", "first_read_time", "last_read_time"):
+        rollups[column] = pd.to_datetime(rollups[column], format="mixed")
+    return rollups
+
+
+def _add_missing_columns(conn, table: sa.Table, rollup: pd.DataFrame) -> sa.Table:
+    """
+    adds the columns of rollup a stored rollup table was created without, as nullable floats
+    :param conn:
+    :param table:
+    :param rollup:
+    :return: the table reflected again when columns were added
+    """
+    missing = [c for c in rollup.columns if c not in table.c]
+    if not missing:
+        return table
+    quote = conn.dialect.identifier_preparer.quote
+    for column in missing:
+        conn.execute(sa.text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column)} FLOAT"))
+    return db.reflect_table(conn, table.name)
+
+
+def update_rollup(stats: pd.DataFrame, engine, table_name: str, freq: str) -> int:
+    """
+    folds new stat rows into a rollup table. stored rows of the events in stats
+    from their earliest new bucket on are read, those sharing a bucket with the
+    new rows are rewritten
+    :param stats:
+    :param engine:
+    :param table_name:
+    :param freq:
+    :return: rollup rows written
+    """
+    rollup = compute_rollup(stats, freq)
+    with engine.begin() as conn:
+        if db.has_table(conn, table_name):
+            table = _add_missing_columns(conn, db.reflect_table(conn, table_name), rollup)
+            # stored buckets before the earliest new one cannot be touched, they are not read
+            stored = db.read_rows_where_in(
+                conn, table, "event_id", rollup["event_id"].unique(),
+                table.c.bucket >= rollup["bucket"].min().to_pydatetime(),
+            )
+            stored = _parse_times(stored)
+            stored = stored.merge(rollup[ROLLUP_KEY], on=ROLLUP_KEY)
+            if not stored.empty:
+                rollup = merge_rollups(pd.concat([stored, rollup], ignore_index=True))
+                conn.execute(
+                    table.delete().where(
+                        sa.and_(*[table.c[k] == sa.bindparam(f"key_{k}") for k in ROLLUP_KEY])
+                    ),
+                    [
+                        {"key_event_id": int(e), "key_bucket": b.to_pydatetime()}
+                        for e, b in stored[ROLLUP_KEY].itertuples(index=False)
+                    ],
+                )
+        rollup.to_sql(table_name, conn, if_exists="append", index=False, chunksize=10000)
+    return len(rollup)
+
+
+def update_rollups(stats: pd.DataFrame, engine) -> typing.Dict[str, int]:
+    """
+    folds new stat rows into every rollup table
+    :param stats:
+    :param engine:
+    :return: rollup rows written per resolution
+    """
+    if stats.empty:
+        return {resolution: 0 for resolution in ROLLUPS}
+    return {
+        resolution: update_rollup(stats, engine, table_name, freq)
+        for resolution, (table_name, freq) in ROLLUPS.items()
+    }
+
+
+def backfill_rollups(engine, events_per_batch: int = 200) -> typing.Dict[str, int]:
+    """
+    rebuilds the rollup tables from the whole stat table, a batch of events at a
+    time. stored rollup rows are dropped first, folding the history into them
+    would count their snapshots twice
+    :param engine:
+    :param events_per_batch:
+    :return: rollup rows written per resolution, summed over batches
+    """
+    written = {resolution: 0 for resolution in ROLLUPS}
+    with engine.begin() as conn:
+        for table_name, _ in ROLLUPS.values():
+            sa.Table(table_name, sa.MetaData()).drop(conn, checkfirst=True)
+    with engine.connect() as conn:
+        event_ids = [row[0] for row in conn.execute(sa.text(f"SELECT DISTINCT event_id FROM {db.STAT_TABLE}"))]
+    for batch in db.batched(event_ids, events_per_batch):
+        stats = db.read_stats(engine, schema.StatQuery(event_id=batch))
+        for resolution, count in update_rollups(stats, engine).items():
+            written[resolution] += count
+    return written
+
+
+def stat_time_range(engine, query: schema.StatQuery) -> typing.Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    returns the min and max utc_read_time of the stat rows selected by query
+    :param engine:
+    :param query:
+    :return:
+    """
+    selected = db.stat_select(query.model_copy(update={"columns": ["utc_read_time"]})).subquery()
+    statement = sa.select(
+        sa.func.min(selected.c.utc_read_time), sa.func.max(selected.c.utc_read_time)
+    )
+    with engine.connect() as conn:
+        start, end = conn.execute(statement).one()
+    return pd.to_datetime(start), pd.to_datetime(end)
+
+
+def choose_resolution(start, end) -> str:
+    """
+    returns 'raw', 'hourly' or 'daily' for a utc_read_time span
+    :param start:
+    :param end:
+    :return:
+    """
+    if pd.isna(start) or pd.isna(end):
+        return "raw"
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    for resolution, longest in RESOLUTION_SPANS:
+        if span <= longest:
+            return resolution
+    return "daily"
+
+
+def rollup_select(rollup: sa.Table, freq: str, query: schema.StatQuery) -> sa.Select:
+    """
+    returns select * on a rollup table filtered like db.stat_select, with bucket
+    standing in for utc_read_time
+    :param rollup: reflected rollup table
+    :param freq: bucket frequency of the table, the bucket holding query.start is included
+    :param query:
+    :return:
+    """
+    statement = sa.select(rollup)
+    if query.start is not None:
+        statement = statement.where(rollup.c.bucket >= pd.Timestamp(query.start).floor(freq).to_pydatetime())
+    if query.end is not None:
+        statement = statement.where(rollup.c.bucket < query.end)
+    if query.event_id is not None:
+        statement = statement.where(rollup.c.event_id.in_(query.event_id))
+    if query.performer_id is not None or query.venue_id is not None:
+        pev = sa.table(db.PEV_TABLE, *[sa.column(c) for c in ("event_id", "performer_id", "venue_id")])
+        linked = sa.select(pev.c.event_id).where(
+            *db.pev_filters(pev, query.model_copy(update={"event_id": None}))
+        )
+        statement = statement.where(rollup.c.event_id.in_(linked))
+    return statement
+
+
+def as_stat_rows(rollups: pd.DataFrame) -> pd.DataFrame:
+    """
+    returns rollup rows shaped like stat rows: close prices, the max highest price,
+    max listing counts and the bucket as utc_read_time, so they can be plotted
+    like raw snapshots. rows rolled up before highest_price_max and
+    visible_listing_count_max were kept hold NaN
+    :param rollups:
+    :return:
+    """
+    stats = pd.DataFrame({"event_id": rollups["event_id"]})
+    for price in ROLLUP_PRICE_COLUMNS:
+        stats[price] = rollups[f"{price}_close"]
+    stats["highest_price"] = rollups.get("highest_price_max", np.nan)
+    stats["listing_count"] = rollups["listing_count_max"]
+    stats["visible_listing_count"] = rollups.get("visible_listing_count_max", np.nan)
+    stats["utc_read_time"] = pd.to_datetime(rollups["bucket"], format="mixed")
+    return stats
+
+
+def rollup_covers(engine, resolution: str, query: schema.StatQuery, start) -> bool:
+    """
+    whether the rollup table of resolution holds the rows selected by query from
+    start on. rollup tables built after stat history was written start at their
+    first update until backfill_rollups is run
+    :param engine:
+    :param resolution: 'hourly' or 'daily'
+    :param query:
+    :param start: earliest utc_read_time of the selected stat rows
+    :return:
+    """
+    table_name, freq = ROLLUPS[resolution]
+    if not db.has_table(engine, table_name):
+        return False
+    selected = rollup_select(db.reflect_table(engine, table_name), freq, query).subquery()
+    with engine.connect() as conn:
+        first_bucket = conn.execute(sa.select(sa.func.min(selected.c.bucket))).scalar()
+    if first_bucket is None:
+        return pd.isna(start)
+    return pd.isna(start) or pd.to_datetime(first_bucket) <= pd.Timestamp(start).floor(freq)
+
+
+def read_stats_at_resolution(
+        engine, query: schema.StatQuery, resolution: str = "auto"
+) -> pd.DataFrame:
+    """
+    returns stat rows selected by query, read from the stat table or a rollup table.
+    with resolution='auto' the resolution is chosen from the utc_read_time span of
+    the selection; raw is used when the rollup table has not been built or does not
+    reach back to the first selected stat row
+    :param engine:
+    :param query:
+    :param resolution: 'auto', 'raw', 'hourly' or 'daily'
+    :return:
+    """
+    if resolution == "auto":
+        stored_start, stored_end = stat_time_range(engine, query)
+        start = query.start if query.start is not None else stored_start
+        end = query.end if query.end is not None else stored_end
+        resolution = choose_resolution(start, end)
+        # the rollup must reach back to the first stored row, not to the requested start
+        if resolution != "raw" and not rollup_covers(engine, resolution, query, stored_start):
+            resolution = "raw"
+    if resolution == "raw" or not db.has_table(engine, ROLLUPS[resolution][0]):
+        return db.read_stats(engine, query)
+    table_name, freq = ROLLUPS[resolution]
+    statement = rollup_select(db.reflect_table(engine, table_name), freq, query)
+    return as_stat_rows(db.read_frames(engine, statement, query.chunksize))
@@ -0,0 +1,285 @@
+"""
+adaptive polling of tracked events: each event is polled at an interval chosen
+from its time to start and the recent volatility of its prices in stat. a heap
+orders events by next due time, due events are fetched together in as few id
+chunks as possible and events that have started are dropped. events added to
+performer_event_venue after startup are picked up every RELOAD_INTERVAL
+usage: python -m src.fetch_data.scheduler
+"""
+import heapq
+import time
+import typing
+
+import numpy as np
+import pandas as pd
+
+import src.fetch_data.db as db
+import src.fetch_data.schema as schema
+from src.fetch_data.fetch_engine import FetchEngine
+from src.fetch_data.instrumentation import log_event, stage
+from src.fetch_data.table_builders import SeatgeekData, get_upcoming_event_ids
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+# (events starting at least this far out, poll interval)
+INTERVAL_TIERS = [
+    (90 * DAY, 24 * HOUR),
+    (30 * DAY, 12 * HOUR),
+    (7 * DAY, 6 * HOUR),
+    (2 * DAY, 2 * HOUR),
+    (1 * DAY, 1 * HOUR),
+    (0, 15 * 60),
+]
+MIN_INTERVAL = 10 * 60
+MAX_INTERVAL = 24 * HOUR
+# relative median price range over VOLATILITY_WINDOW above which polling is sped
+# up, and below which it is slowed down
+HIGH_VOLATILITY = 0.05
+LOW_VOLATILITY = 0.005
+VOLATILITY_WINDOW = 3 * DAY
+VOLATILITY_COLUMN = "median_price"
+# events due within this share of their interval are pulled forward to fill the last id chunk
+LOOKAHEAD_SHARE = 0.25
+MAX_SLEEP = 5 * 60
+# how often run tracks the events added to performer_event_venue since the last load
+RELOAD_INTERVAL = HOUR
+
+
+def poll_interval(seconds_to_event: float, volatility: typing.Optional[float] = None) -> float:
+    """
+    returns the seconds until an event is polled again. the interval shrinks as the
+    event nears, is halved for volatile prices and doubled for flat ones
+    :param seconds_to_event:
+    :param volatility: relative price range of recent snapshots, None when unknown
+    :return:
+    """
+    interval = next(interval for horizon, interval in INTERVAL_TIERS if seconds_to_event >= horizon)
+    if volatility is not None and not np.isnan(volatility):
+        if volatility >= HIGH_VOLATILITY:
+            interval /= 2
+        elif volatility <= LOW_VOLATILITY:
+            interval *= 2
+    # never poll again after the event started
+    return float(min(max(interval, MIN_INTERVAL), MAX_INTERVAL, max(seconds_to_event, MIN_INTERVAL)))
+
+
+def price_volatility(stats: pd.DataFrame, column: str = VOLATILITY_COLUMN) -> pd.Series:
+    """
+    returns (max - min) / mean of column per event_id
+    :param stats:
+    :param column:
+    :return:
+    """
+    if stats.empty:
+        return pd.Series(dtype=float)
+    prices = stats.groupby("event_id")[column].agg(["min", "max", "mean"])
+    return (prices["max"] - prices["min"]) / prices["mean"].where(prices["mean"] > 0)
+
+
+def _epoch_seconds(values) -> np.ndarray:
+    """utc datetimes or datetime strings as unix seconds, NaN where unparseable"""
+    times = pd.to_datetime(pd.Series(values), utc=True, errors="coerce", format="mixed")
+    return ((times - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=float, na_value=np.nan)
+
+
+class PollScheduler:
+    """
+    keeps a heap of (next due time, event_id) for the tracked events. poll_once
+    fetches the due events, writes their tables and reschedules each one
+    """
+    def __init__(
+            self,
+            engine,
+            fetcher: FetchEngine,
+            clock: typing.Callable[[], float] = time.time,
+            push: typing.Optional[typing.Callable[[SeatgeekData], None]] = None,
+    ):
+        """
+        :param engine: stat reads for volatility, and writes unless push is given
+        :param fetcher:
+        :param clock: returns the current unix time
+        :param push: writes the tables of each poll, defaults to SeatgeekData.push_to_db(engine)
+        """
+        self.engine = engine
+        self.fetcher = fetcher
+        self.clock = clock
+        self.push = push or (lambda data: data.push_to_db(engine))
+        self.starts: typing.Dict[int, float] = {}
+        self.intervals: typing.Dict[int, float] = {}
+        self._due: typing.Dict[int, float] = {}
+        self._heap: typing.List[typing.Tuple[float, int]] = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def track(self, events: pd.DataFrame):
+        """
+        schedules events that are not tracked yet to be polled now, and updates
+        the start time of tracked ones
+        :param events: event_id and datetime_utc columns
+        :return:
+        """
+        now = self.clock()
+        for event_id in self._set_starts(events):
+            if event_id not in self._due:
+                self._schedule(event_id, now)
+
+    def _set_starts(self, events: pd.DataFrame) -> typing.List[int]:
+        """
+        records the start time of events that have not started
+        :param events: event_id and datetime_utc columns
+        :return: ids of those events
+        """
+        now = self.clock()
+        upcoming = []
+        for event_id, start in zip(events["event_id"], _epoch_seconds(events["datetime_utc"])):
+            if np.isnan(start) or start > now:
+                self.starts[int(event_id)] = start
+                upcoming.append(int(event_id))
+        return upcoming
+
+    def untrack(self, event_ids: typing.Iterable):
+        for event_id in event_ids:
+            self.starts.pop(int(event_id), None)
+            self.intervals.pop(int(event_id), None)
+            self._due.pop(int(event_id), None)
+
+    def load(self):
+        """
+        tracks the upcoming events of the performer_event_venue table, events
+        already tracked keep their due time
+        :return:
+        """
+        if not db.has_table(self.engine, db.PEV_TABLE):
+            return
+        pev = db.read_performer_event_venue(
+            self.engine, schema.StatQuery()
+        )[["event_id", "datetime_utc"]].drop_duplicates("event_id")
+        now = pd.Timestamp(self.clock(), unit="s", tz="UTC")
+        self.track(pev.loc[pev["event_id"].isin(get_upcoming_event_ids(pev, now))])
+
+    def _schedule(self, event_id: int, due: float):
+        # superseded heap entries are skipped when popped
+        self._due[event_id] = due
+        heapq.heappush(self._heap, (due, event_id))
+
+    def next_due(self) -> typing.Optional[float]:
+        """returns the earliest due time, None when nothing is tracked"""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self) -> typing.List[int]:
+        """
+        returns the due events, topped up with events due within their lookahead
+        until the last id chunk is full. events that have started are dropped
+        :return:
+        """
+        now = self.clock()
+        due = []
+        while (next_due := self.next_due()) is not None:
+            event_id = self._heap[0][1]
+            if next_due > now:
+                lookahead = LOOKAHEAD_SHARE * self.intervals.get(event_id, MIN_INTERVAL)
+                if len(due) % self.fetcher.chunk_size == 0 or next_due > now + lookahead:
+                    break
+            heapq.heappop(self._heap)
+            del self._due[event_id]
+            start = self.starts[event_id]
+            if not np.isnan(start) and start <= now:
+                self.untrack([event_id])
+                continue
+            due.append(event_id)
+        return due
+
+    def reschedule(self, event_ids: typing.List[int], volatility: pd.Series):
+        """
+        schedules each event one poll_interval from now
+        :param event_ids:
+        :param volatility: per event_id, see price_volatility
+        :return:
+        """
+        now = self.clock()
+        for event_id in event_ids:
+            start = self.starts[event_id]
+            seconds_to_event = start - now if not np.isnan(start) else INTERVAL_TIERS[0][0]
+            interval = poll_interval(seconds_to_event, volatility.get(event_id))
+            self.intervals[event_id] = interval
+            self._schedule(event_id, now + interval)
+
+    def recent_volatility(self, event_ids: typing.List[int]) -> pd.Series:
+        """
+        returns price_volatility of the stat rows read within VOLATILITY_WINDOW
+        :param event_ids:
+        :return:
+        """
+        if not event_ids or not db.has_table(self.engine, db.STAT_TABLE):
+            return pd.Series(dtype=float)
+        since = pd.Timestamp(self.clock() - VOLATILITY_WINDOW, unit="s")
+        stats = db.read_stats(
+            self.engine,
+            schema.StatQuery(event_id=event_ids, start=since, columns=[VOLATILITY_COLUMN]),
+        )
+        return price_volatility(stats)
+
+    def poll_once(self) -> typing.Dict[str, int]:
+        """
+        fetches the due events in id chunks, writes their tables and reschedules them.
+        events the api no longer returns are dropped
+        :return: counts of polled, fetched and dropped events
+        """
+        due = self.pop_due()
+        if not due:
+            return {"polled": 0, "fetched": 0, "dropped": 0}
+        with stage("poll", events=len(due)) as counts:
+            events = self.fetcher.map_chunks("get_events", "id", due)
+            fetched = set(events["id"].astype(int)) if not events.empty else set()
+            if fetched:
+                # start times move when events are rescheduled. taken from the events, events
+                # without performers have no performer_event_venue rows
+                upcoming = set(self._set_starts(
+                    events[["id", "datetime_utc"]].rename(columns={"id": "event_id"}).drop_duplicates("event_id")
+                ))
+                self.push(SeatgeekData.from_events(events))
+            else:
+                upcoming = set()
+            dropped = [e for e in due if e not in upcoming]
+            self.untrack(dropped)
+            polled = [e for e in due if e in upcoming]
+            self.reschedule(polled, self.recent_volatility(polled))
+            counts.update(fetched=len(fetched), dropped=len(dropped))
+        return {"polled": len(due), "fetched": len(fetched), "dropped": len(dropped)}
+
+    def run(
+            self,
+            stop: typing.Callable[[], bool] = lambda: False,
+            sleep: typing.Callable[[float], None] = time.sleep,
+            reload_interval: float = RELOAD_INTERVAL,
+    ):
+        """
+        polls due events until stop(), loading newly tracked events every
+        reload_interval. nothing tracked is not a reason to stop, events may be added
+        :param stop:
+        :param sleep:
+        :param reload_interval: seconds between calls of load
+        :return:
+        """
+        loaded = None
+        while not stop():
+            if loaded is None or self.clock() - loaded >= reload_interval:
+                self.load()
+                loaded = self.clock()
+            result = self.poll_once()
+            if result["polled"]:
+                log_event("poll", **result, tracked=len(self))
+            next_due = self.next_due()
+            wait = MAX_SLEEP if next_due is None else max(next_due - self.clock(), 0)
+            sleep(max(min(wait, loaded + reload_interval - self.clock(), MAX_SLEEP), 0))
+
+
+if __name__ == "__main__":
+    import src.fetch_data.connections as connections
+    import src.fetch_data.instrumentation as instrumentation
+    instrumentation.configure_logging()
+    scheduler = PollScheduler(connections.get_engine(), FetchEngine(connections.get_client()))
+    scheduler.run()
@@ -2,6 +2,7 @@ from pydantic import BaseModel
 from dataclasses import dataclass
 import typing
 from abc import ABC
+from datetime import datetime
 
 @dataclass
 class Pair:
@@ -125,3 +126,48 @@ class SlugReq(BaseModel):
     Represents a model with a slug.
     """
     slug: PerformerSlug | VenueSlug
+
+
+class StatQuery(BaseModel):
+    """
+    Represents a filtered read of the stat and performer_event_venue tables.
+    Every filter is optional, unset filters match all rows.
+    start/end bound utc_read_time as start <= utc_read_time < end.
+    columns projects the stat table, event_id is always read.
+    chunksize is the number of rows fetched from the database at a time.
+    """
+    start: typing.Optional[datetime] = None
+    end: typing.Optional[datetime] = None
+    performer_id: typing.Optional[typing.List[int]] = None
+    venue_id: typing.Optional[typing.List[int]] = None
+    event_id: typing.Optional[typing.List[int]] = None
+    columns: typing.Optional[typing.List[str]] = None
+    chunksize: int = 50000
+
+
+class StatBucketQuery(StatQuery):
+    """
+    Represents a filtered read of the stat table downsampled to one row per event
+    and utc_read_time bucket.
+    bucket is a pandas timedelta string, e.g. '15min', '1h' or '1d', buckets are
+    aligned to the unix epoch. aggregations are applied to every projected column.
+    """
+    bucket: str = "1h"
+    aggregations: typing.List[str] = ["mean"]
+
+
+class JobStatus(BaseModel):
+    """
+    Represents the state of a background ingestion job.
+    state moves queued -> running -> succeeded | failed, stage names the step
+    being run and timings holds the seconds spent in each finished stage.
+    """
+    id: str
+    state: str = "queued"
+    stage: typing.Optional[str] = None
+    submitted_at: datetime
+    started_at: typing.Optional[datetime] = None
+    finished_at: typing.Optional[datetime] = None
+    timings: typing.Dict[str, float] = {}
+    result: typing.Optional[typing.Dict[str, typing.Any]] = None
+    error: typing.Optional[str] = None
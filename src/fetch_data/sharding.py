@@ -0,0 +1,203 @@
+"""
+sharded ingestion of a watchlist across worker processes, in two phases:
+1. discovery: the venue, performer and event ids of the watchlist are hash
+   partitioned across the shards, each shard fetches the events of its ids
+2. ingestion: the discovered events are routed to the shard owning the hash of
+   their event id, which dedupes them, builds their tables and writes them
+an event found through ids of several shards is written by its owner only, so
+shards never write the same stat or performer_event_venue rows. the run metrics
+of every shard are merged by the coordinator
+"""
+import os
+import typing
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import src.fetch_data.connections as connections
+import src.fetch_data.db as db
+import src.fetch_data.delta as delta
+from src.fetch_data import instrumentation
+from src.fetch_data.fetch_engine import FetchEngine
+from src.fetch_data.instrumentation import log_event, stage
+from src.fetch_data.table_builders import SeatgeekData
+
+WATCHLIST_ID_FIELDS = ("venue_id", "performer_id", "event_id")
+DEFAULT_SHARDS = os.cpu_count() or 1
+
+
+def shard_of(ids: typing.Iterable, shards: int) -> np.ndarray:
+    """
+    returns the shard of each id, stable across processes and runs
+    :param ids:
+    :param shards:
+    :return:
+    """
+    return np.fromiter((zlib.crc32(str(i).encode()) % shards for i in ids), dtype=np.int64)
+
+
+def partition_watchlist(watchlist: dict, shards: int) -> typing.List[typing.Dict[str, typing.List[str]]]:
+    """
+    splits the ids of a watchlist into one watchlist per shard
+    :param watchlist: venue_id, performer_id and event_id lists
+    :param shards:
+    :return:
+    """
+    parts = [{field: [] for field in WATCHLIST_ID_FIELDS} for _ in range(shards)]
+    for field in WATCHLIST_ID_FIELDS:
+        ids = list(dict.fromkeys(str(i) for i in watchlist.get(field) or []))
+        for id_, shard in zip(ids, shard_of(ids, shards)):
+            parts[shard][field].append(id_)
+    return parts
+
+
+def route_events(frames: typing.Iterable[pd.DataFrame], shards: int) -> typing.List[pd.DataFrame]:
+    """
+    returns the events of frames owned by each shard, each event once
+    :param frames: events discovered by each shard
+    :param shards:
+    :return:
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return [pd.DataFrame() for _ in range(shards)]
+    events = pd.concat(frames, ignore_index=True).drop_duplicates(subset=["id"])
+    owners = shard_of(events["id"], shards)
+    return [events.loc[owners == shard].reset_index(drop=True) for shard in range(shards)]
+
+
+def discover(watchlist: dict, client_factory: typing.Callable = connections.get_client) -> pd.DataFrame:
+    """
+    phase 1, returns the concert events of a watchlist
+    :param watchlist:
+    :param client_factory: returns the seatgeek client of the worker process
+    :return:
+    """
+    fetcher = FetchEngine(client_factory())
+    with stage("api_fetch", source="shard") as counts:
+        events = fetcher.get_watchlist_events(event_type="concert", **watchlist)
+        counts.update(rows=len(events))
+    return events
+
+
+def ingest(
+        events: pd.DataFrame,
+        shard: int,
+        engine_url: typing.Optional[str] = None,
+        heartbeat: typing.Optional[pd.Timedelta] = delta.DEFAULT_HEARTBEAT,
+        suppress_unchanged: bool = False,
+) -> dict:
+    """
+    phase 2, builds, compacts and writes the tables of the events owned by shard.
+    with suppress_unchanged, like the in process update, only stat rows that changed
+    since the last stored row of their event are written. worker pools live for one
+    run, so the last values are seeded from the stat table
+    :param events:
+    :param shard:
+    :param engine_url: defaults to the url of connections.get_engine
+    :param heartbeat: with suppress_unchanged, also write unchanged rows once the last one is this old
+    :param suppress_unchanged: skip stat rows equal to the last stored row of their event
+    :return: the shard's run summary, counts and performer_event_venue rows
+    """
+    with instrumentation.run("ingest_shard", shard=shard) as summary:
+        if events.empty:
+            data = None
+        else:
+            data = SeatgeekData.from_events(events).compact()
+            data.push_to_db(
+                connections.get_engine(engine_url),
+                last_values=delta.LastValueCache() if suppress_unchanged else None,
+                heartbeat=heartbeat,
+            )
+    return {
+        **summary,
+        "events": len(events),
+        "stat": len(data.stat) if data is not None else 0,
+        "performer_event_venue": data.performer_event_venue if data is not None else pd.DataFrame(),
+    }
+
+
+def merge_metrics(results: typing.List[dict]) -> dict:
+    """
+    merges the run summaries of the shards: counts and stage seconds are summed,
+    seconds and peak rss are those of the slowest and largest shard
+    :param results: return values of ingest
+    :return:
+    """
+    merged = {
+        "shards": len(results),
+        "events": 0,
+        "stat": 0,
+        "stages": {},
+        "counts": {},
+        "seconds": 0.0,
+        "peak_rss_bytes": None,
+        "shard_seconds": {},
+    }
+    for result in results:
+        merged["events"] += result["events"]
+        merged["stat"] += result["stat"]
+        for key in ("stages", "counts"):
+            for name, value in result[key].items():
+                merged[key][name] = merged[key].get(name, 0) + value
+        merged["seconds"] = max(merged["seconds"], result["seconds"])
+        merged["shard_seconds"][result["shard"]] = result["seconds"]
+        if result["peak_rss_bytes"] is not None:
+            merged["peak_rss_bytes"] = max(merged["peak_rss_bytes"] or 0, result["peak_rss_bytes"])
+    merged["stages"] = {k: round(v, 4) for k, v in merged["stages"].items()}
+    return merged
+
+
+def run_sharded(
+        watchlist: dict,
+        shards: int = DEFAULT_SHARDS,
+        engine_url: typing.Optional[str] = None,
+        client_factory: typing.Callable = connections.get_client,
+        executor: typing.Optional[Executor] = None,
+        suppress_unchanged: bool = False,
+) -> typing.Tuple[dict, pd.DataFrame]:
+    """
+    fetches, builds and writes a watchlist across shards worker processes
+    :param watchlist: venue_id, performer_id and event_id lists
+    :param shards:
+    :param engine_url: defaults to the url of connections.get_engine
+    :param client_factory: picklable, returns the seatgeek client of a worker process
+    :param executor: runs the shards, defaults to a process pool of shards workers
+    :param suppress_unchanged: only write stat rows that changed, see ingest
+    :return: merged metrics and the performer_event_venue rows written by every shard
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=shards, initializer=connections.reset_after_fork)
+    try:
+        parts = partition_watchlist(watchlist, shards)
+        discovered = list(executor.map(discover, parts, [client_factory] * shards))
+        owned = route_events(discovered, shards)
+        log_event(
+            "shards_routed",
+            discovered=sum(len(f) for f in discovered),
+            events=[len(f) for f in owned],
+        )
+        pending = [shard for shard in range(shards) if not owned[shard].empty]
+        results = []
+        # the first shard creates the tables alone, concurrent creates of the same table fail
+        if pending and not db.has_table(connections.get_engine(engine_url), db.STAT_TABLE):
+            first = pending.pop(0)
+            results.append(
+                executor.submit(ingest, owned[first], first, engine_url, suppress_unchanged=suppress_unchanged).result()
+            )
+        futures = [
+            executor.submit(ingest, owned[shard], shard, engine_url, suppress_unchanged=suppress_unchanged)
+            for shard in pending
+        ]
+        results.extend(future.result() for future in futures)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    merged = merge_metrics(results)
+    merged["discovered"] = sum(len(f) for f in discovered)
+    log_event("sharded_run", **merged)
+    frames = [r["performer_event_venue"] for r in results if not r["performer_event_venue"].empty]
+    return merged, pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -1,3 +1,5 @@
+import itertools
+import operator
 import typing
 from dataclasses import dataclass
 from datetime import datetime
@@ -10,6 +12,12 @@ from src.scalpyr import ScalpyrPro
 from src.scalpyr.scalpyrpro import ApiException
 
 import src.fetch_data.schema as schema
+import src.fetch_data.db as db
+import src.fetch_data.rollup as rollup
+import src.fetch_data.delta as delta
+import src.fetch_data.buckets as buckets
+from src.fetch_data.instrumentation import log_event, stage
+from src.fetch_data.fetch_engine import FetchEngine
 
 
 def get_performer_events(
@@ -60,6 +68,33 @@ def select_events_by_event_id(
     return events_df.loc[events_df["id"].isin(event_ids)]
 
 
+# stats keys kept in the stat table, in column order
+STAT_PRICE_COLUMNS = ["average_price", "lowest_price", "highest_price", "median_price"]
+STAT_COUNT_COLUMNS = ["listing_count", "visible_listing_count"]
+
+
+def extract_stats(events_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    pulls event_id and the stat table keys out of the stats dicts of events_df,
+    column by column. prices are float64 and counts int64, so written values are
+    those of the payload, see compact_table for the downcast counts. rows missing
+    any key are dropped
+    :param events_df:
+    :return:
+    """
+    records = [s if isinstance(s, dict) else {} for s in events_df["stats"].tolist()]
+    # missing keys and None become NaN in a float64 array
+    columns = {
+        key: np.array([r.get(key) for r in records], dtype=np.float64)
+        for key in STAT_PRICE_COLUMNS + STAT_COUNT_COLUMNS
+    }
+    keep = np.logical_and.reduce([~np.isnan(v) for v in columns.values()])
+    data = {"event_id": events_df["id"].values[keep]}
+    data.update({key: columns[key][keep] for key in STAT_PRICE_COLUMNS})
+    data.update({key: columns[key][keep].astype(np.int64) for key in STAT_COUNT_COLUMNS})
+    return pd.DataFrame(data, index=events_df.index[keep])
+
+
 def build_stats_df(events_df: pd.DataFrame) -> pd.DataFrame:
     """
     moves stats from events_df to its own dataframe, with id from
@@ -68,49 +103,59 @@ def build_stats_df(events_df: pd.DataFrame) -> pd.DataFrame:
     :param events_df:
     :return:
     """
-    stats_df = events_df[["id", "stats"]].copy()
-    stats_df = stats_df.rename(columns={"id": "event_id"})
-    # expand stats column dict keys into columns, keep event_id, drop stats column
-    stats_df = pd.concat(
-        [stats_df.drop(["stats"], axis=1), stats_df["stats"].apply(pd.Series)], axis=1
-    )
-    # keep only event_id, average_price, lowest_price, highest_price, listing_count, visible_listing_count, median_price
-    stats_df = stats_df[
-        [
-            "event_id",
-            "average_price",
-            "lowest_price",
-            "highest_price",
-            "median_price",
-            "listing_count",
-            "visible_listing_count",
-        ]
-    ]
+    # keep only event_id, average_price, lowest_price, highest_price, median_price, listing_count, visible_listing_count
+    stats_df = extract_stats(events_df)
     # add utc timestamp as column to stats_df, without seconds
     stats_df["utc_read_time"] = pd.to_datetime("now").round("min")
     stats_df = stats_df.dropna()
     return stats_df
 
 
+PEV_EVENT_COLUMNS = ["id", "venue_id", "datetime_utc", "announce_date", "visible_at"]
+
+
+def _flatten_performers(events: pd.DataFrame) -> typing.Tuple[np.ndarray, list, np.ndarray]:
+    """
+    flattens the nested performer lists of events in one pass
+    :param events:
+    :return: row position of the event of each performer, performer dicts, performer ids
+    """
+    lists = [p if isinstance(p, list) else [] for p in events["performers"].tolist()]
+    lengths = np.fromiter(map(len, lists), dtype=np.intp, count=len(lists))
+    flat = list(itertools.chain.from_iterable(lists))
+    performer_ids = np.fromiter(map(operator.itemgetter("id"), flat), dtype=np.int64, count=len(flat))
+    return np.repeat(np.arange(len(lists)), lengths), flat, performer_ids
+
+
+def _link_performers(events: pd.DataFrame, positions: np.ndarray, performer_ids: np.ndarray) -> pd.DataFrame:
+    performers_events = events[PEV_EVENT_COLUMNS].iloc[positions].rename(columns={"id": "event_id"})
+    performers_events["performer_id"] = performer_ids
+    return performers_events
+
+
+def normalize_performers(events: pd.DataFrame) -> typing.Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    walks the nested performer lists of events once and returns the
+    performer_event_venue link table and the performer table, one row per
+    performer id in first-seen order. events without performers have no link rows
+    :param events: events with a venue_id column
+    :return: performer_event_venue, performers
+    """
+    positions, flat, performer_ids = _flatten_performers(events)
+    _, first = np.unique(performer_ids, return_index=True)
+    first = np.sort(first)
+    performers = pd.DataFrame([flat[i] for i in first], index=first)
+    return _link_performers(events, positions, performer_ids), performers
+
+
 def build_performer_events_df(events: pd.DataFrame) -> pd.DataFrame:
     """
     Returns a dataframe of performer ids mapped to event ids
     :param events:
     :return:
     """
-    # map performers to event id and explode
-    performers_events = events[
-        ["id", "venue_id", "performers", 'datetime_utc', 'announce_date', 'visible_at']
-    ].explode("performers")
-    # rename id to event_id
-    performers_events = performers_events.rename(columns={"id": "event_id"})
-    # extract id from performers, mapping event ids to performer ids
-    performers_events["performer_id"] = performers_events["performers"].apply(
-        lambda x: x["id"]
-    )
-    # drop performers column
-    performers_events = performers_events.drop(columns=["performers"])
-    return performers_events
+    positions, _, performer_ids = _flatten_performers(events)
+    return _link_performers(events, positions, performer_ids)
 
 
 def get_performer_stats_df(
@@ -154,11 +199,118 @@ def get_event_venue_ids(events: pd.DataFrame) -> pd.DataFrame:
     return venue_df.rename(columns={"id": "venue_id"})["venue_id"]
 
 
+def _lookup_positions(index: typing.Dict[typing.Any, np.ndarray], values) -> np.ndarray:
+    """
+    returns the sorted row positions of every value found in a value -> positions index
+    :param index:
+    :param values:
+    :return:
+    """
+    found = [index[v] for v in pd.unique(pd.Series(values)) if v in index]
+    if not found:
+        return np.empty(0, dtype=np.intp)
+    return np.sort(np.concatenate(found))
+
+
+def _range_positions(order: np.ndarray, sorted_keys: np.ndarray, values) -> np.ndarray:
+    """
+    returns the sorted row positions of every value, given the argsort of a key column
+    and the key column in sorted order. each value costs two binary searches
+    :param order: positions that sort the key column
+    :param sorted_keys: key column values in sorted order
+    :param values:
+    :return:
+    """
+    values = pd.unique(pd.Series(values))
+    left = np.searchsorted(sorted_keys, values, side="left")
+    right = np.searchsorted(sorted_keys, values, side="right")
+    lengths = right - left
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.intp)
+    # offsets of every selected slot within the sorted key column
+    starts = np.repeat(left - np.cumsum(lengths) + lengths, lengths)
+    return np.sort(order[starts + np.arange(total)])
+
+
+# columns that compact_table converts
+ID_COLUMNS = ["id", "event_id", "performer_id", "venue_id"]
+CATEGORY_COLUMNS = ["slug", "name", "type", "city", "state", "country", "timezone"]
+DATETIME_COLUMNS = ["datetime_utc", "announce_date", "visible_at"]
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    """
+    deep in-memory size of a fetched frame, logged as frame_bytes. it is not the
+    size of the api responses, those are read by the seatgeek client
+    """
+    return int(df.memory_usage(index=True, deep=True).sum()) if not df.empty else 0
+
+
+def get_nested_columns(df: pd.DataFrame) -> typing.List[str]:
+    """
+    returns the object columns of df holding dicts or lists
+    :param df:
+    :return:
+    """
+    nested = []
+    for column in df.columns[df.dtypes == object]:
+        values = df[column].dropna()
+        if len(values) and isinstance(values.iloc[0], (dict, list)):
+            nested.append(column)
+    return nested
+
+
+def compact_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    returns df with nested columns dropped, ids and listing counts downcast to
+    int32, repeated strings as category and datetime strings parsed to datetime64.
+    prices stay float64, compacted tables are written as they are
+    :param df:
+    :return:
+    """
+    df = df.drop(columns=get_nested_columns(df))
+    int32 = np.iinfo(np.int32)
+    for column in df.columns.intersection(ID_COLUMNS + STAT_COUNT_COLUMNS):
+        values = df[column]
+        if (
+            pd.api.types.is_integer_dtype(values)
+            and (len(values) == 0 or (values.min() >= int32.min and values.max() <= int32.max))
+        ):
+            df[column] = values.astype(np.int32)
+    for column in df.columns.intersection(CATEGORY_COLUMNS):
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    for column in df.columns.intersection(DATETIME_COLUMNS):
+        if not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], errors="coerce", format="mixed")
+    return df
+
+
+def get_upcoming_event_ids(performer_event_venue: pd.DataFrame, now: typing.Optional[pd.Timestamp] = None) -> np.ndarray:
+    """
+    returns the unique event ids whose datetime_utc has not passed yet, events
+    without a parseable datetime_utc are kept
+    :param performer_event_venue:
+    :param now: utc timestamp to compare against, defaults to the current time
+    :return:
+    """
+    now = now if now is not None else pd.Timestamp.now(tz="UTC")
+    starts = pd.to_datetime(performer_event_venue["datetime_utc"], utc=True, errors="coerce", format="mixed")
+    upcoming = starts.isna() | (starts >= now)
+    return performer_event_venue.loc[upcoming, "event_id"].unique()
+
+
 class SeatgeekData:
     """
     # class which, given event data from seatgeek, builds dataframes using
     # the table builder functions above
+    # lookup indexes are built lazily on first use and dropped whenever a table is reassigned.
+    # call invalidate_indexes() after mutating a table in place. refresh() appends
+    # the rows stored since from_db and extends the indexes instead
     """
+    _tables = ("event", "performer", "stat", "performer_event_venue", "venue")
+
     def __init__(
             self,
             events: pd.DataFrame,
@@ -167,12 +319,80 @@ class SeatgeekData:
             performer_event_venue: pd.DataFrame,
             venue: pd.DataFrame
     ):
+        self._indexes = {}
+        # set by from_db, see refresh
+        self._source = None
+        self._watermark = None
+        self._watermark_event_ids = set()
+        self._known_event_ids = None
         self.event = events
         self.performer = performers
         self.stat = stats
         self.performer_event_venue = performer_event_venue
         self.venue = venue
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self._tables:
+            self.invalidate_indexes()
+
+    def invalidate_indexes(self):
+        """
+        drops all cached lookup indexes, they are rebuilt on next use
+        :return:
+        """
+        self._indexes = {}
+
+    def _cached_index(self, key: tuple, build: typing.Callable):
+        if key not in self._indexes:
+            self._indexes[key] = build()
+        return self._indexes[key]
+
+    def _positions_index(self, table_name: str, column: str) -> typing.Dict[typing.Any, np.ndarray]:
+        """
+        returns {value: row positions} for column of table_name
+        :param table_name:
+        :param column:
+        :return:
+        """
+        return self._cached_index(
+            ("positions", table_name, column),
+            lambda: getattr(self, table_name).groupby(column, sort=False, observed=True).indices,
+        )
+
+    def _slug_index(self, table_name: str) -> typing.Dict[str, typing.Any]:
+        """
+        returns {slug: id} for table_name, the first id wins for a repeated slug
+        :param table_name:
+        :return:
+        """
+        def build():
+            table = getattr(self, table_name).drop_duplicates("slug")
+            return dict(zip(table["slug"], table["id"]))
+        return self._cached_index(("slug", table_name), build)
+
+    def _stat_event_index(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        returns the stable argsort of stat.event_id and event_id in sorted order
+        :return:
+        """
+        def build():
+            event_ids = self.stat["event_id"].values
+            order = np.argsort(event_ids, kind="stable")
+            return order, event_ids[order]
+        return self._cached_index(("stat", "event_id"), build)
+
+    def _select(self, table_name: str, column: str, values) -> pd.DataFrame:
+        """
+        returns the rows of table_name where column is in values, in table order
+        :param table_name:
+        :param column:
+        :param values:
+        :return:
+        """
+        positions = _lookup_positions(self._positions_index(table_name, column), values)
+        return getattr(self, table_name).iloc[positions]
+
     @classmethod
     def from_events(cls, events: pd.DataFrame):
         """
@@ -180,8 +400,7 @@ class SeatgeekData:
         :param events:
         :return:
         """
-        performers = build_df_from_series_of_dicts(events["performers"].explode())
-        return cls._build_tables(events, performers)
+        return cls._build_tables(events)
 
     @classmethod
     def from_watchlist(
@@ -190,33 +409,30 @@ class SeatgeekData:
             venue_id: typing.Union[typing.List[str], None] = None,
             performer_id: typing.Union[typing.List[str], None] = None,
             event_id: typing.Union[typing.List[str], None] = None,
+            fetcher: typing.Optional[FetchEngine] = None,
             **_
     ):
         """
-        Returns a SeatgeekData object from a watchlist
+        Returns a SeatgeekData object from a watchlist. ids are submitted
+        MAX_IDS_PER_REQUEST at a time, all chunks are fetched concurrently and paged
         :param client:
         :param venue_id:
         :param performer_id:
         :param event_id:
+        :param fetcher: fetch engine to submit requests with, defaults to one wrapping client
         :return:
         """
-        events = []
-        event_type = 'concert'
-        if venue_id:
-            # submit 50 venue ids at a time
-            v_resp = client.get_events_by('venue', venue_id, event_type=event_type)
-            events.append(v_resp['events'])
-        if performer_id:
-            events.append(client.get_events_by('performers', performer_id, event_type=event_type)['events'])
-        if event_id:
-            events.append(client.get_events_by('events', event_id, event_type=event_type)['events'])
-        # concat events, keep first instance of each event id
-        events = pd.concat(events).drop_duplicates(subset=['id'])
-        # get performers from events
-        performers = build_df_from_series_of_dicts(events["performers"].explode())
-        performers = performers.drop_duplicates(subset=['id'])
-
-        return cls._build_tables(events, performers)
+        fetcher = fetcher or FetchEngine(client)
+        with stage("api_fetch", source="watchlist") as counts:
+            events = fetcher.get_watchlist_events(
+                venue_id=venue_id,
+                performer_id=performer_id,
+                event_id=event_id,
+                event_type='concert',
+            )
+            counts.update(rows=len(events), frame_bytes=_frame_bytes(events))
+        # performers are taken from the events
+        return cls._build_tables(events)
 
     @classmethod
     def from_api(cls, client: ScalpyrPro):
@@ -226,88 +442,312 @@ class SeatgeekData:
         :param client:
         :return:
         """
-        print(f"getting events from seatgeek {datetime.now()}")
-        performers = client.get_performers(
-            {'type': 'band', 'per_page': 100, 'has_upcoming_events': 'true'}
-        )
-        events = client.get_events_by_performers(performers)
+        with stage("api_fetch", source="api") as counts:
+            performers = client.get_performers(
+                {'type': 'band', 'per_page': 100, 'has_upcoming_events': 'true'}
+            )
+            events = client.get_events_by_performers(performers)
+            counts.update(rows=len(events), frame_bytes=_frame_bytes(events))
         return cls._build_tables(events, performers)
 
     @classmethod
-    def from_db(cls, engine, client: ScalpyrPro, stats_query: str = ""):
+    def from_db(
+            cls,
+            engine,
+            client: ScalpyrPro,
+            query: typing.Optional[schema.StatQuery] = None,
+            live_only: bool = True,
+            fetcher: typing.Optional[FetchEngine] = None,
+            archive=None,
+    ):
         """
-        Returns a SeatgeekData object from a database
-        :param stats_query:
+        Returns a SeatgeekData object from a database. only the stat and
+        performer_event_venue rows/columns selected by query are read, so query
+        bounds memory, the selected rows are all loaded. to process more stat rows
+        than fit in memory, stream db.stat_select(query) with db.iter_read instead.
+        performers and events are fetched from the api in concurrent, size bounded batches
+        :param query: filters pushed down to the database, reads everything when None
+        :param live_only: only fetch events whose datetime_utc has not passed
+        :param fetcher: fetch engine to submit requests with, defaults to one wrapping client
+        :param archive: archive.ParquetArchive to read the tables from instead of engine
         :param client:
         :param engine:
         :return:
         """
-        print(f"getting events from database {datetime.now()}")
-        performer_event_venue = pd.read_sql_table("performer_event_venue", engine)
-        if stats_query:
-            stat = pd.read_sql(stats_query, engine)
+        query = query or schema.StatQuery()
+        fetcher = fetcher or FetchEngine(client)
+        with stage("db_read", source="archive" if archive is not None else "db") as counts:
+            if archive is not None:
+                performer_event_venue = archive.read_performer_event_venue(query)
+                stat = archive.read_stats(query)
+            else:
+                performer_event_venue = db.read_performer_event_venue(engine, query)
+                stat = db.read_stats(engine, query)
+            counts.update(stat_rows=len(stat), performer_event_venue_rows=len(performer_event_venue))
+        with stage("api_fetch", source="db") as counts:
+            # get performers from api by unique performer_id in performer_event_venue table
+            performers = fetcher.map_chunks('get_performers', 'id', performer_event_venue.performer_id.unique())
+            if live_only:
+                event_ids = get_upcoming_event_ids(performer_event_venue)
+            else:
+                event_ids = performer_event_venue.event_id.unique()
+            events = fetcher.map_chunks('get_events', 'id', event_ids)
+            counts.update(rows=len(events), frame_bytes=_frame_bytes(events) + _frame_bytes(performers))
+        if events.empty:
+            data = cls(events, performers, stat, performer_event_venue, pd.DataFrame())
         else:
-            stat = pd.read_sql_table("stat", engine)
-        # get performers from api by unique performer_id in performer_event_venue table
-        performer_ids = performer_event_venue.performer_id.astype(str).unique()
-        performers = client.get_performers(
-            {
-                'id': ','.join(performer_ids),
-                'per_page': len(performer_ids),
-            }
-        )
-        event_ids = performer_event_venue.event_id.astype(str).unique()
-        # split event ids into ten lists
-        event_ids = np.array_split(event_ids, 5)
-        events_list = []
-
-        for i in event_ids:
-            evnts = client.get_events(
-                {
-                    'id': ','.join(i),
-                }
-            )
-            events_list.append(evnts)
-        events = pd.concat(events_list)
-        local_data = cls._build_tables(events, performers)
-        return cls(local_data.event, local_data.performer, stat, performer_event_venue, local_data.venue)
+            local_data = cls._build_tables(events, performers)
+            data = cls(local_data.event, local_data.performer, stat, performer_event_venue, local_data.venue)
+        data._source = {"query": query, "live_only": live_only, "fetcher": fetcher, "archive": archive}
+        return data
+
+    def _append(self, table_name: str, rows: pd.DataFrame):
+        """
+        appends rows to a table and extends its cached lookup indexes with the new
+        positions instead of dropping them
+        :param table_name:
+        :param rows:
+        :return:
+        """
+        if rows.empty:
+            return
+        table = getattr(self, table_name)
+        offset = len(table)
+        table = pd.concat([table, rows], ignore_index=True) if offset else rows.reset_index(drop=True)
+        # bypasses __setattr__, which would drop the indexes
+        object.__setattr__(self, table_name, table)
+        for key in list(self._indexes):
+            if key == ("stat", "event_id"):
+                if table_name != "stat":
+                    continue
+                order, sorted_event_ids = self._indexes[key]
+                event_ids = table["event_id"].values[offset:]
+                added_order = np.argsort(event_ids, kind="stable")
+                added_sorted = event_ids[added_order]
+                # after the stored rows of the same event, as a stable argsort would place them
+                at = np.searchsorted(sorted_event_ids, added_sorted, side="right")
+                self._indexes[key] = (
+                    np.insert(order, at, added_order + offset),
+                    np.insert(sorted_event_ids, at, added_sorted),
+                )
+            elif key[1] != table_name:
+                continue
+            elif key[0] == "positions":
+                index = self._indexes[key]
+                added = rows.groupby(key[2], sort=False, observed=True).indices
+                for value, positions in added.items():
+                    positions = positions + offset
+                    index[value] = np.concatenate([index[value], positions]) if value in index else positions
+            elif key[0] == "slug":
+                for slug, id_ in zip(rows["slug"], rows["id"]):
+                    self._indexes[key].setdefault(slug, id_)
+
+    def refresh(self, engine, fetcher: typing.Optional[FetchEngine] = None) -> typing.Dict[str, int]:
+        """
+        appends the stat rows read since the last read and the performer_event_venue
+        links, events, performers and venues of events not seen before, in place.
+        rows are selected by the query from_db was called with, only stat rows at or
+        after the latest utc_read_time already held are read. lookup indexes are
+        extended rather than rebuilt
+        :param engine:
+        :param fetcher: fetch engine for the new events and performers, defaults to
+            the one from_db used. skipped when there is none
+        :return: counts of appended rows per table
+        """
+        source = self._source or {"query": schema.StatQuery(), "live_only": True, "fetcher": None, "archive": None}
+        query = source["query"]
+        fetcher = fetcher or source["fetcher"]
+        if self._watermark is None and not self.stat.empty:
+            self._set_watermark(self.stat)
+        if self._known_event_ids is None:
+            self._known_event_ids = set(self.performer_event_venue.get("event_id", []))
+        start = query.start
+        if self._watermark is not None:
+            start = self._watermark if start is None else max(pd.Timestamp(start), self._watermark)
+        delta_query = query.model_copy(update={"start": start})
+        archive = source["archive"]
+        with stage("db_read", source="refresh") as counts:
+            stat = archive.read_stats(delta_query) if archive is not None else db.read_stats(engine, delta_query)
+            if self._watermark is not None and not stat.empty:
+                # rows read at the watermark itself may already be held
+                at_watermark = pd.to_datetime(stat["utc_read_time"]) == self._watermark
+                stat = stat.loc[~(at_watermark & stat["event_id"].isin(self._watermark_event_ids))]
+            new_event_ids = [e for e in pd.unique(stat["event_id"]) if e not in self._known_event_ids]
+            if not new_event_ids:
+                performer_event_venue = pd.DataFrame()
+            else:
+                # the id filters of query still apply, as in from_db
+                pev_query = query.model_copy(update={"event_id": [int(e) for e in new_event_ids], "start": None})
+                if archive is not None:
+                    performer_event_venue = archive.read_performer_event_venue(pev_query)
+                else:
+                    performer_event_venue = db.read_performer_event_venue(engine, pev_query)
+            counts.update(stat_rows=len(stat), performer_event_venue_rows=len(performer_event_venue))
+        appended = {table_name: 0 for table_name in self._tables}
+        if fetcher is not None and not performer_event_venue.empty:
+            appended.update(self._fetch_new_events(fetcher, performer_event_venue, source["live_only"]))
+        self._append("stat", stat)
+        self._append("performer_event_venue", performer_event_venue)
+        appended.update(stat=len(stat), performer_event_venue=len(performer_event_venue))
+        if not stat.empty:
+            self._set_watermark(stat)
+        self._known_event_ids.update(new_event_ids)
+        return appended
+
+    def _set_watermark(self, stat: pd.DataFrame):
+        """records the latest utc_read_time of stat and the events read at it"""
+        read_times = pd.to_datetime(stat["utc_read_time"])
+        latest = read_times.max()
+        at_latest = set(stat.loc[read_times == latest, "event_id"])
+        if latest == self._watermark:
+            at_latest |= self._watermark_event_ids
+        self._watermark, self._watermark_event_ids = latest, at_latest
+
+    def _fetch_new_events(
+            self, fetcher: FetchEngine, performer_event_venue: pd.DataFrame, live_only: bool
+    ) -> typing.Dict[str, int]:
+        """
+        appends the events, performers and venues of new performer_event_venue rows
+        that are not held yet, fetched from the api
+        :param fetcher:
+        :param performer_event_venue:
+        :param live_only: only fetch events whose datetime_utc has not passed
+        :return: counts of appended rows per table
+        """
+        held_performers = set(self.performer["id"]) if "id" in self.performer else set()
+        with stage("api_fetch", source="refresh") as counts:
+            performer_ids = [p for p in performer_event_venue["performer_id"].unique() if p not in held_performers]
+            performers = fetcher.map_chunks('get_performers', 'id', performer_ids)
+            if live_only:
+                event_ids = get_upcoming_event_ids(performer_event_venue)
+            else:
+                event_ids = performer_event_venue["event_id"].unique()
+            events = fetcher.map_chunks('get_events', 'id', event_ids)
+            counts.update(rows=len(events), frame_bytes=_frame_bytes(events) + _frame_bytes(performers))
+        if events.empty:
+            self._append("performer", performers)
+            return {"performer": len(performers)}
+        local_data = self._build_tables(events, performers)
+        held_venues = set(self.venue["id"]) if "id" in self.venue else set()
+        venue = local_data.venue.loc[~local_data.venue["id"].isin(held_venues)]
+        self._append("event", local_data.event)
+        self._append("performer", local_data.performer)
+        self._append("venue", venue)
+        return {"event": len(local_data.event), "performer": len(local_data.performer), "venue": len(venue)}
 
     @classmethod
     def _build_tables(
-        cls, events: pd.DataFrame, performers_df: pd.DataFrame
+        cls, events: pd.DataFrame, performers_df: typing.Optional[pd.DataFrame] = None
     ):
-        print(f"building seatgeek data {datetime.now()}")
-        events = events
-        performers_df = performers_df
-        stats_df = build_stats_df(events)
-        events["venue_id"] = get_event_venue_ids(events)
-        performer_events_venue = build_performer_events_df(events)
-        venue = build_df_from_series_of_dicts(events["venue"]).drop_duplicates('id')
+        """
+        builds the stat, venue and performer_event_venue tables of events
+        :param events:
+        :param performers_df: performer table, defaults to the performers of events
+        :return:
+        """
+        log_event("build_tables", events=len(events))
+        if events.empty:
+            # a watchlist without events builds empty tables
+            return cls(
+                pd.DataFrame(), pd.DataFrame(), pd.DataFrame(columns=db.STAT_COLUMNS),
+                pd.DataFrame(columns=["event_id", "venue_id", *db.PEV_DATETIME_COLUMNS, "performer_id"]),
+                pd.DataFrame(),
+            )
+        with stage("stats_extraction") as counts:
+            stats_df = build_stats_df(events)
+            counts.update(rows=len(stats_df))
+        with stage("venue_normalization") as counts:
+            events["venue_id"] = get_event_venue_ids(events)
+            venue = build_df_from_series_of_dicts(events["venue"]).drop_duplicates('id')
+            counts.update(rows=len(venue))
+        with stage("performer_explode") as counts:
+            if performers_df is None:
+                performer_events_venue, performers_df = normalize_performers(events)
+            else:
+                performer_events_venue = build_performer_events_df(events)
+            counts.update(rows=len(performer_events_venue))
         return cls(events, performers_df, stats_df, performer_events_venue, venue)
 
-    def get_performer_events(self, performer_name: str) -> pd.Series:
-        return get_performer_events(
-            performer_name, self.performer, self.performer_event_venue
+    def compact(self):
+        """
+        shrinks the tables in place: raw nested columns (performers, venue, stats,
+        taxonomies, ...) are dropped, ids become int32, slugs and names become
+        category and datetime columns are parsed once
+        :return: self
+        """
+        for table_name in self._tables:
+            table = getattr(self, table_name)
+            if not table.empty:
+                setattr(self, table_name, compact_table(table))
+        return self
+
+    def memory_report(self) -> pd.DataFrame:
+        """
+        returns rows and deep memory usage in bytes of each table, with a total row
+        :return:
+        """
+        report = pd.DataFrame(
+            {
+                "rows": [len(getattr(self, t)) for t in self._tables],
+                "bytes": [int(getattr(self, t).memory_usage(deep=True).sum()) for t in self._tables],
+            },
+            index=pd.Index(self._tables, name="table"),
         )
+        report.loc["total"] = report.sum()
+        return report
+
+    def get_performer_events(self, performer_name: str) -> pd.Series:
+        performer_id = self._select("performer", "name", [performer_name])["id"].values[0]
+        return self._select("performer_event_venue", "performer_id", [performer_id])["event_id"]
 
     def get_performer_stats(self, performer_name: str) -> pd.DataFrame:
-        return get_performer_stats_df(performer_name, self.performer, self.event, self.performer_event_venue)
+        return self._get_stats(self.get_performer_events(performer_name))
 
     def get_performer_events_df(self, performer_name: str) -> pd.DataFrame:
-        return get_performer_events_df(
-            performer_name, self.performer, self.event, self.performer_event_venue
-        )
+        return self._select("event", "id", self.get_performer_events(performer_name))
 
     # function that pushes all tables to a database using sqlalchemy via pandas
-    def push_to_db(self, engine):
+    def push_to_db(
+            self,
+            engine,
+            incremental: bool = True,
+            stat_writer: typing.Optional[str] = None,
+            rollups: bool = True,
+            last_values: typing.Optional[delta.LastValueCache] = None,
+            heartbeat: typing.Optional[pd.Timedelta] = None,
+    ):
         """
         pushes all data to a database using sqlalchemy via pandas
-        new stat rows are appended to the stat table
-        new performer_event_venue rows are appended to the performer_event_venue table
+        new stat rows are appended to the stat table with a bulk writer, see db.STAT_WRITERS,
+        and folded into the hourly/daily rollup tables. given last_values, only rows
+        that changed since the last stored row of their event are written
+        new performer_event_venue rows are upserted into the performer_event_venue table,
+        keyed on (event_id, performer_id). with incremental=False the stored table is
+        read, concatenated with the new rows and replaced (legacy behaviour)
         :param engine:
+        :param incremental:
+        :param stat_writer: name of the stat bulk writer, defaults to the one for the engine dialect
+        :param rollups: update the rollup tables with the new stat rows
+        :param last_values: cache of the last written stats, enables change-only writes
+        :param heartbeat: with last_values, also write unchanged rows once the last one is this old
         :return:
         """
-        self.stat.to_sql("stat", engine, if_exists="append", index=False, chunksize=10000)
+        with stage("db_write", table="stat") as counts:
+            stat = self.stat
+            if last_values is not None:
+                stat = delta.suppress_unchanged(stat, engine, last_values, heartbeat)
+            db.write_stats(stat, engine, stat_writer)
+            if last_values is not None:
+                last_values.update(stat)
+            counts.update(rows=len(stat), suppressed=len(self.stat) - len(stat))
+        if rollups:
+            with stage("db_write", table="rollups") as counts:
+                counts.update(rollup.update_rollups(stat, engine))
+
+        if incremental:
+            with stage("db_write", table="performer_event_venue") as counts:
+                counts.update(db.upsert_performer_event_venue(self.performer_event_venue, engine))
+            return
 
         try:
             stored_performer_event_venue = pd.read_sql_table("performer_event_venue", engine)
@@ -332,9 +772,8 @@ class SeatgeekData:
         :param query:
         :return:
         """
-        table = getattr(self, query.slug.name)
         # select id from table where slug = query.slug.value, should be unique
-        id_ = table.loc[table['slug'] == query.slug.value, "id"].values[0]
+        id_ = self._slug_index(query.slug.name)[query.slug.value]
         return self.get_pev_by_id(schema.ForeignKey(fk={f"{query.slug.name}_id": id_}))
 
     def get_pev_by_id(self, query: schema.ForeignKey) -> pd.DataFrame:
@@ -344,19 +783,54 @@ class SeatgeekData:
         :return:
         """
         # select rows in self.performer_event_venue where query.id.key = query.id.value
-        return self.performer_event_venue.loc[
-            self.performer_event_venue[query.fk.name] == query.fk.value
-            ]
+        return self._select("performer_event_venue", query.fk.name, [query.fk.value])
 
     def _get_stats(self, event_ids: pd.Series) -> pd.DataFrame:
-        return self.stat.loc[self.stat.event_id.isin(event_ids)]
+        order, sorted_event_ids = self._stat_event_index()
+        return self.stat.iloc[_range_positions(order, sorted_event_ids, event_ids)]
 
-    def get_stats_by_slug(self, query: schema.SlugReq) -> pd.DataFrame:
+    def _get_bucketed_stats(
+            self,
+            event_ids: pd.Series,
+            bucket: typing.Optional[str],
+            aggregations: typing.Optional[typing.List[str]],
+    ) -> pd.DataFrame:
+        stats = self._get_stats(event_ids)
+        if bucket is None:
+            return stats
+        return buckets.bucket_stats(stats, bucket, aggregations)
+
+    def get_stats_by_slug(
+            self,
+            query: schema.SlugReq,
+            bucket: typing.Optional[str] = None,
+            aggregations: typing.Optional[typing.List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        returns the stats of the events of a slug, every snapshot or, given bucket,
+        one row per event and bucket, see buckets.bucket_stats
+        :param query:
+        :param bucket: e.g. '1h' or '1d'
+        :param aggregations: e.g. ['mean', 'max'], defaults to buckets.DEFAULT_AGGREGATIONS
+        :return:
+        """
         event_ids = self.get_ids_by_slug(query).event_id
-        return self._get_stats(event_ids)
+        return self._get_bucketed_stats(event_ids, bucket, aggregations)
 
-    def get_stats_by_id(self, query: schema.ForeignKey) -> pd.DataFrame:
+    def get_stats_by_id(
+            self,
+            query: schema.ForeignKey,
+            bucket: typing.Optional[str] = None,
+            aggregations: typing.Optional[typing.List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        returns the stats of the events of an id, see get_stats_by_slug
+        :param query:
+        :param bucket:
+        :param aggregations:
+        :return:
+        """
         event_ids = self.get_pev_by_id(query).event_id
-        return self._get_stats(event_ids)
+        return self._get_bucketed_stats(event_ids, bucket, aggregations)
 
 
@@ -0,0 +1,113 @@
+"""
+fan-out of many watchlists into one ingestion run: the ids of every watchlist are
+merged so each distinct venue, performer and event is fetched once, and the
+fetched events are attributed back to the watchlists that asked for them
+"""
+import typing
+
+import pandas as pd
+
+import src.fetch_data.db as db
+from src.schemas.models import WatchListResponse
+
+WATCHLIST_EVENT_TABLE = "watchlist_event"
+WATCHLIST_EVENT_KEY = ["username", "event_id", "matched_by"]
+# watchlist id field -> performer_event_venue column it is matched on
+WATCHLIST_ID_COLUMNS = {
+    "venue_id": "venue_id",
+    "performer_id": "performer_id",
+    "event_id": "event_id",
+}
+# the latest watchlist document of each user, unless that one is marked inactive
+LATEST_WATCHLIST_PIPELINE = [
+    {"$sort": {"_id": -1}},
+    {"$group": {"_id": "$username", "document": {"$first": "$$ROOT"}}},
+    {"$replaceRoot": {"newRoot": "$document"}},
+    {"$match": {"active": {"$ne": False}}},
+    {"$sort": {"username": 1}},
+]
+
+
+def read_latest_watchlists(collection) -> typing.List[WatchListResponse]:
+    """
+    returns the latest active watchlist of each user, older documents of a user
+    hold ids they have since dropped
+    :param collection: mongo collection of watchlist documents
+    :return:
+    """
+    return [
+        WatchListResponse(
+            username=document["username"],
+            **{f: [str(i) for i in document[f]] for f in WATCHLIST_ID_COLUMNS if document.get(f)},
+        )
+        for document in collection.aggregate(LATEST_WATCHLIST_PIPELINE)
+    ]
+
+
+def merge_watchlists(watchlists: typing.Iterable[WatchListResponse]) -> typing.Dict[str, typing.List[str]]:
+    """
+    returns the union of the venue, performer and event ids of watchlists, each id
+    once in first-seen order, as keyword arguments of SeatgeekData.from_watchlist
+    :param watchlists:
+    :return:
+    """
+    merged = {field: {} for field in WATCHLIST_ID_COLUMNS}
+    for watchlist in watchlists:
+        for field in WATCHLIST_ID_COLUMNS:
+            merged[field].update(dict.fromkeys(str(i) for i in getattr(watchlist, field) or []))
+    return {field: list(ids) for field, ids in merged.items()}
+
+
+def watchlist_ids(watchlists: typing.Iterable[WatchListResponse]) -> pd.DataFrame:
+    """
+    returns one (username, matched_by, id) row per id of each watchlist
+    :param watchlists:
+    :return:
+    """
+    rows = [
+        (watchlist.username, field, str(i))
+        for watchlist in watchlists
+        for field in WATCHLIST_ID_COLUMNS
+        for i in getattr(watchlist, field) or []
+    ]
+    ids = pd.DataFrame(rows, columns=["username", "matched_by", "id"])
+    ids["id"] = pd.to_numeric(ids["id"], errors="coerce")
+    return ids.dropna(subset=["id"]).astype({"id": "int64"}).drop_duplicates()
+
+
+def attribute_events(
+        watchlists: typing.Iterable[WatchListResponse], performer_event_venue: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    returns the (username, event_id, matched_by) pairs linking each watchlist to the
+    fetched events of its venues, performers and events
+    :param watchlists:
+    :param performer_event_venue:
+    :return:
+    """
+    ids = watchlist_ids(watchlists)
+    frames = []
+    for field, column in WATCHLIST_ID_COLUMNS.items():
+        wanted = ids.loc[ids["matched_by"] == field]
+        if wanted.empty or performer_event_venue.empty:
+            continue
+        links = pd.DataFrame(
+            {"event_id": performer_event_venue["event_id"], "id": performer_event_venue[column].astype("int64")}
+        ).drop_duplicates()
+        matched = wanted.merge(links, on="id")
+        frames.append(matched[["username", "event_id", "matched_by"]])
+    if not frames:
+        return pd.DataFrame(columns=WATCHLIST_EVENT_KEY)
+    return pd.concat(frames, ignore_index=True).drop_duplicates().reset_index(drop=True)
+
+
+def push_attribution(attribution: pd.DataFrame, engine) -> typing.Dict[str, int]:
+    """
+    records new watchlist/event links in the watchlist_event table
+    :param attribution: rows of attribute_events
+    :param engine:
+    :return: counts of inserted and updated rows
+    """
+    if attribution.empty:
+        return {"inserted": 0, "updated": 0}
+    return db.upsert_rows(attribution, engine, WATCHLIST_EVENT_TABLE, WATCHLIST_EVENT_KEY)
@@ -1,8 +1,5 @@
-import env
 from src.fetch_data.table_builders import SeatgeekData
-from sqlalchemy import create_engine
-
-from src.scalpyr import ScalpyrPro
+import src.fetch_data.connections as connections
 
 
 # function: pull all data from 'performer_event_venue' table to df,
@@ -14,15 +11,15 @@ def migrate():
     :param engine:
     :return:
     """
-    engine = create_engine(env.PLANETSCALE_URL, echo=True)
-    client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
+    engine = connections.get_engine(echo=True)
+    client = connections.get_client()
     data = SeatgeekData.from_db(engine, client)
     data.performer_event_venue.to_sql('performer_event_venue', engine, if_exists='replace', index=False)
 
 
 def reformat():
-    engine = create_engine(env.PLANETSCALE_URL, echo=True)
-    client = ScalpyrPro(env.SEATGEEK_CLIENT_ID)
+    engine = connections.get_engine(echo=True)
+    client = connections.get_client()
     data = SeatgeekData.from_api(client)
     data.performer_event_venue.to_sql('performer_event_venue', engine, if_exists='replace', index=False)
 
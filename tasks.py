@@ -53,7 +53,35 @@ def gcrdeploy(c):
         '--env-vars-file',
         './env.yaml',
         '--memory',
-        '2Gi'
+        '2Gi',
+        # POST / answers 202 and ingests in a background thread, which needs cpu after the response
+        '--no-cpu-throttling',
     ]
     print(' '.join(command))
     subprocess.run(command, check=True, shell=True)
+
+
+@task
+def syncarchive(c):
+    """
+    mirror the stat and performer_event_venue tables into the local parquet archive
+    :param c:
+    :return:
+    """
+    from sqlalchemy import create_engine
+    from src.fetch_data.archive import ParquetArchive
+    print("Syncing parquet archive...")
+    print(ParquetArchive().sync(create_engine(env.PLANETSCALE_URL)))
+
+
+@task
+def backfillrollups(c):
+    """
+    build the hourly and daily rollup tables from the stat history
+    :param c:
+    :return:
+    """
+    from sqlalchemy import create_engine
+    from src.fetch_data.rollup import backfill_rollups
+    print("Backfilling rollup tables...")
+    print(backfill_rollups(create_engine(env.PLANETSCALE_URL)))
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+
+def mock_event(event_id, venue_id, performer_ids):
+    """
+    returns a seatgeek event payload
+    :param event_id:
+    :param venue_id:
+    :param performer_ids:
+    :return:
+    """
+    return {
+        'id': event_id,
+        'type': 'concert',
+        'datetime_utc': '2030-01-01T20:00:00',
+        'announce_date': '2029-01-01T00:00:00',
+        'visible_at': '2029-01-01T00:00:00',
+        'venue': {'id': venue_id, 'name': f'venue {venue_id}', 'slug': f'venue-{venue_id}'},
+        'performers': [
+            {'id': p, 'name': f'performer {p}', 'slug': f'performer-{p}'} for p in performer_ids
+        ],
+        'stats': {
+            'average_price': 100, 'lowest_price': 50, 'highest_price': 200,
+            'median_price': 90, 'listing_count': 10, 'visible_listing_count': 8,
+            'lowest_sg_base_price': 45,
+        },
+    }
+
+
+class StubScalpyr:
+    """
+    stands in for ScalpyrPro, serves get_events from a fixed list of events,
+    honouring id filters and paging, and records every request
+    """
+    def __init__(self, events, delay=0.0):
+        self.events = events
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def get_events(self, params):
+        with self._lock:
+            self.requests.append(params)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        matches = self.events
+        if 'id' in params:
+            ids = set(params['id'].split(','))
+            matches = [e for e in matches if str(e['id']) in ids]
+        if 'venue.id' in params:
+            ids = set(params['venue.id'].split(','))
+            matches = [e for e in matches if str(e['venue']['id']) in ids]
+        if 'performers.id' in params:
+            ids = set(params['performers.id'].split(','))
+            matches = [e for e in matches if ids & {str(p['id']) for p in e['performers']}]
+        with self._lock:
+            self.active -= 1
+        return self._page(matches, params)
+
+    def get_performers(self, params):
+        self.requests.append(params)
+        performers = {p['id']: p for e in self.events for p in e['performers']}
+        ids = {int(i) for i in params['id'].split(',')}
+        return self._page([p for i, p in performers.items() if i in ids], params)
+
+    def get_venues(self, params):
+        self.requests.append(params)
+        venues = {e['venue']['id']: e['venue'] for e in self.events}
+        ids = {int(i) for i in params['id'].split(',')}
+        return self._page([v for i, v in venues.items() if i in ids], params)
+
+    @staticmethod
+    def _page(rows, params):
+        start = (params['page'] - 1) * params['per_page']
+        return pd.DataFrame(rows[start:start + params['per_page']])
+
+
+@pytest.fixture
+def stub_client():
+    events = [mock_event(i, 1000 + i % 7, [i % 11, 100 + i % 3]) for i in range(1, 121)]
+    return StubScalpyr(events, delay=0.02)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """
+    returns a sqlite engine backed by a temporary file
+    :param tmp_path:
+    :return:
+    """
+    return create_engine(f"sqlite:///{tmp_path / 'test.db'}")
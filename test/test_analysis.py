@@ -0,0 +1,51 @@
+import pandas as pd
+
+import src.fetch_data as fetch_data
+from src.analysis import analysis_scripts
+from src.fetch_data.client_cache import CachedScalpyr
+
+
+def test_plot_all_stats_batch(stub_client, tmp_path):
+    data = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[:6]))
+    later = data.stat.assign(utc_read_time=data.stat.utc_read_time + pd.Timedelta('1h'))
+    stats = pd.concat([data.stat, later], ignore_index=True)
+    client = CachedScalpyr(stub_client, tmp_path / 'cache.sqlite')
+
+    titles = analysis_scripts.build_event_titles(data.performer_event_venue, client)
+    assert titles[1] == 'performer-1, venue 1001, 2030-01-01T20:00:00'
+    paths = analysis_scripts.plot_all_stats_batch(
+        stats, data.performer_event_venue, tmp_path / 'plots', processes=2, client=client
+    )
+    assert sorted(p.name for p in paths) == [f'{i}.png' for i in range(1, 7)]
+    assert all(p.stat().st_size > 0 for p in paths)
+    # one venue and one performer lookup for all events
+    assert len(stub_client.requests) == 2
+
+
+def test_stats_info_view(stub_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis_scripts, '_client', CachedScalpyr(stub_client, tmp_path / 'cache.sqlite'))
+    data = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events))
+    plotter = analysis_scripts.DataPlotter(
+        data.event, data.performer, data.stat, data.performer_event_venue, data.venue
+    )
+    view = plotter.stats_info_view('performer-100')
+    assert sorted(view.event_id) == [e['id'] for e in stub_client.events if e['id'] % 3 == 0]
+    row = view.loc[view.event_id == 3].iloc[0]
+    assert row.title == 'performer-100,venue-1003,2030-01-01T20:00:00'
+    projected = plotter.stats_info_view(
+        'performer-100', columns=['utc_read_time', 'average_price', 'event_id', 'title']
+    )
+    assert list(projected.columns) == ['utc_read_time', 'average_price', 'event_id', 'title']
+    assert len(projected) == len(view)
+
+
+def test_build_event_titles_with_empty_lookup(stub_client, tmp_path):
+    data = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[:3]))
+    client = CachedScalpyr(stub_client, tmp_path / 'cache.sqlite')
+    unknown = data.performer_event_venue.assign(venue_id=-1, performer_id=-1)
+    stub_client.events = []
+    titles = analysis_scripts.build_event_titles(unknown, client)
+    assert titles.empty
+    # plots fall back to the event id as title
+    assert titles.get(1, str(1)) == '1'
+    assert analysis_scripts.build_event_titles(unknown.iloc[:0], client).empty
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+import src.fetch_data as fetch_data
+import src.fetch_data.db as db
+from src.fetch_data.archive import EVENT_BUCKETS, ParquetArchive
+
+
+def mock_stats(event_ids, read_time):
+    n = len(event_ids)
+    return pd.DataFrame(
+        {
+            'event_id': event_ids,
+            'average_price': [float(e) for e in event_ids],
+            'lowest_price': [1.0] * n,
+            'highest_price': [9.0] * n,
+            'median_price': [5.0] * n,
+            'listing_count': [10] * n,
+            'visible_listing_count': [10] * n,
+            'utc_read_time': pd.Timestamp(read_time),
+        }
+    )
+
+
+@pytest.fixture
+def engine(engine):
+    pd.DataFrame(
+        {'event_id': [1, 2, 17], 'performer_id': [1, 1, 2], 'venue_id': [10, 20, 10]}
+    ).to_sql(db.PEV_TABLE, engine, index=False)
+    mock_stats([1, 2, 17], '2030-01-01 10:00').to_sql(db.STAT_TABLE, engine, index=False)
+    mock_stats([1, 2, 17], '2030-01-02 10:00').to_sql(db.STAT_TABLE, engine, index=False, if_exists='append')
+    return engine
+
+
+def test_sync_leaves_latest_read_time_for_next_sync(engine, tmp_path):
+    archive = ParquetArchive(tmp_path / 'archive')
+    assert archive.sync(engine) == {'stat': 3, 'performer_event_venue': 3}
+    assert archive.watermark == pd.Timestamp('2030-01-02 10:00')
+    # nothing new below the latest read time
+    assert archive.sync(engine)['stat'] == 0
+    mock_stats([1, 2], '2030-01-03 10:00').to_sql(db.STAT_TABLE, engine, index=False, if_exists='append')
+    assert archive.sync(engine)['stat'] == 3
+    stored = archive.read_stats(fetch_data.StatQuery())
+    assert len(stored) == 6
+    assert not stored.duplicated(['event_id', 'utc_read_time']).any()
+    partitions = {p.relative_to(archive.stat_path).parts[:2] for p in archive.stat_path.glob('**/*.parquet')}
+    assert ('date=2030-01-01', f'event_bucket={17 % EVENT_BUCKETS}') in partitions
+
+
+def test_read_matches_database(engine, tmp_path):
+    mock_stats([1, 2], '2030-01-03 10:00').to_sql(db.STAT_TABLE, engine, index=False, if_exists='append')
+    archive = ParquetArchive(tmp_path / 'archive')
+    archive.sync(engine)
+    query = fetch_data.StatQuery(
+        performer_id=[1], start='2030-01-02', columns=['average_price', 'utc_read_time']
+    )
+    from_archive = archive.read_stats(query)
+    assert list(from_archive.columns) == ['event_id', 'average_price', 'utc_read_time']
+    expected = db.read_stats(engine, query.model_copy(update={'end': archive.watermark}))
+    pd.testing.assert_frame_equal(
+        from_archive.sort_values('event_id').reset_index(drop=True),
+        expected.sort_values('event_id').reset_index(drop=True),
+        check_dtype=False,
+    )
+    by_venue = archive.read_performer_event_venue(fetch_data.StatQuery(venue_id=[10]))
+    assert sorted(by_venue.event_id) == [1, 17]
+
+
+def test_read_empty_archive(tmp_path):
+    stats = ParquetArchive(tmp_path / 'archive').read_stats(fetch_data.StatQuery(columns=['lowest_price']))
+    assert stats.empty
+    assert list(stats.columns) == ['event_id', 'lowest_price']
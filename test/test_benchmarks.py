@@ -0,0 +1,25 @@
+from benchmarks.bench_table_builders import compare
+from benchmarks.synthetic import generate_events
+from src.fetch_data import SeatgeekData
+from src.fetch_data.table_builders import build_df_from_series_of_dicts
+
+
+def test_synthetic_events_build_tables():
+    events = generate_events(200, no_listing_share=0.5)
+    assert events.id.is_unique
+    performers = build_df_from_series_of_dicts(events.performers.explode()).drop_duplicates(subset=['id'])
+    data = SeatgeekData._build_tables(events, performers)
+    # events without listings carry no prices and are dropped from the stats
+    assert 0 < len(data.stat) < len(events)
+    assert len(data.performer_event_venue) >= len(events)
+    assert data.venue.id.is_unique
+
+
+def test_compare_flags_regressions_past_tolerance():
+    baseline = {'10k': {'a': {'seconds': 1.0, 'peak_bytes': 10 << 20}, 'b': {'seconds': 0.001, 'peak_bytes': 0}}}
+    results = {
+        '10k': {'a': {'seconds': 1.2, 'peak_bytes': 20 << 20}, 'b': {'seconds': 0.004, 'peak_bytes': 0}},
+        '1m': {'a': {'seconds': 100.0, 'peak_bytes': 0}},
+    }
+    assert compare(results, baseline) == ['10k a peak_bytes: 10485760 -> 20971520 (+100%)']
+    assert len(compare(results, baseline, tolerance=0.1)) == 2
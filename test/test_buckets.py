@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.fetch_data as fetch_data
+import src.fetch_data.buckets as buckets
+import src.fetch_data.db as db
+
+
+def snapshots(event_ids=(1, 2, 3), periods=200, freq='7min', seed=0):
+    """
+    returns stat rows of each event read every freq
+    :param event_ids:
+    :param periods:
+    :param freq:
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    read_times = pd.date_range('2030-01-01 00:03', periods=periods, freq=freq)
+    n = periods * len(event_ids)
+    return pd.DataFrame(
+        {
+            'event_id': np.tile(event_ids, periods),
+            'average_price': rng.integers(50, 100, n).astype(float),
+            'lowest_price': rng.integers(10, 50, n).astype(float),
+            'highest_price': rng.integers(100, 200, n).astype(float),
+            'median_price': rng.integers(40, 90, n).astype(float),
+            'listing_count': rng.integers(0, 100, n),
+            'visible_listing_count': rng.integers(0, 100, n),
+            'utc_read_time': np.repeat(read_times, len(event_ids)),
+        }
+    )
+
+
+@pytest.mark.parametrize('bucket', ['1h', '1d', '15min'])
+def test_sql_and_memory_buckets_match(engine, bucket):
+    stats = snapshots()
+    stats.to_sql(db.STAT_TABLE, engine, index=False)
+    query = fetch_data.StatBucketQuery(
+        bucket=bucket,
+        aggregations=['mean', 'min', 'max', 'count'],
+        columns=['median_price', 'listing_count'],
+        event_id=[1, 3],
+        start=pd.Timestamp('2030-01-01 01:00'),
+    )
+    in_db = buckets.read_bucketed_stats(engine, query)
+    selected = stats.loc[stats.event_id.isin([1, 3]) & (stats.utc_read_time >= query.start)]
+    in_memory = buckets.bucket_stats(selected, bucket, query.aggregations, query.columns)
+    assert list(in_db.columns) == list(in_memory.columns) == [
+        'event_id', 'bucket', 'n',
+        'median_price_mean', 'median_price_min', 'median_price_max', 'median_price_count',
+        'listing_count_mean', 'listing_count_min', 'listing_count_max', 'listing_count_count',
+    ]
+    pd.testing.assert_frame_equal(in_db, in_memory, check_dtype=False)
+    # one row per event and bucket, however many snapshots were read
+    assert in_db.groupby('event_id').size().max() == in_db.bucket.nunique()
+    assert in_db.n.sum() == len(selected)
+
+
+def test_bucket_validation():
+    assert buckets.bucket_seconds('1d') == 86400
+    with pytest.raises(ValueError):
+        buckets.bucket_seconds('500ms')
+    with pytest.raises(ValueError):
+        buckets.bucket_stats(snapshots(), '1h', ['median'])
+
+
+def test_seatgeek_data_bucketed_stats(stub_client):
+    data = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events))
+    hourly = [data.stat.assign(utc_read_time=pd.Timestamp('2030-01-01') + pd.Timedelta(minutes=m)) for m in range(0, 180, 20)]
+    data.stat = pd.concat(hourly, ignore_index=True)
+    query = fetch_data.SlugReq(slug={'performer': 'performer-100'})
+    raw = data.get_stats_by_slug(query)
+    bucketed = data.get_stats_by_slug(query, bucket='1h', aggregations=['max'])
+    assert len(raw) == 3 * len(bucketed)
+    assert (bucketed.n == 3).all()
+    assert set(bucketed.bucket) == set(pd.date_range('2030-01-01', periods=3, freq='h'))
+    by_id = data.get_stats_by_id(fetch_data.ForeignKey(fk={'venue_id': 1003}), bucket='1d')
+    assert set(by_id.columns) >= {'event_id', 'bucket', 'n', 'median_price_mean'}
+    assert (by_id.n == 9).all()
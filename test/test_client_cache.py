@@ -0,0 +1,61 @@
+import pytest
+
+from src.fetch_data.client_cache import CachedScalpyr
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cached_client(stub_client, clock, tmp_path):
+    return CachedScalpyr(stub_client, tmp_path / 'cache.sqlite', ttl=60, max_entries=5, clock=clock)
+
+
+def test_duplicate_ids_are_fetched_once(cached_client, stub_client):
+    performers = cached_client.get_by_id('performers', ['1', '2', '1', 2])
+    assert list(performers.id) == [1, 2]
+    assert len(stub_client.requests) == 1
+    assert stub_client.requests[0]['id'] == '1,2'
+    venues = cached_client.get_venues({'id': '1001'})
+    assert venues.slug.values[0] == 'venue-1001'
+    assert cached_client.cache_info() == {'hits': 0, 'misses': 3, 'entries': 3}
+
+
+def test_hits_are_served_from_disk(cached_client, stub_client, tmp_path, clock):
+    cached_client.get_performers({'id': '1,2'})
+    requests = len(stub_client.requests)
+    reopened = CachedScalpyr(stub_client, tmp_path / 'cache.sqlite', ttl=60, clock=clock)
+    performers = reopened.get_performers({'id': '2,1,3'})
+    assert list(performers.id) == [2, 1, 3]
+    assert stub_client.requests[requests:] == [{'id': '3', 'per_page': 100, 'page': 1}]
+    assert reopened.cache_info()['hits'] == 2
+
+
+def test_expired_entries_are_refetched(cached_client, stub_client, clock):
+    cached_client.get_performers({'id': '1'})
+    clock.now += 61
+    cached_client.get_performers({'id': '1'})
+    assert cached_client.cache_info()['misses'] == 2
+    assert len(stub_client.requests) == 2
+
+
+def test_least_recently_used_entries_are_evicted(cached_client, clock):
+    for i in range(1, 8):
+        clock.now += 1
+        cached_client.get_performers({'id': str(i)})
+        if i > 1:
+            # keep performer 1 recently used
+            clock.now += 1
+            cached_client.get_performers({'id': '1'})
+    assert cached_client.cache_info()['entries'] == 5
+    assert cached_client._read('performers', ['1', '2']).keys() == {'1'}
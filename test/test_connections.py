@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+import src.fetch_data.connections as connections
+
+
+def test_engine_is_shared_and_connections_reused(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    try:
+        engine = connections.get_engine(url)
+        assert connections.get_engine(url) is engine
+        assert connections.get_engine(url, echo=True) is not engine
+        for i in range(5):
+            pd.DataFrame({'a': [i]}).to_sql('t', engine, if_exists='append', index=False)
+        stats = connections.connection_stats(engine)
+        assert stats['connects'] == 1
+        assert stats['reused'] == stats['checkouts'] - 1 > 0
+    finally:
+        connections.dispose_engines()
+
+
+def test_pool_options():
+    assert 'pool_size' not in connections.pool_options('sqlite://')
+    options = connections.pool_options('mysql+mysqlconnector://user:pw@host/db')
+    assert options['pool_size'] == connections.POOL_SIZE
+    assert options['pool_pre_ping'] is connections.POOL_PRE_PING
+
+
+def test_client_uses_the_pooled_session(monkeypatch):
+    class Client:
+        def __init__(self, client_id):
+            self.session = None
+
+    class ClientWithoutSession:
+        def __init__(self, client_id):
+            pass
+
+    monkeypatch.setattr(connections, 'ScalpyrPro', Client)
+    monkeypatch.setattr(connections, '_client', None)
+    assert connections.get_client().session is connections.get_http_session()
+    monkeypatch.setattr(connections, 'ScalpyrPro', ClientWithoutSession)
+    monkeypatch.setattr(connections, '_client', None)
+    with pytest.raises(TypeError):
+        connections.get_client()
+    assert connections._client is None
@@ -0,0 +1,184 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+import src.fetch_data as fetch_data
+import src.fetch_data.db as db
+
+
+def mock_performer_event_venue(event_ids, performer_ids, datetimes=None):
+    """
+    returns a performer_event_venue frame for the given ids
+    :param event_ids:
+    :param performer_ids:
+    :param datetimes:
+    :return:
+    """
+    n = len(event_ids)
+    return pd.DataFrame(
+        {
+            'event_id': event_ids,
+            'venue_id': [10] * n,
+            'datetime_utc': datetimes or ['2030-01-01T20:00:00'] * n,
+            'announce_date': ['2029-01-01T00:00:00'] * n,
+            'visible_at': ['2029-01-01T00:00:00'] * n,
+            'performer_id': performer_ids,
+        }
+    )
+
+
+def test_upsert_creates_table(engine):
+    pev = mock_performer_event_venue([1, 2, 2], [1, 1, 2])
+    result = db.upsert_performer_event_venue(pev, engine)
+    assert result == {'inserted': 3, 'updated': 0}
+    stored = pd.read_sql_table(db.PEV_TABLE, engine)
+    assert len(stored) == 3
+
+
+def test_upsert_inserts_new_keys_only(engine):
+    db.upsert_performer_event_venue(mock_performer_event_venue([1, 2], [1, 1]), engine)
+    result = db.upsert_performer_event_venue(
+        mock_performer_event_venue([1, 2, 3], [1, 1, 1]), engine
+    )
+    assert result == {'inserted': 1, 'updated': 0}
+    stored = pd.read_sql_table(db.PEV_TABLE, engine)
+    assert sorted(stored.event_id) == [1, 2, 3]
+
+
+def test_upsert_updates_changed_rows(engine):
+    db.upsert_performer_event_venue(mock_performer_event_venue([1, 2], [1, 1]), engine)
+    # event 2 is rescheduled, same instant written in a different format for event 1
+    rescheduled = mock_performer_event_venue(
+        [1, 2], [1, 1], ['2030-01-01 20:00:00', '2030-02-01T20:00:00']
+    )
+    result = db.upsert_performer_event_venue(rescheduled, engine)
+    assert result == {'inserted': 0, 'updated': 1}
+    stored = pd.read_sql_table(db.PEV_TABLE, engine).set_index('event_id')
+    assert len(stored) == 2
+    assert stored.loc[2, 'datetime_utc'] == '2030-02-01T20:00:00'
+
+
+def test_upsert_keeps_keys_unique_across_writers(engine, monkeypatch):
+    db.upsert_performer_event_venue(mock_performer_event_venue([1, 2], [1, 1]), engine)
+    indexes = sa.inspect(engine).get_indexes(db.PEV_TABLE)
+    assert [(i['column_names'], i['unique']) for i in indexes] == [(db.PEV_KEY, 1)]
+    # another writer inserts the same keys between the read and the insert
+    monkeypatch.setattr(
+        db, 'read_rows_where_in', lambda con, table, *args: pd.DataFrame(columns=[c.name for c in table.columns])
+    )
+    rescheduled = mock_performer_event_venue([2, 3], [1, 1], ['2030-02-01T20:00:00'] * 2)
+    db.upsert_performer_event_venue(rescheduled, engine)
+    stored = pd.read_sql_table(db.PEV_TABLE, engine).set_index('event_id')
+    assert sorted(stored.index) == [1, 2, 3]
+    assert stored.loc[2, 'datetime_utc'] == '2030-02-01T20:00:00'
+
+
+def test_upsert_into_table_with_duplicate_keys(engine):
+    pd.concat([mock_performer_event_venue([1], [1])] * 2).to_sql(db.PEV_TABLE, engine, index=False)
+    result = db.upsert_performer_event_venue(mock_performer_event_venue([1, 2], [1, 1]), engine)
+    assert result == {'inserted': 1, 'updated': 0}
+    assert sa.inspect(engine).get_indexes(db.PEV_TABLE) == []
+    assert len(pd.read_sql_table(db.PEV_TABLE, engine)) == 3
+
+
+def test_push_to_db_is_incremental(engine):
+    stats = pd.DataFrame(
+        {
+            'event_id': [1, 2],
+            'average_price': [10.0, 20.0],
+            'lowest_price': [5.0, 10.0],
+            'median_price': [8.0, 16.0],
+            'listing_count': [3, 4],
+            'utc_read_time': pd.to_datetime(['2030-01-01', '2030-01-01']),
+        }
+    )
+    data = fetch_data.SeatgeekData(
+        events=pd.DataFrame(),
+        performers=pd.DataFrame(),
+        stats=stats,
+        performer_event_venue=mock_performer_event_venue([1, 2], [1, 1]),
+        venue=pd.DataFrame(),
+    )
+    data.push_to_db(engine)
+    data.push_to_db(engine)
+    assert len(pd.read_sql_table('stat', engine)) == 4
+    assert len(pd.read_sql_table(db.PEV_TABLE, engine)) == 2
+
+
+@pytest.fixture
+def stored_tables(engine):
+    """
+    writes two events for performer 1 and one for performer 2, each read at two times
+    :param engine:
+    :return:
+    """
+    pev = mock_performer_event_venue([1, 2, 3], [1, 1, 2])
+    pev.loc[2, 'venue_id'] = 20
+    pev.to_sql(db.PEV_TABLE, engine, index=False)
+    stats = pd.DataFrame(
+        {
+            'event_id': [1, 2, 3, 1, 2, 3],
+            'average_price': [10.0, 20.0, 30.0, 11.0, 21.0, 31.0],
+            'lowest_price': [1.0, 2.0, 3.0, 1.0, 2.0, 3.0],
+            'highest_price': [1.0, 2.0, 3.0, 1.0, 2.0, 3.0],
+            'median_price': [1.0, 2.0, 3.0, 1.0, 2.0, 3.0],
+            'listing_count': [1, 2, 3, 1, 2, 3],
+            'visible_listing_count': [1, 2, 3, 1, 2, 3],
+            'utc_read_time': pd.to_datetime(['2030-01-01'] * 3 + ['2030-01-02'] * 3),
+        }
+    )
+    stats.to_sql(db.STAT_TABLE, engine, index=False)
+    return engine
+
+
+def test_read_stats_filters_and_projects(stored_tables):
+    query = fetch_data.StatQuery(
+        performer_id=[1], start='2030-01-02', columns=['average_price', 'utc_read_time'], chunksize=1
+    )
+    stats = db.read_stats(stored_tables, query)
+    assert list(stats.columns) == ['event_id', 'average_price', 'utc_read_time']
+    assert sorted(stats.average_price) == [11.0, 21.0]
+    assert str(stats.utc_read_time.dtype).startswith('datetime64')
+
+
+def test_read_stats_by_venue_and_event(stored_tables):
+    by_venue = db.read_stats(stored_tables, fetch_data.StatQuery(venue_id=[20]))
+    assert sorted(by_venue.event_id) == [3, 3]
+    by_event = db.read_stats(stored_tables, fetch_data.StatQuery(event_id=[2], end='2030-01-02'))
+    assert list(by_event.average_price) == [20.0]
+
+
+def test_read_stats_rejects_unknown_columns(stored_tables):
+    with pytest.raises(ValueError):
+        db.read_stats(stored_tables, fetch_data.StatQuery(columns=['event_id; drop table stat']))
+
+
+def test_read_performer_event_venue(stored_tables):
+    pev = db.read_performer_event_venue(stored_tables, fetch_data.StatQuery(performer_id=[1]))
+    assert sorted(pev.event_id) == [1, 2]
+    assert 'datetime_utc' in pev.columns
+
+
+@pytest.mark.parametrize('writer', ['multi', 'executemany'])
+def test_stat_writers_append(engine, writer):
+    stats = pd.DataFrame(
+        {
+            'event_id': [1, 2, 3],
+            'average_price': pd.array([10.5, None, 30.0], dtype='float32'),
+            'listing_count': pd.array([1, 2, 3], dtype='int32'),
+            'utc_read_time': pd.to_datetime(['2030-01-01 10:00', '2030-01-01 10:00', '2030-01-02 00:00']),
+        }
+    )
+    assert db.write_stats(stats, engine, writer) == 3
+    assert db.write_stats(stats, engine, writer) == 3
+    stored = pd.read_sql_table(db.STAT_TABLE, engine)
+    assert len(stored) == 6
+    assert stored.average_price.isna().sum() == 2
+    assert list(stored.utc_read_time[:3]) == list(stats.utc_read_time)
+    window = db.read_stats(engine, fetch_data.StatQuery(start='2030-01-02', columns=['listing_count']))
+    assert list(window.event_id) == [3, 3]
+
+
+def test_load_data_writer_requires_mysql(engine):
+    with pytest.raises(ValueError):
+        db.write_stats(pd.DataFrame({'event_id': [1]}), engine, 'load_data')
@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+
+import src.fetch_data as fetch_data
+import src.fetch_data.db as db
+import src.fetch_data.delta as delta
+
+
+def snapshot(read_time, prices, counts=None):
+    """
+    returns one stat row per event, event ids 1..n
+    :param read_time:
+    :param prices: average_price of each event
+    :param counts: listing_count of each event
+    :return:
+    """
+    n = len(prices)
+    counts = counts or [10] * n
+    return pd.DataFrame(
+        {
+            'event_id': list(range(1, n + 1)),
+            'average_price': prices,
+            'lowest_price': [1.0] * n,
+            'highest_price': [9.0] * n,
+            'median_price': [5.0] * n,
+            'listing_count': list(counts),
+            'visible_listing_count': list(counts),
+            'utc_read_time': pd.Timestamp(read_time),
+        }
+    )
+
+
+def push(engine, stats, last_values, heartbeat=None):
+    data = fetch_data.SeatgeekData(pd.DataFrame(), pd.DataFrame(), stats, pd.DataFrame(
+        {'event_id': stats.event_id, 'performer_id': 1, 'venue_id': 1}
+    ), pd.DataFrame())
+    data.push_to_db(engine, last_values=last_values, heartbeat=heartbeat)
+
+
+def test_only_changed_rows_are_written(engine):
+    last_values = delta.LastValueCache()
+    push(engine, snapshot('2030-01-01 00:00', [10.0, 20.0]), last_values)
+    push(engine, snapshot('2030-01-01 01:00', [10.0, 21.0]), last_values)
+    push(engine, snapshot('2030-01-01 02:00', [10.0, 21.0], counts=(11, 10)), last_values)
+    stored = pd.read_sql_table(db.STAT_TABLE, engine)
+    assert list(zip(stored.event_id, stored.utc_read_time.dt.hour)) == [(1, 0), (2, 0), (2, 1), (1, 2)]
+
+
+def test_cache_is_seeded_from_db(engine):
+    push(engine, snapshot('2030-01-01 00:00', [10.0, 20.0]), delta.LastValueCache())
+    # a new process starts with an empty cache
+    push(engine, snapshot('2030-01-01 01:00', [10.0, 22.0]), delta.LastValueCache())
+    stored = pd.read_sql_table(db.STAT_TABLE, engine)
+    assert len(stored) == 3
+
+
+def test_rows_of_a_failed_write_are_not_suppressed(engine, monkeypatch):
+    last_values = delta.LastValueCache()
+    push(engine, snapshot('2030-01-01 00:00', [10.0]), last_values)
+
+    def fail(df, engine, table_name):
+        raise ConnectionError('lost connection')
+
+    monkeypatch.setitem(db.STAT_WRITERS, 'failing', fail)
+    monkeypatch.setitem(db.DEFAULT_STAT_WRITERS, engine.dialect.name, 'failing')
+    with pytest.raises(ConnectionError):
+        push(engine, snapshot('2030-01-01 01:00', [11.0]), last_values)
+    monkeypatch.undo()
+    push(engine, snapshot('2030-01-01 02:00', [11.0]), last_values)
+    stored = pd.read_sql_table(db.STAT_TABLE, engine)
+    assert list(zip(stored.utc_read_time.dt.hour, stored.average_price)) == [(0, 10.0), (2, 11.0)]
+
+
+def test_heartbeat_writes_unchanged_rows(engine):
+    last_values = delta.LastValueCache()
+    for hour in range(5):
+        push(engine, snapshot(f'2030-01-01 {hour:02d}:00', [10.0]), last_values, pd.Timedelta('2h'))
+    stored = pd.read_sql_table(db.STAT_TABLE, engine)
+    assert list(stored.utc_read_time.dt.hour) == [0, 2, 4]
+
+
+def test_forward_filled_reader(engine):
+    last_values = delta.LastValueCache()
+    push(engine, snapshot('2030-01-01 00:00', [10.0, 20.0]), last_values)
+    push(engine, snapshot('2030-01-01 03:00', [11.0, 20.0]), last_values)
+    query = fetch_data.StatQuery(start='2030-01-01 01:00', end='2030-01-01 05:00')
+    filled = delta.read_forward_filled(engine, query, 'h')
+    event_1 = filled.loc[filled.event_id == 1]
+    assert list(event_1.utc_read_time.dt.hour) == [1, 2, 3, 4]
+    assert list(event_1.average_price) == [10.0, 10.0, 11.0, 11.0]
+    assert list(filled.loc[filled.event_id == 2].average_price) == [20.0] * 4
@@ -4,8 +4,11 @@ import pandas as pd
 from pymongo import MongoClient
 
 import src.fetch_data as fetch_data
+import src.fetch_data.db as db
+import src.fetch_data.delta as delta
 import env
 from src.fetch_data import ForeignKey, SlugReq
+from src.fetch_data.fetch_engine import FetchEngine
 import src.schemas
 
 
@@ -205,4 +208,185 @@ def test_from_watchlist_2(seatgeek_data):
         performer_id=watchlist.performer_id,
         event_id=watchlist.event_id,
     )
-    print('done')
\ No newline at end of file
+    print('done')
+
+
+def test_build_stats_df():
+    """
+    stats keys are extracted into typed columns, events missing a stat are dropped
+    :return:
+    """
+    stats = {
+        'average_price': 100, 'lowest_price': 50, 'highest_price': 200, 'median_price': 90,
+        'listing_count': 10, 'visible_listing_count': 8, 'lowest_sg_base_price': 45,
+    }
+    events = pd.DataFrame(
+        {
+            'id': [1, 2, 3],
+            'stats': [stats, {**stats, 'lowest_price': None}, {**stats, 'average_price': 99.5}],
+        }
+    )
+    stats_df = fetch_data.build_stats_df(events)
+    assert list(stats_df.columns) == [
+        'event_id', 'average_price', 'lowest_price', 'highest_price', 'median_price',
+        'listing_count', 'visible_listing_count', 'utc_read_time',
+    ]
+    assert list(stats_df.event_id) == [1, 3]
+    assert list(stats_df.average_price) == [100, 99.5]
+    assert stats_df.average_price.dtype == 'float64'
+    assert stats_df.listing_count.dtype == 'int64'
+
+
+def test_build_stats_df_keeps_fractional_prices():
+    """
+    prices are written exactly as the apply(pd.Series) implementation wrote them
+    :return:
+    """
+    from benchmarks.bench_build_stats import legacy_build_stats_df
+    prices = [123.45, 19.99, 1e6 + 0.01]
+    events = pd.DataFrame(
+        {
+            'id': [1, 2, 3],
+            'stats': [
+                {
+                    'average_price': p, 'lowest_price': p / 3, 'highest_price': p * 7.1,
+                    'median_price': p + 0.07, 'listing_count': 10, 'visible_listing_count': 8,
+                }
+                for p in prices
+            ],
+        }
+    )
+    current = fetch_data.build_stats_df(events)
+    legacy = legacy_build_stats_df(events)
+    price_columns = fetch_data.table_builders.STAT_PRICE_COLUMNS
+    pd.testing.assert_frame_equal(current[price_columns], legacy[price_columns], check_exact=True)
+    assert list(current.average_price) == prices
+    # apply(pd.Series) made the counts of rows with fractional prices float, the values match
+    count_columns = fetch_data.table_builders.STAT_COUNT_COLUMNS
+    assert (current[count_columns].values == legacy[count_columns].values).all()
+
+
+def test_indexes_are_invalidated_on_reassignment():
+    """
+    lookups are served from cached indexes until a table is reassigned
+    :return:
+    """
+    seatgeek_data = mock_seatgeek_data()
+    query = ForeignKey(fk={'event_id': 2})
+    assert list(seatgeek_data.get_stats_by_id(query).lowest_price) == [2]
+    assert seatgeek_data._indexes
+    seatgeek_data.stat = pd.concat(
+        [seatgeek_data.stat, seatgeek_data.stat.assign(lowest_price=[4, 5, 6])],
+        ignore_index=True,
+    )
+    assert not seatgeek_data._indexes
+    assert list(seatgeek_data.get_stats_by_id(query).lowest_price) == [2, 5]
+    assert list(seatgeek_data.get_performer_stats('Test Performer').event_id) == [1, 2, 3, 1, 2, 3]
+
+
+def test_normalize_performers_matches_explode(stub_client):
+    events = pd.DataFrame(stub_client.events)
+    events['venue_id'] = fetch_data.get_event_venue_ids(events)
+    performers_events, performers = fetch_data.normalize_performers(events)
+    # the explode/apply implementation it replaced
+    exploded = events[['id', 'venue_id', 'performers', 'datetime_utc', 'announce_date', 'visible_at']].explode('performers')
+    exploded = exploded.rename(columns={'id': 'event_id'})
+    exploded['performer_id'] = exploded['performers'].apply(lambda x: x['id'])
+    pd.testing.assert_frame_equal(performers_events, exploded.drop(columns=['performers']))
+    expected = fetch_data.build_df_from_series_of_dicts(events['performers'].explode()).drop_duplicates(subset=['id'])
+    pd.testing.assert_frame_equal(performers, expected, check_index_type=False)
+
+
+def test_watchlist_without_events_builds_empty_tables(stub_client, engine):
+    stub_client.events = []
+    data = fetch_data.SeatgeekData.from_watchlist(stub_client, venue_id=['1001'])
+    assert len(data.event) == len(data.stat) == len(data.performer_event_venue) == 0
+    data.compact().push_to_db(engine, last_values=delta.LastValueCache())
+
+
+def test_from_db_fetches_live_events_only(stub_client, engine):
+    live = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[:4]))
+    pev = live.performer_event_venue.copy()
+    pev.loc[pev.event_id == 1, 'datetime_utc'] = '2000-01-01T20:00:00'
+    db.upsert_performer_event_venue(pev, engine)
+    live.stat.to_sql(db.STAT_TABLE, engine, index=False)
+
+    stub_client.requests.clear()
+    data = fetch_data.SeatgeekData.from_db(
+        engine, stub_client, fetcher=FetchEngine(stub_client, chunk_size=2, per_page=10)
+    )
+    assert sorted(data.event.id) == [2, 3, 4]
+    assert sorted(data.stat.event_id) == [1, 2, 3, 4]
+    assert set(data.performer.id) == set(pev.performer_id)
+    event_requests = [r for r in stub_client.requests if 'id' in r and 'type' not in r]
+    assert all(len(r['id'].split(',')) <= 2 for r in event_requests)
+
+
+def test_compact(stub_client):
+    data = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events))
+    before = data.memory_report()
+    data.compact()
+    after = data.memory_report()
+    assert after.loc['total', 'bytes'] < before.loc['total', 'bytes']
+    assert after.loc['total', 'rows'] == before.loc['total', 'rows']
+    assert not {'performers', 'venue', 'stats'} & set(data.event.columns)
+    assert data.performer_event_venue.event_id.dtype == 'int32'
+    assert data.performer.slug.dtype == 'category'
+    assert str(data.performer_event_venue.datetime_utc.dtype).startswith('datetime64')
+    slug_req = fetch_data.SlugReq(slug={'performer': 'performer-100'})
+    assert len(data.get_stats_by_slug(slug_req)) == 40
+
+
+def test_refresh_appends_only_new_rows(stub_client, engine):
+    first, later = pd.Timestamp('2029-06-01 10:00'), pd.Timestamp('2029-06-01 11:00')
+    held = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[:6]))
+    db.upsert_performer_event_venue(held.performer_event_venue, engine)
+    held.stat.assign(utc_read_time=first).to_sql(db.STAT_TABLE, engine, index=False)
+    data = fetch_data.SeatgeekData.from_db(engine, stub_client, fetcher=FetchEngine(stub_client))
+    slug_req = fetch_data.SlugReq(slug={'performer': 'performer-100'})
+    assert len(data.get_stats_by_slug(slug_req)) == 2
+    indexes = data._indexes
+
+    # a second snapshot of the held events, and events 7 and 8 tracked since
+    new = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[6:8]))
+    db.upsert_performer_event_venue(new.performer_event_venue, engine)
+    pd.concat([held.stat, new.stat]).assign(utc_read_time=later).to_sql(
+        db.STAT_TABLE, engine, index=False, if_exists='append'
+    )
+    stub_client.requests.clear()
+    appended = data.refresh(engine)
+    assert appended == {'event': 2, 'performer': 2, 'stat': 8, 'performer_event_venue': 4, 'venue': 1}
+    # only the new events and performers are fetched
+    assert sorted(int(i) for r in stub_client.requests for i in r['id'].split(',')) == [7, 7, 8, 8]
+    assert not data.stat.duplicated(['event_id', 'utc_read_time']).any()
+    assert sorted(data.event.id) == list(range(1, 9))
+    # indexes are extended in place and match rebuilt ones
+    assert data._indexes is indexes
+    rebuilt = fetch_data.SeatgeekData(data.event, data.performer, data.stat, data.performer_event_venue, data.venue)
+    for req in (slug_req, fetch_data.SlugReq(slug={'performer': 'performer-7'})):
+        pd.testing.assert_frame_equal(data.get_stats_by_slug(req), rebuilt.get_stats_by_slug(req))
+    assert len(data.get_stats_by_slug(slug_req)) == 4
+    assert data.refresh(engine)['stat'] == 0
+
+
+def test_refresh_keeps_the_query_filters(stub_client, engine):
+    first, later = pd.Timestamp('2029-06-01 10:00'), pd.Timestamp('2029-06-01 11:00')
+    held = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[:6]))
+    db.upsert_performer_event_venue(held.performer_event_venue, engine)
+    held.stat.assign(utc_read_time=first).to_sql(db.STAT_TABLE, engine, index=False)
+    query = fetch_data.StatQuery(performer_id=[100])
+    data = fetch_data.SeatgeekData.from_db(engine, stub_client, query, fetcher=FetchEngine(stub_client))
+
+    # event 9 is linked to performer 100 and performer 9
+    new = fetch_data.SeatgeekData.from_events(pd.DataFrame(stub_client.events[8:9]))
+    db.upsert_performer_event_venue(new.performer_event_venue, engine)
+    new.stat.assign(utc_read_time=later).to_sql(db.STAT_TABLE, engine, index=False, if_exists='append')
+    data.refresh(engine)
+
+    fresh = fetch_data.SeatgeekData.from_db(engine, stub_client, query, fetcher=FetchEngine(stub_client))
+    key = ['event_id', 'performer_id']
+    assert sorted(map(tuple, data.performer_event_venue[key].values)) == [(3, 100), (6, 100), (9, 100)]
+    assert sorted(map(tuple, data.performer_event_venue[key].values)) == sorted(
+        map(tuple, fresh.performer_event_venue[key].values)
+    )
+    assert sorted(data.performer.id) == sorted(fresh.performer.id) == [100]
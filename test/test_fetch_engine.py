@@ -0,0 +1,35 @@
+import src.fetch_data as fetch_data
+from src.fetch_data.fetch_engine import FetchEngine, chunk_ids
+
+
+def test_chunk_ids():
+    chunks = chunk_ids(['1', 2, '2', '3', '4'], size=2)
+    assert chunks == [['1', '2'], ['3', '4']]
+    # '100' + '%2C' + '200' fits in 9 chars, a third id does not
+    chunks = chunk_ids(['100', '200', '300'], size=50, max_chars=9)
+    assert chunks == [['100', '200'], ['300']]
+
+
+def test_watchlist_ids_are_chunked_and_paged(stub_client):
+    fetcher = FetchEngine(stub_client, max_workers=4, chunk_size=10, per_page=5)
+    event_ids = [str(i) for i in range(1, 121)]
+    events = fetcher.get_watchlist_events(event_id=event_ids)
+    assert sorted(events.id) == list(range(1, 121))
+    assert all(len(r['id'].split(',')) <= 10 for r in stub_client.requests)
+    # 12 chunks of 10 events, 2 full pages each plus an empty page
+    assert len(stub_client.requests) == 36
+    assert stub_client.max_active > 1
+
+
+def test_from_watchlist_with_stub(stub_client):
+    data = fetch_data.SeatgeekData.from_watchlist(
+        stub_client,
+        venue_id=['1001'],
+        performer_id=['100'],
+        fetcher=FetchEngine(stub_client, chunk_size=1, per_page=20),
+    )
+    pev = data.performer_event_venue
+    assert set(pev.venue_id[pev.venue_id == 1001]) == {1001}
+    assert 100 in pev.performer_id.values
+    assert data.performer.id.is_unique
+    assert set(data.stat.event_id) == set(pev.event_id)
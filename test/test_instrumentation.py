@@ -0,0 +1,44 @@
+import io
+import json
+
+import pandas as pd
+
+import src.fetch_data as fetch_data
+import src.fetch_data.instrumentation as instrumentation
+
+
+def read_lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_build_tables_logs_stages_and_run_summary(stub_client):
+    stream = io.StringIO()
+    instrumentation.configure_logging(stream=stream)
+    events = pd.DataFrame(stub_client.events[:20])
+    with instrumentation.run('build', source='test') as summary:
+        fetch_data.SeatgeekData._build_tables(events, pd.DataFrame())
+    lines = read_lines(stream)
+    stages = {line['stage']: line for line in lines if line['event'] == 'stage'}
+    assert {'stats_extraction', 'venue_normalization', 'performer_explode'} <= set(stages)
+    assert stages['stats_extraction']['rows'] == 20
+    assert stages['venue_normalization']['rows'] == 7
+    run = lines[-1]
+    assert run['event'] == 'run' and run['source'] == 'test'
+    assert set(run['stages']) == set(stages)
+    assert run['counts']['stats_extraction.rows'] == 20
+    assert summary['seconds'] >= sum(run['stages'].values()) - 1e-3
+    assert run['peak_rss_bytes'] is None or run['peak_rss_bytes'] > 0
+
+
+def test_profile_dump_is_controlled_by_env(tmp_path, monkeypatch):
+    stream = io.StringIO()
+    instrumentation.configure_logging(stream=stream)
+    with instrumentation.run('unprofiled'):
+        pass
+    monkeypatch.setenv(instrumentation.PROFILE_ENV, 'cprofile')
+    monkeypatch.setenv(instrumentation.PROFILE_DIR_ENV, str(tmp_path))
+    with instrumentation.run('profiled'):
+        sum(range(1000))
+    dumps = list(tmp_path.glob('*.prof'))
+    assert [p.name.split('-')[0] for p in dumps] == ['profiled']
+    assert [line['path'] for line in read_lines(stream) if line['event'] == 'profile'] == [str(dumps[0])]
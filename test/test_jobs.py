@@ -0,0 +1,65 @@
+import threading
+
+from src.fetch_data.jobs import JobQueue
+
+
+def test_overlapping_triggers_coalesce():
+    release = threading.Event()
+    started = threading.Event()
+    running = []
+    overlap = []
+
+    def run(job):
+        overlap.append(len(running))
+        running.append(job.status.id)
+        job.stage('fetch')
+        started.set()
+        release.wait(5)
+        job.stage('push')
+        running.remove(job.status.id)
+        return {'events': 1}
+
+    jobs = JobQueue(run)
+    first = jobs.submit()
+    assert started.wait(5)
+    # the first job is running, the next two triggers share one queued job
+    second = jobs.submit()
+    third = jobs.submit()
+    assert second.id == third.id != first.id
+    assert jobs.get(first.id).state == 'running'
+    assert jobs.get(first.id).stage == 'fetch'
+    release.set()
+    assert jobs.join(5)
+    assert overlap == [0, 0]
+    status = jobs.get(first.id)
+    assert status.state == 'succeeded'
+    assert status.result == {'events': 1}
+    assert set(status.timings) == {'fetch', 'push'}
+    assert jobs.get(second.id).state == 'succeeded'
+
+
+def test_failed_job_reports_error_and_stage():
+    def run(job):
+        job.stage('fetch')
+        raise RuntimeError('api down')
+
+    jobs = JobQueue(run)
+    job_id = jobs.submit().id
+    assert jobs.join(5)
+    status = jobs.get(job_id)
+    assert status.state == 'failed'
+    assert status.stage == 'fetch'
+    assert status.error == 'RuntimeError: api down'
+    assert status.finished_at is not None
+    assert jobs.get('unknown') is None
+
+
+def test_finished_jobs_are_pruned():
+    jobs = JobQueue(lambda job: None, max_finished=2)
+    ids = []
+    for _ in range(4):
+        ids.append(jobs.submit().id)
+        assert jobs.join(5)
+    ids.append(jobs.submit().id)
+    assert jobs.join(5)
+    assert [jobs.get(i) is not None for i in ids] == [False, False, True, True, True]
@@ -0,0 +1,72 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import src.fetch_data.db as db
+from src.fetch_data import pipeline
+from src.fetch_data.fetch_engine import FetchEngine
+
+
+def test_run_watchlist_writes_each_page(stub_client, engine):
+    """
+    rows of the first page are in the db before the last page is requested,
+    events found through several ids are written once
+    :param stub_client:
+    :param engine:
+    :return:
+    """
+    rows_before_request = []
+    get_events = stub_client.get_events
+
+    def get_events_and_count(params):
+        stored = pd.read_sql_table(db.STAT_TABLE, engine) if db.has_table(engine, db.STAT_TABLE) else []
+        rows_before_request.append(len(stored))
+        return get_events(params)
+
+    stub_client.get_events = get_events_and_count
+    fetcher = FetchEngine(stub_client, chunk_size=2, per_page=10)
+    watchlist = {'venue_id': ['1001', '1002'], 'performer_id': ['100']}
+    summary = pipeline.run_watchlist(fetcher, engine, watchlist, prefetch_pages=0)
+
+    stat = pd.read_sql_table(db.STAT_TABLE, engine)
+    assert stat.event_id.is_unique
+    assert summary['stat'] == len(stat)
+    expected = {e['id'] for e in stub_client.events if e['venue']['id'] in (1001, 1002)}
+    expected |= {e['id'] for e in stub_client.events if 100 in [p['id'] for p in e['performers']]}
+    assert set(stat.event_id) == expected
+    assert rows_before_request[0] == 0
+    assert any(0 < n < len(stat) for n in rows_before_request)
+
+
+def test_prefetch_keeps_order_and_raises():
+    def items():
+        yield 1
+        yield 2
+        raise ValueError('boom')
+
+    consumed = []
+    with pytest.raises(ValueError):
+        for item in pipeline.prefetch(items()):
+            consumed.append(item)
+    assert consumed == [1, 2]
+
+
+def test_prefetch_thread_exits_after_early_break():
+    produced = []
+
+    def items():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    before = set(threading.enumerate())
+    for item in pipeline.prefetch(items()):
+        break
+    threads = set(threading.enumerate()) - before
+    assert threads
+    for thread in threads:
+        thread.join(timeout=5)
+    assert not any(t.is_alive() for t in threads)
+    # the producer stopped instead of draining items
+    assert len(produced) < 100
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+import src.fetch_data as fetch_data
+import src.fetch_data.db as db
+import src.fetch_data.rollup as rollup
+from src.analysis import analysis_scripts
+
+
+def mock_stats(read_times, event_ids=(1, 2), seed=0):
+    """
+    returns one stat row per event per read time with random prices
+    :param read_times:
+    :param event_ids:
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    read_times = pd.to_datetime(read_times)
+    n = len(read_times) * len(event_ids)
+    return pd.DataFrame(
+        {
+            'event_id': np.tile(event_ids, len(read_times)),
+            'average_price': rng.integers(50, 100, n).astype(np.float32),
+            'lowest_price': rng.integers(10, 50, n).astype(np.float32),
+            'highest_price': rng.integers(100, 200, n).astype(np.float32),
+            'median_price': rng.integers(40, 90, n).astype(np.float32),
+            'listing_count': rng.integers(0, 100, n).astype(np.int32),
+            'visible_listing_count': rng.integers(0, 100, n).astype(np.int32),
+            'utc_read_time': np.repeat(read_times, len(event_ids)),
+        }
+    )
+
+
+def test_incremental_rollup_matches_full_rollup(engine):
+    read_times = pd.date_range('2030-01-01 00:10', periods=12, freq='20min')
+    stats = mock_stats(read_times)
+    # written in three runs, the second run covers the same hours as the first
+    for batch in (stats.iloc[:6], stats.iloc[6:14], stats.iloc[14:]):
+        rollup.update_rollups(batch, engine)
+    stored = pd.read_sql_table('stat_hourly', engine).sort_values(rollup.ROLLUP_KEY, ignore_index=True)
+    expected = rollup.compute_rollup(stats, 'h').sort_values(rollup.ROLLUP_KEY, ignore_index=True)
+    assert len(stored) == 8
+    pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+    daily = pd.read_sql_table('stat_daily', engine)
+    assert list(daily.n) == [12, 12]
+    assert list(daily.average_price_open) == list(stats.average_price[:2])
+    assert list(daily.average_price_close) == list(stats.average_price[-2:])
+
+
+def test_update_reads_only_touched_buckets(engine, monkeypatch):
+    history = mock_stats(pd.date_range('2030-01-01', periods=48, freq='h'))
+    rollup.update_rollups(history, engine)
+    read = []
+    read_rows_where_in = db.read_rows_where_in
+
+    def spy(*args, **kwargs):
+        rows = read_rows_where_in(*args, **kwargs)
+        read.append(len(rows))
+        return rows
+
+    monkeypatch.setattr(db, 'read_rows_where_in', spy)
+    rollup.update_rollups(mock_stats(['2030-01-02 23:30'], seed=1), engine)
+    # the last hour of each event, and the last day of each event
+    assert read == [2, 2]
+    stored = pd.read_sql_table('stat_hourly', engine)
+    assert len(stored) == 96
+    assert list(stored.loc[stored.bucket == stored.bucket.max(), 'n']) == [2, 2]
+
+
+def test_push_to_db_updates_rollups(engine):
+    stats = mock_stats(['2030-01-01 10:00'])
+    data = fetch_data.SeatgeekData(pd.DataFrame(), pd.DataFrame(), stats, pd.DataFrame(
+        {'event_id': [1, 2], 'performer_id': [1, 1], 'venue_id': [1, 1]}
+    ), pd.DataFrame())
+    data.push_to_db(engine)
+    assert len(pd.read_sql_table('stat_hourly', engine)) == 2
+
+
+def test_read_stats_at_resolution(engine):
+    stats = mock_stats(pd.date_range('2030-01-01', periods=24 * 10, freq='h'), event_ids=(1,))
+    db.write_stats(stats, engine)
+    rollup.backfill_rollups(engine)
+    pd.DataFrame({'event_id': [1], 'performer_id': [7], 'venue_id': [1]}).to_sql(db.PEV_TABLE, engine)
+
+    assert rollup.choose_resolution(pd.Timestamp('2030-01-01'), pd.Timestamp('2030-01-02')) == 'raw'
+    recent = fetch_data.StatQuery(performer_id=[7], start='2030-01-09')
+    assert len(rollup.read_stats_at_resolution(engine, recent)) == 48
+    everything = rollup.read_stats_at_resolution(engine, fetch_data.StatQuery(performer_id=[7]))
+    assert len(everything) == 240
+    month = fetch_data.StatQuery(performer_id=[7], start='2029-12-01', end='2030-03-01')
+    daily = rollup.read_stats_at_resolution(engine, month)
+    assert len(daily) == 10
+    # rollup reads have the columns of raw reads
+    assert list(daily.columns) == [
+        'event_id', 'lowest_price', 'median_price', 'average_price', 'highest_price',
+        'listing_count', 'visible_listing_count', 'utc_read_time',
+    ]
+    assert set(daily.columns) == set(everything.columns)
+    assert daily.average_price.iloc[0] == stats.average_price.iloc[23]
+    assert daily.highest_price.iloc[0] == stats.highest_price.iloc[:24].max()
+    analysis_scripts._use_non_interactive_backend()
+    analysis_scripts.plot_stats(daily, 'daily', include_highest=True)
+
+
+def test_rollups_built_after_stat_history_are_not_read(engine):
+    stats = mock_stats(pd.date_range('2030-01-01', periods=24 * 10, freq='h'), event_ids=(1,))
+    db.write_stats(stats, engine)
+    # rollups created by the first update after deploy, without a backfill
+    rollup.update_rollups(stats.iloc[-24:], engine)
+    month = fetch_data.StatQuery(event_id=[1], start='2029-12-01', end='2030-03-01')
+    assert len(rollup.read_stats_at_resolution(engine, month)) == 240
+    rollup.backfill_rollups(engine)
+    daily = pd.read_sql_table('stat_daily', engine)
+    assert list(daily.n) == [24] * 10
+    assert len(rollup.read_stats_at_resolution(engine, month)) == 10
+
+
+def test_columns_are_added_to_older_rollup_tables(engine):
+    stats = mock_stats(['2030-01-01 10:00', '2030-01-01 10:30'])
+    older = rollup.compute_rollup(stats.iloc[:2], 'h').drop(columns=['highest_price_max', 'visible_listing_count_max'])
+    older.to_sql('stat_hourly', engine, index=False)
+    rollup.update_rollup(stats.iloc[2:], engine, 'stat_hourly', 'h')
+    stored = pd.read_sql_table('stat_hourly', engine).sort_values('event_id', ignore_index=True)
+    assert list(stored.n) == [2, 2]
+    assert list(stored.highest_price_max) == list(stats.highest_price.iloc[2:])
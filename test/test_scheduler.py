@@ -0,0 +1,134 @@
+import pandas as pd
+
+import src.fetch_data.db as db
+from src.fetch_data.fetch_engine import FetchEngine
+from src.fetch_data.scheduler import DAY, HOUR, PollScheduler, poll_interval
+
+START = pd.Timestamp('2030-01-01', tz='UTC').timestamp()
+
+
+class FakeClock:
+    def __init__(self, now=START):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def starting_in(seconds):
+    return pd.Timestamp(START + seconds, unit='s').isoformat()
+
+
+def id_requests(client):
+    return [r['id'].split(',') for r in client.requests if 'id' in r and r.get('page') == 1]
+
+
+def test_poll_interval():
+    assert poll_interval(100 * DAY) == 24 * HOUR
+    assert poll_interval(3 * DAY) == 2 * HOUR
+    assert poll_interval(3 * DAY, volatility=0.2) == HOUR
+    assert poll_interval(3 * DAY, volatility=0.0) == 4 * HOUR
+    assert poll_interval(HOUR) == 15 * 60
+    # never scheduled past the start of the event
+    assert poll_interval(100 * DAY, volatility=0.0) == 24 * HOUR
+    assert poll_interval(12 * 60) == 12 * 60
+
+
+def test_polls_nearer_events_more_often_and_stops_after_start(stub_client, engine):
+    clock = FakeClock()
+    stub_client.delay = 0
+    offsets = {1: 100 * DAY, 2: 3 * DAY, 3: 2 * HOUR}
+    for event in stub_client.events:
+        event['datetime_utc'] = starting_in(offsets.get(event['id'], 200 * DAY))
+    polls = []
+    scheduler = PollScheduler(
+        engine,
+        FetchEngine(stub_client),
+        clock=clock.time,
+        push=lambda data: polls.extend((clock.now - START, e) for e in data.stat.event_id),
+    )
+    scheduler.track(pd.DataFrame({'event_id': list(offsets), 'datetime_utc': [starting_in(s) for s in offsets.values()]}))
+    scheduler.run(stop=lambda: clock.now >= START + 2 * DAY, sleep=clock.sleep)
+    polls = pd.DataFrame(polls, columns=['at', 'event_id'])
+    gaps = polls.groupby('event_id')['at'].diff().dropna().groupby(polls.event_id)
+    # each event is polled at most one interval apart, nearer events more often.
+    # event 2 moves from the 2 hour to the 1 hour tier once it is 2 days out
+    assert (gaps.max() <= pd.Series({1: 24 * HOUR, 2: 2 * HOUR, 3: 15 * 60})).all()
+    assert gaps.max()[3] == 15 * 60
+    counts = polls.event_id.value_counts()
+    assert counts[3] == 8 and counts[2] > counts[1]
+    # polled until it started, then dropped
+    assert polls.loc[polls.event_id == 3, 'at'].max() < offsets[3]
+    assert 3 not in scheduler.starts
+    assert set(scheduler.starts) == {1, 2}
+    # every event is fetched in one request per poll
+    assert len(id_requests(stub_client)) == polls['at'].nunique()
+
+
+def test_volatile_events_are_polled_sooner(stub_client, engine):
+    clock = FakeClock()
+    stub_client.delay = 0
+    for event in stub_client.events:
+        event['datetime_utc'] = starting_in(10 * DAY)
+    # an event without performers is still returned by the api
+    stub_client.events[2]['performers'] = []
+    pd.DataFrame(
+        {
+            'event_id': [1, 1, 2, 2],
+            'median_price': [100.0, 150.0, 100.0, 100.0],
+            'utc_read_time': [pd.Timestamp(START - HOUR, unit='s')] * 4,
+        }
+    ).to_sql(db.STAT_TABLE, engine, index=False)
+    scheduler = PollScheduler(engine, FetchEngine(stub_client), clock=clock.time, push=lambda data: None)
+    scheduler.track(pd.DataFrame({'event_id': [1, 2, 3], 'datetime_utc': [starting_in(10 * DAY)] * 3}))
+    assert scheduler.poll_once() == {'polled': 3, 'fetched': 3, 'dropped': 0}
+    assert scheduler.intervals == {1: 3 * HOUR, 2: 12 * HOUR, 3: 6 * HOUR}
+
+
+def test_due_events_share_the_fewest_requests(stub_client, engine):
+    clock = FakeClock()
+    stub_client.delay = 0
+    for event in stub_client.events:
+        event['datetime_utc'] = starting_in(10 * DAY)
+    scheduler = PollScheduler(engine, FetchEngine(stub_client, chunk_size=50), clock=clock.time, push=lambda data: None)
+    events = pd.DataFrame({'event_id': range(1, 121), 'datetime_utc': starting_in(10 * DAY)})
+    scheduler.track(events.iloc[:100])
+    clock.sleep(HOUR)
+    scheduler.track(events.iloc[100:])
+    # 100 events are overdue, 20 due now: three chunks of 50, 50 and 20
+    assert scheduler.poll_once()['polled'] == 120
+    assert [len(ids) for ids in id_requests(stub_client)] == [50, 50, 20]
+    # events due within their lookahead top up the chunk of a due event
+    stub_client.requests.clear()
+    clock.sleep(6 * HOUR - 60)
+    scheduler.track(pd.DataFrame({'event_id': [121], 'datetime_utc': [starting_in(10 * DAY)]}))
+    # events the api does not return are dropped
+    assert scheduler.poll_once() == {'polled': 50, 'fetched': 49, 'dropped': 1}
+    assert [len(ids) for ids in id_requests(stub_client)] == [50]
+    assert len(scheduler) == 120
+
+
+def test_run_tracks_events_added_after_startup(stub_client, engine):
+    clock = FakeClock()
+    stub_client.delay = 0
+    for event in stub_client.events:
+        event['datetime_utc'] = starting_in(10 * DAY)
+    polled = []
+    scheduler = PollScheduler(
+        engine, FetchEngine(stub_client), clock=clock.time, push=lambda data: polled.extend(data.stat.event_id)
+    )
+
+    def add_events_later(seconds):
+        clock.sleep(seconds)
+        if clock.now >= START + 90 * 60 and not db.has_table(engine, db.PEV_TABLE):
+            pd.DataFrame(
+                {'event_id': [1, 2], 'performer_id': [1, 1], 'venue_id': [1, 1], 'datetime_utc': starting_in(10 * DAY)}
+            ).to_sql(db.PEV_TABLE, engine, index=False)
+
+    # nothing is tracked at startup, the scheduler keeps running
+    scheduler.run(stop=lambda: clock.now >= START + 3 * HOUR, sleep=add_events_later)
+    assert set(scheduler.starts) == {1, 2}
+    assert sorted(polled) == [1, 2]
@@ -0,0 +1,56 @@
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+import src.fetch_data.connections as connections
+import src.fetch_data.db as db
+from src.fetch_data import sharding
+
+
+def test_partition_and_route_are_stable():
+    watchlist = {'venue_id': [str(i) for i in range(1000, 1007)], 'performer_id': ['1', '2', '2'], 'event_id': None}
+    parts = sharding.partition_watchlist(watchlist, 3)
+    assert parts == sharding.partition_watchlist(watchlist, 3)
+    assert sorted(i for p in parts for i in p['venue_id']) == watchlist['venue_id']
+    assert sorted(i for p in parts for i in p['performer_id']) == ['1', '2']
+    assert all(p['event_id'] == [] for p in parts)
+    # an event discovered by every shard is owned by one
+    frames = [pd.DataFrame({'id': [1, 2, 3], 'shard': s}) for s in range(3)]
+    owned = sharding.route_events(frames, 3)
+    assert sorted(i for f in owned for i in f['id']) == [1, 2, 3]
+    for shard, events in enumerate(owned):
+        assert (sharding.shard_of(events['id'], 3) == shard).all()
+
+
+@pytest.mark.parametrize('shards', [1, 3])
+def test_run_sharded_writes_each_event_once(stub_client, tmp_path, shards):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    stub_client.delay = 0
+    client_factory = functools.partial(type(stub_client), stub_client.events)
+    # venues and performers overlap, so shards discover the same events
+    watchlist = {'venue_id': ['1001', '1002', '1003'], 'performer_id': ['100', '3', '4'], 'event_id': ['7', '8']}
+    try:
+        with ProcessPoolExecutor(max_workers=shards, initializer=connections.reset_after_fork) as executor:
+            metrics, pev = sharding.run_sharded(watchlist, shards, url, client_factory, executor)
+            # unchanged snapshots are not written again, as in the in process update
+            again, _ = sharding.run_sharded(
+                watchlist, shards, url, client_factory, executor, suppress_unchanged=True
+            )
+        stat = pd.read_sql_table(db.STAT_TABLE, connections.get_engine(url))
+    finally:
+        connections.dispose_engines()
+    expected = {
+        e['id'] for e in stub_client.events
+        if e['venue']['id'] in (1001, 1002, 1003)
+        or {100, 3, 4} & {p['id'] for p in e['performers']}
+        or e['id'] in (7, 8)
+    }
+    assert stat.event_id.is_unique
+    assert set(stat.event_id) == expected
+    assert set(pev.event_id) == expected
+    assert metrics['events'] == metrics['stat'] == len(expected) <= metrics['discovered']
+    assert metrics['shards'] == len(metrics['shard_seconds']) <= shards
+    assert metrics['counts']['stats_extraction.rows'] == len(expected)
+    assert again['counts']['db_write.suppressed'] == len(expected)
@@ -0,0 +1,78 @@
+import pandas as pd
+
+import src.fetch_data as fetch_data
+import src.fetch_data.watchlists as watchlists
+from src.schemas.models import WatchListResponse
+
+USER_WATCHLISTS = [
+    WatchListResponse(username='a', venue_id=['1001'], performer_id=['100']),
+    WatchListResponse(username='b', venue_id=['1001'], event_id=['5', '9']),
+    WatchListResponse(username='c', performer_id=['100'], event_id=['9']),
+]
+
+
+def test_merge_dedupes_ids_across_watchlists():
+    merged = watchlists.merge_watchlists(USER_WATCHLISTS)
+    assert merged == {'venue_id': ['1001'], 'performer_id': ['100'], 'event_id': ['5', '9']}
+
+
+def test_fan_out_fetches_each_id_once(stub_client, engine):
+    merged = watchlists.merge_watchlists(USER_WATCHLISTS)
+    data = fetch_data.SeatgeekData.from_watchlist(stub_client, **merged)
+    requested = [r for r in stub_client.requests if r.get('page') == 1]
+    assert len(requested) == 3
+    attribution = watchlists.attribute_events(USER_WATCHLISTS, data.performer_event_venue)
+    by_user = attribution.groupby('username').event_id.apply(set)
+    venue_events = {e for e in range(1, 121) if 1000 + e % 7 == 1001}
+    performer_events = {e for e in range(1, 121) if 100 + e % 3 == 100}
+    assert by_user['a'] == venue_events | performer_events
+    assert by_user['b'] == venue_events | {5, 9}
+    assert by_user['c'] == performer_events | {9}
+    assert set(attribution.loc[attribution.username == 'b', 'matched_by']) == {'venue_id', 'event_id'}
+
+    assert watchlists.push_attribution(attribution, engine)['inserted'] == len(attribution)
+    assert watchlists.push_attribution(attribution, engine)['inserted'] == 0
+    stored = pd.read_sql_table(watchlists.WATCHLIST_EVENT_TABLE, engine)
+    assert len(stored) == len(attribution)
+
+
+class WatchlistCollection:
+    """runs the stages of watchlists.LATEST_WATCHLIST_PIPELINE on documents"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def aggregate(self, pipeline):
+        documents = list(self.documents)
+        for step in pipeline:
+            (name, spec), = step.items()
+            if name == '$sort':
+                (field, order), = spec.items()
+                documents.sort(key=lambda d: d[field], reverse=order < 0)
+            elif name == '$group':
+                grouped = {}
+                for document in documents:
+                    grouped.setdefault(document[spec['_id'][1:]], {'document': document})
+                documents = list(grouped.values())
+            elif name == '$replaceRoot':
+                documents = [d[spec['newRoot'][1:]] for d in documents]
+            elif name == '$match':
+                documents = [d for d in documents if d.get('active') is not False]
+        return iter(documents)
+
+
+def test_read_latest_watchlist_of_each_user():
+    collection = WatchlistCollection([
+        {'_id': 1, 'username': 'a', 'venue_id': [1001], 'performer_id': [100]},
+        {'_id': 2, 'username': 'b', 'event_id': [5]},
+        {'_id': 3, 'username': 'a', 'venue_id': [1002]},
+        {'_id': 4, 'username': 'c', 'event_id': [9]},
+        {'_id': 5, 'username': 'c', 'event_id': [9], 'active': False},
+    ])
+    latest = watchlists.read_latest_watchlists(collection)
+    # a dropped venue 1001 and performer 100, c's latest watchlist is inactive
+    assert [(w.username, w.venue_id, w.performer_id, w.event_id) for w in latest] == [
+        ('a', ['1002'], None, None),
+        ('b', None, None, ['5']),
+    ]
+    assert watchlists.merge_watchlists(latest) == {'venue_id': ['1002'], 'performer_id': [], 'event_id': ['5']}